@@ -0,0 +1,75 @@
+"""Show the AIMD Ollama concurrency limit converging on two simulated node sizes.
+
+The mock runs a throughput curve: up to PARALLEL_CAPACITY generations each
+stream at full speed, beyond that they share the node. Many clients keep
+the queue full; the limit should climb from the configured start and
+settle where per-stream speed meets OLLAMA_TARGET_TOKENS_PER_SECOND, i.e.
+higher on the bigger node. A fixed limit of OLLAMA_MAX_CONCURRENCY is run
+for comparison.
+
+Run from the repository root:  python benchmarks/bench_adaptive_concurrency.py
+"""
+import asyncio
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+import mock_ollama
+from mock_ollama import run_in_thread
+
+logging.getLogger().setLevel(logging.WARNING)
+
+CLIENTS = 60
+SECONDS = 15
+STREAM_TPS = 100.0
+TARGET_TPS = 60.0
+NODES = [("8-core node", 4), ("32-core node", 16)]
+MESSAGES = [{"role": "user", "content": "How long is a normal cycle?"}]
+
+
+async def client(queue, stop, counts):
+    while not stop.is_set():
+        ticket = queue.try_acquire()
+        if ticket is None:
+            await asyncio.sleep(0.01)
+            continue
+        async for item in server.queued_ollama_response(ticket, MESSAGES):
+            if isinstance(item, str):
+                counts["tokens"] += 1
+
+
+async def run(limiter):
+    queue = server.AdmissionQueue("bench", server.OLLAMA_MAX_CONCURRENCY, CLIENTS, limiter=limiter)
+    stop = asyncio.Event()
+    counts = {"tokens": 0}
+    clients = [asyncio.ensure_future(client(queue, stop, counts)) for _ in range(CLIENTS)]
+    timeline = []
+    for _ in range(SECONDS):
+        await asyncio.sleep(1)
+        timeline.append(queue.concurrency)
+    stop.set()
+    await asyncio.gather(*clients)
+    return timeline, counts["tokens"] / SECONDS
+
+
+async def main():
+    server.OLLAMA_API_URL = run_in_thread()
+    mock_ollama.TOKENS_PER_REPLY = 20
+    mock_ollama.STREAM_TOKENS_PER_SECOND = STREAM_TPS
+    for name, capacity in NODES:
+        mock_ollama.PARALLEL_CAPACITY = capacity
+        limiter = server.AIMDLimiter(server.OLLAMA_MAX_CONCURRENCY, 1, 64, TARGET_TPS, server.OLLAMA_TARGET_TTFT)
+        timeline, adaptive_tps = await run(limiter)
+        _, fixed_tps = await run(None)
+        ideal = int(capacity * STREAM_TPS / TARGET_TPS)
+        print(f"{name} (full speed up to {capacity} streams, target reached at <= {ideal}):")
+        print(f"  limit per second: {timeline}")
+        print(f"  adaptive: {adaptive_tps:7.1f} tokens/s   fixed limit {server.OLLAMA_MAX_CONCURRENCY}: {fixed_tps:7.1f} tokens/s")
+    await server.get_upstream_client("ollama").aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""Measure /api/chat payload bytes before and after ChatRequest normalisation.
+
+Histories are built the way the chat UI sends them: the canned welcome
+message first, then turns carrying the UI's id and timestamp fields. "before"
+is the Ollama payload with messages forwarded verbatim, as the endpoint used
+to; "after" is what goes upstream now (role and content only, no welcome
+message). Also reports the cost of validating a body.
+
+Run from the repository root:  python benchmarks/bench_chat_payload.py
+"""
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+
+logging.getLogger().setLevel(logging.WARNING)
+
+TURNS = [2, 10, 40]
+ITERATIONS = 2000
+WELCOME = "Hello! I'm your healthcare assistant. How can I help you today? Feel free to ask about periods, fertility or symptoms."
+
+
+def ui_history(turns):
+    start = datetime(2024, 3, 1, 9, 0)
+    messages = [{"id": "welcome-message", "role": "assistant", "content": WELCOME, "timestamp": start.isoformat() + "Z"}]
+    for i in range(turns):
+        stamp = (start + timedelta(minutes=i)).isoformat() + "Z"
+        messages.append({"id": str(1709283600000 + 2 * i), "role": "user",
+                         "content": "My cycle was 34 days this month, is that normal?", "timestamp": stamp})
+        messages.append({"id": str(1709283600001 + 2 * i), "role": "assistant",
+                         "content": "Cycles between 21 and 35 days are considered normal for adults. " * 3, "timestamp": stamp})
+    return messages
+
+
+def ollama_payload(messages):
+    return json.dumps({"model": server.OLLAMA_MODEL, "messages": messages, "stream": True,
+                       "options": {"temperature": 0.7, "num_predict": 2000}}).encode()
+
+
+def main():
+    system = server.system_prefix(None, server.PROMPT_DEFAULT_PERSONA)
+    print(f"{'turns':>5s} {'client body':>12s} {'upstream before':>16s} {'upstream after':>15s} {'saved':>6s} {'validate':>10s}")
+    for turns in TURNS:
+        history = ui_history(turns)
+        body = json.dumps({"messages": history, "model_type": "ollama", "language": "en",
+                           "temperature": 0.7, "max_tokens": 2000}).encode()
+        before = ollama_payload([system] + history)
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            request = server.ChatRequest.model_validate_json(body)
+        validate_us = (time.perf_counter() - start) / ITERATIONS * 1e6
+        after = ollama_payload(server.assemble_prompt([m.model_dump() for m in request.messages]))
+        saved = 1 - len(after) / len(before)
+        print(f"{turns:5d} {len(body):12d} {len(before):16d} {len(after):15d} {saved:6.1%} {validate_us:8.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Compare plain fair queueing with model-affinity scheduling across two local models.
+
+Users alternate between two models on a node that holds one model at a
+time and runs one generation at once, so every change of model in the
+grant order costs a swap. Reports swaps, time lost to them and the total
+time to drain the same burst of requests.
+
+Run from the repository root:  python benchmarks/bench_model_affinity.py
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+import mock_ollama
+from mock_ollama import run_in_thread
+
+logging.getLogger().setLevel(logging.WARNING)
+
+USERS = 8
+REQUESTS_PER_USER = 6
+MODELS = ["llama3.2", "qwen2.5"]
+MESSAGES = [{"role": "user", "content": "What helps with cramps?"}]
+
+
+async def chat(queue, user, model):
+    ticket = queue.try_acquire(user, 1.0, None, model)
+    async for _ in server.queued_ollama_response(ticket, MESSAGES, model=model):
+        pass
+
+
+async def run(affinity):
+    residency = server.ModelResidency(0.5)
+    poller = asyncio.ensure_future(residency.run_forever())
+    queue = server.AdmissionQueue("bench", 1, USERS * REQUESTS_PER_USER,
+                                  residency=residency if affinity else None,
+                                  affinity_window=server.OLLAMA_AFFINITY_WINDOW, max_bypass=server.OLLAMA_AFFINITY_MAX_BYPASS)
+    server.metrics.clear()
+    swaps_before = mock_ollama.swaps
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        chat(queue, f"user{u}", MODELS[(u + r) % len(MODELS)])
+        for r in range(REQUESTS_PER_USER) for u in range(USERS)
+    ))
+    elapsed = time.perf_counter() - start
+    poller.cancel()
+    return mock_ollama.swaps - swaps_before, elapsed
+
+
+async def main():
+    server.OLLAMA_API_URL = run_in_thread()
+    mock_ollama.TOKENS_PER_REPLY = 10
+    mock_ollama.TOKEN_DELAY = 0.005
+    mock_ollama.SWAP_SECONDS = 0.3
+    requests = USERS * REQUESTS_PER_USER
+    for name, affinity in (("fair queueing only", False), ("with model affinity", True)):
+        swaps, elapsed = await run(affinity)
+        print(f"{name:20s} {requests} requests  swaps {swaps:3d}  lost to swaps {swaps * mock_ollama.SWAP_SECONDS:5.1f} s  total {elapsed:5.1f} s")
+    await server.get_upstream_client("ollama").aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
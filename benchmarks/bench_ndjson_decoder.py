@@ -0,0 +1,76 @@
+"""Compare the old per-chunk json.loads loop with NDJSONDecoder.
+
+A large NDJSON stream (including multi-byte characters) is cut into
+randomly sized fragments, as an upstream socket would deliver it under load.
+Reports throughput and how many of the objects each approach recovers.
+
+Run from the repository root:  python benchmarks/bench_ndjson_decoder.py
+"""
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import NDJSONDecoder
+
+logging.getLogger().setLevel(logging.ERROR)
+
+OBJECTS = 200_000
+WORDS = ["cramps ", "période ", "月经 ", "دورة ", "मासिक ", "normal "]
+
+
+def build_stream():
+    lines = []
+    for i in range(OBJECTS):
+        obj = {"model": "llama3.2", "message": {"role": "assistant", "content": WORDS[i % len(WORDS)]}, "done": False}
+        lines.append(json.dumps(obj, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def fragment(data, rng):
+    chunks = []
+    pos = 0
+    while pos < len(data):
+        size = rng.randint(1, 300)
+        chunks.append(data[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def old_loop(chunks):
+    recovered = 0
+    for chunk in chunks:
+        try:
+            json.loads(chunk)
+            recovered += 1
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+    return recovered
+
+
+def new_decoder(chunks):
+    decoder = NDJSONDecoder()
+    recovered = 0
+    for chunk in chunks:
+        recovered += len(decoder.feed(chunk))
+    recovered += len(decoder.flush())
+    return recovered
+
+
+def main():
+    data = build_stream()
+    chunks = fragment(data, random.Random(42))
+    print(f"{OBJECTS} objects, {len(data) / 1e6:.1f} MB in {len(chunks)} fragments")
+    for name, fn in (("per-chunk json.loads", old_loop), ("NDJSONDecoder", new_decoder)):
+        start = time.perf_counter()
+        recovered = fn(chunks)
+        elapsed = time.perf_counter() - start
+        print(f"{name:22s} {elapsed:.3f} s  {len(data) / elapsed / 1e6:7.1f} MB/s  recovered {recovered}/{OBJECTS}")
+
+
+if __name__ == "__main__":
+    main()
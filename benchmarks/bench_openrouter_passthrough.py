@@ -0,0 +1,94 @@
+"""Compare server CPU per token for OpenRouter streams: parsing vs pass-through.
+
+An OpenRouter-style SSE stream (full chunk objects, some multi-byte text) is
+served by an in-process httpx transport, either one event per read (how
+tokens trickle in live) or in 4 KB reads (a burst, e.g. after a stall). Each
+path runs up to the bytes /api/chat would send: sse_frames() over
+stream_openrouter_response() (json.loads + json.dumps per token) and over
+stream_openrouter_passthrough() (relayed events). "transport only" just
+reads the body and is the floor both share. Pass-through trades CPU for
+bandwidth: the client gets OpenRouter's full chunk objects.
+
+Run from the repository root:  python benchmarks/bench_openrouter_passthrough.py
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import server
+
+logging.getLogger().setLevel(logging.WARNING)
+
+TOKENS = 20_000
+WORDS = ["Cramps ", "are ", "common ", "during ", "période ", "月经 ", "and ", "usually ", "normal. "]
+
+
+def build_stream():
+    events = []
+    for i in range(TOKENS):
+        chunk = {"id": "gen-1760000000-abcdefghijklmnop", "provider": "Chutes", "model": server.OPENROUTER_MODEL,
+                 "object": "chat.completion.chunk", "created": 1760000000,
+                 "choices": [{"index": 0, "delta": {"role": "assistant", "content": WORDS[i % len(WORDS)]},
+                              "finish_reason": None, "native_finish_reason": None, "logprobs": None}]}
+        events.append(f"data: {json.dumps(chunk, separators=(',', ':'), ensure_ascii=False)}\n\n".encode("utf-8"))
+    events.append(b"data: [DONE]\n\n")
+    return events
+
+
+def reads(events, size):
+    if size is None:
+        return events
+    data = b"".join(events)
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def use_upstream(chunks):
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body()))
+    server.upstream_clients["openrouter"] = httpx.AsyncClient(transport=transport)
+
+
+async def transport_only():
+    async with server.open_openrouter_stream([], 0.7, 2000) as response:
+        async for _ in response.aiter_text():
+            yield "x"
+
+
+async def run(make_stream, chunks):
+    use_upstream(chunks)
+    sent = 0
+    start = time.process_time()
+    async for frame in server.sse_frames(make_stream()):
+        sent += len(frame.encode("utf-8"))
+    return time.process_time() - start, sent
+
+
+async def main():
+    events = build_stream()
+    paths = (
+        ("transport only", transport_only),
+        ("parse + re-encode", lambda: server.stream_openrouter_response([])),
+        ("pass-through", lambda: server.stream_openrouter_passthrough([])),
+    )
+    print(f"{TOKENS} tokens, {sum(map(len, events)) / 1e6:.1f} MB upstream")
+    for label, size in (("one event per read", None), ("4 KB reads", 4096)):
+        chunks = reads(events, size)
+        print(f"\n{label} ({len(chunks)} reads)")
+        for name, make_stream in paths:
+            cpu, sent = min([await run(make_stream, chunks) for _ in range(3)])
+            sent = "" if make_stream is transport_only else f"{sent / TOKENS:6.1f} bytes/token sent"
+            print(f"  {name:18s} {cpu / TOKENS * 1e6:6.2f} us/token  {sent}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""Prompt-eval time per conversation: old prompt layout vs. the stable system prefix.
+
+Before: no system message, the language instruction wrapped around the
+newest user message, and the history trimmed one message at a time, so the
+prompt prefix changes every turn. After: assemble_prompt's byte-identical
+system prefix and block-wise trimming. Sums Ollama's prompt_eval_duration
+over a multi-turn conversation.
+
+Uses the mock (which models a single-slot prompt cache) unless
+BENCH_OLLAMA_URL points at a real Ollama.
+
+Run from the repository root:  python benchmarks/bench_prompt_prefix.py
+"""
+import asyncio
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+from mock_ollama import run_in_thread
+
+logging.getLogger().setLevel(logging.WARNING)
+
+TURNS = 16
+LANGUAGE = "hindi"
+CONTEXT_TOKENS = 600
+QUESTIONS = [
+    "My cycle has been 35 days for the last three months, is that normal?",
+    "I also get cramps on the first two days, what can help?",
+    "Does stress change cycle length?",
+    "When should I see a gynecologist about this?",
+]
+
+
+def legacy_prompt(history, question):
+    # Language instruction inside the newest user message, as the old route did
+    wrapped = f"Please respond in {LANGUAGE} language. User's message: {question}"
+    return history + [{"role": "user", "content": wrapped}]
+
+
+def stable_prompt(history, question):
+    return server.assemble_prompt(history + [{"role": "user", "content": question}], LANGUAGE)
+
+
+async def run(build, block):
+    manager = server.ContextManager(CONTEXT_TOKENS, 2, 0, 10, block=block)
+    history = []
+    eval_ns = 0
+    eval_tokens = 0
+    for turn in range(TURNS):
+        question = QUESTIONS[turn % len(QUESTIONS)]
+        messages, _, _ = manager.fit(build(history, question))
+        stats = {}
+        answer = "".join([t async for t in server.stream_ollama_response(messages, stats=stats)])
+        eval_ns += stats.get("prompt_eval_duration", 0)
+        eval_tokens += stats.get("prompt_eval_count", 0)
+        history += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+    return eval_ns / 1e6, eval_tokens
+
+
+async def main():
+    server.OLLAMA_API_URL = os.getenv("BENCH_OLLAMA_URL") or run_in_thread()
+    before_ms, before_tokens = await run(legacy_prompt, block=1)
+    after_ms, after_tokens = await run(stable_prompt, block=server.CONTEXT_TRIM_BLOCK)
+    await server.get_upstream_client("ollama").aclose()
+    print(f"{TURNS} turns against {server.OLLAMA_API_URL}")
+    print(f"before: {before_ms:8.1f} ms prompt eval, {before_tokens:6d} prompt tokens evaluated")
+    print(f"after:  {after_ms:8.1f} ms prompt eval, {after_tokens:6d} prompt tokens evaluated")
+    print(f"prompt eval reduced {before_ms / max(after_ms, 1e-9):.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
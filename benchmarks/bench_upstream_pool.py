@@ -0,0 +1,52 @@
+"""Compare a fresh httpx client per call against the pooled upstream client.
+
+Run from the repository root:  python benchmarks/bench_upstream_pool.py
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import server
+from mock_ollama import run_in_thread
+
+logging.getLogger().setLevel(logging.WARNING)
+
+ITERATIONS = 500
+
+
+async def fresh_client(url):
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        async with httpx.AsyncClient() as client:
+            await client.get(url)
+    return time.perf_counter() - start
+
+
+async def pooled_client(url):
+    client = server.get_upstream_client("ollama")
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        await client.get(url)
+    elapsed = time.perf_counter() - start
+    await client.aclose()
+    return elapsed
+
+
+async def main():
+    base_url = run_in_thread()
+    url = f"{base_url}/api/version"
+    fresh = await fresh_client(url)
+    pooled = await pooled_client(url)
+    print(f"fresh client per call: {fresh / ITERATIONS * 1000:.3f} ms/request")
+    print(f"pooled client:         {pooled / ITERATIONS * 1000:.3f} ms/request")
+    print(f"speedup:               {fresh / pooled:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,212 @@
+"""Compare /api/chat (SSE) with /ws/chat for 1k concurrent users, over real sockets.
+
+The app runs under uvicorn in a child process (with the mock Ollama in
+another), and this process drives USERS concurrent clients against it:
+
+  SSE        one browser-like HTTP/1.1 client per user (keep-alive, up to
+             6 connections) that streams its answers from POST /api/chat
+             while polling GET /api/ollama-status
+  WebSocket  one /ws/chat socket per user carrying the same answers and
+             {"op": "status"} polls
+
+The server process counts the TCP connections it accepted, the peak it
+held open at once and the bytes it wrote to them, and reports its CPU
+time, so every number below is measured on the server side.
+
+Run from the repository root:  python benchmarks/bench_ws_vs_sse.py
+(needs the `websockets` package from requirements.txt)
+"""
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import httpx
+import websockets
+
+USERS = 1000
+CHATS_PER_USER = 2
+TOKENS = 50
+TOKEN_DELAY = 0.02
+STATUS_POLL_SECONDS = 1.0
+APP_PORT = 8765
+MOCK_PORT = 11435
+APP_URL = f"http://127.0.0.1:{APP_PORT}"
+
+
+def serve():
+    """Child process: the app under uvicorn, with connection and byte counters."""
+    os.environ.update({
+        "UPSTREAM_MAX_CONNECTIONS": str(USERS),
+        "OLLAMA_MAX_CONCURRENCY": str(USERS),
+        "OLLAMA_MAX_QUEUE_DEPTH": str(USERS),
+        "CHAT_CACHE_ENABLED": "false",
+    })
+    import uvicorn
+    from uvicorn.protocols.http.h11_impl import H11Protocol
+
+    import server
+
+    logging.getLogger().setLevel(logging.WARNING)
+    server.OLLAMA_API_URL = f"http://127.0.0.1:{MOCK_PORT}"
+    server.ollama_queue = server.AdmissionQueue("bench", USERS, USERS)
+    counters = Counter()
+    started = [time.process_time()]
+
+    class CountingTransport:
+        """Counts what the server writes; a WebSocket upgrade keeps using it."""
+
+        def __init__(self, transport):
+            self._transport = transport
+
+        def write(self, data):
+            counters["bytes_out"] += len(data)
+            self._transport.write(data)
+
+        def writelines(self, chunks):
+            for chunk in chunks:
+                self.write(chunk)
+
+        def __getattr__(self, name):
+            return getattr(self._transport, name)
+
+    class CountingH11Protocol(H11Protocol):
+        def connection_made(self, transport):
+            counters["accepted"] += 1
+            super().connection_made(CountingTransport(transport))
+
+    @server.app.post("/bench/reset")
+    async def reset():
+        counters.clear()
+        started[0] = time.process_time()
+        return {}
+
+    @server.app.get("/bench/counters")
+    async def read_counters():
+        return dict(counters, cpu=time.process_time() - started[0])
+
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=APP_PORT, http=CountingH11Protocol,
+                            ws="websockets", log_level="warning", backlog=4096)
+    app_server = uvicorn.Server(config)
+
+    async def sample_open_connections():
+        # uvicorn tracks live HTTP and WebSocket protocols; an upgrade moves a connection across
+        while True:
+            counters["peak_open"] = max(counters["peak_open"], len(app_server.server_state.connections))
+            await asyncio.sleep(0.05)
+
+    async def main():
+        sampler = asyncio.ensure_future(sample_open_connections())
+        await app_server.serve()
+        sampler.cancel()
+
+    asyncio.run(main())
+
+
+def start_processes():
+    mock = subprocess.Popen([sys.executable, "-c", (
+        "import mock_ollama, uvicorn\n"
+        f"mock_ollama.TOKENS_PER_REPLY = {TOKENS}\n"
+        f"mock_ollama.TOKEN_DELAY = {TOKEN_DELAY}\n"
+        f"uvicorn.run(mock_ollama.app, host='127.0.0.1', port={MOCK_PORT}, log_level='warning', backlog=4096)\n"
+    )], cwd=BENCH_DIR)
+    app = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve"])
+    for url in (f"http://127.0.0.1:{MOCK_PORT}/api/version", f"{APP_URL}/health"):
+        for _ in range(200):
+            try:
+                httpx.get(url)
+                break
+            except httpx.TransportError:
+                time.sleep(0.05)
+    return mock, app
+
+
+def messages(user, turn):
+    # Distinct prompts, so singleflight doesn't merge users
+    return [{"role": "user", "content": f"user {user} turn {turn}"}]
+
+
+async def poll_status(poll):
+    while True:
+        await asyncio.sleep(STATUS_POLL_SECONDS)
+        await poll()
+
+
+async def sse_user(user, received):
+    # A browser keeps up to 6 HTTP/1.1 connections per host
+    limits = httpx.Limits(max_connections=6, max_keepalive_connections=6)
+    async with httpx.AsyncClient(base_url=APP_URL, limits=limits, timeout=120) as client:
+        poller = asyncio.ensure_future(poll_status(lambda: client.get("/api/ollama-status")))
+        try:
+            for turn in range(CHATS_PER_USER):
+                async with client.stream("POST", "/api/chat", json={"messages": messages(user, turn)}) as response:
+                    async for line in response.aiter_lines():
+                        if line.startswith('data: {"text"'):
+                            received["tokens"] += 1
+        finally:
+            poller.cancel()
+
+
+async def ws_user(user, received):
+    async with websockets.connect(f"ws://127.0.0.1:{APP_PORT}/ws/chat", open_timeout=120, max_queue=None) as socket:
+        poller = asyncio.ensure_future(poll_status(lambda: socket.send('{"op":"status"}')))
+        try:
+            for turn in range(CHATS_PER_USER):
+                await socket.send(json.dumps({"op": "chat", "c": turn, "messages": messages(user, turn)}))
+                while True:
+                    frame = json.loads(await socket.recv())
+                    if frame.get("c") != turn:
+                        continue
+                    if "t" in frame:
+                        received["tokens"] += 1
+                    elif frame.get("d"):
+                        break
+        finally:
+            poller.cancel()
+
+
+async def measure(control, user_fn):
+    await control.post("/bench/reset")
+    received = Counter()
+    wall = time.perf_counter()
+    results = await asyncio.gather(*(user_fn(u, received) for u in range(USERS)), return_exceptions=True)
+    wall = time.perf_counter() - wall
+    counters = (await control.get("/bench/counters")).json()
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    return counters, received["tokens"], failed, wall
+
+
+async def main():
+    logging.getLogger().setLevel(logging.WARNING)
+    mock, app = start_processes()
+    try:
+        expected = USERS * CHATS_PER_USER * TOKENS
+        print(f"{USERS} users x {CHATS_PER_USER} answers x {TOKENS} tokens, status poll every {STATUS_POLL_SECONDS:g} s")
+        print(f"{'transport':10s} {'accepted':>9s} {'peak open':>10s} {'bytes/token':>12s} {'cpu us/token':>13s} {'tokens':>8s} {'failed':>7s} {'wall s':>7s}")
+        async with httpx.AsyncClient(base_url=APP_URL, timeout=60) as control:
+            await control.get("/health")
+            for name, user_fn in (("SSE", sse_user), ("WebSocket", ws_user)):
+                counters, tokens, failed, wall = await measure(control, user_fn)
+                print(f"{name:10s} {counters.get('accepted', 0):9d} {counters.get('peak_open', 0):10d} "
+                      f"{counters.get('bytes_out', 0) / expected:12.1f} {counters['cpu'] / expected * 1e6:13.1f} "
+                      f"{tokens:8d} {failed:7d} {wall:7.1f}")
+        print("(bytes include HTTP headers, status replies and WebSocket handshakes; CPU is the app process only)")
+    finally:
+        app.terminate()
+        mock.terminate()
+        app.wait()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["serve"]:
+        serve()
+    else:
+        asyncio.run(main())
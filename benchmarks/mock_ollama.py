@@ -0,0 +1,181 @@
+"""Minimal stand-in for the Ollama HTTP API, used by the benchmarks.
+
+Serves /api/version, /api/tags, /api/embeddings and streaming NDJSON
+/api/generate and /api/chat so server.py can be exercised without a real
+model.
+
+Prompt caching is modelled like Ollama's single-slot KV cache: only the part
+of the rendered prompt after the prefix shared with the previous request is
+counted in prompt_eval_count / prompt_eval_duration.
+
+With PARALLEL_CAPACITY set, /api/chat follows a throughput curve instead of
+TOKEN_DELAY: up to that many generations each stream at
+STREAM_TOKENS_PER_SECOND, beyond it they share the node's throughput, and
+the time to first token grows the same way.
+
+One model fits in memory at a time: a /api/chat request for a different
+model than the loaded one waits SWAP_SECONDS first (reported as
+load_duration), and /api/ps lists the loaded model.
+"""
+import asyncio
+import json
+import threading
+import time
+
+import uvicorn
+
+TOKENS_PER_REPLY = 50
+TOKEN_DELAY = 0.0
+PROMPT_EVAL_NS_PER_TOKEN = 2_000_000
+
+PARALLEL_CAPACITY = 0
+STREAM_TOKENS_PER_SECOND = 100.0
+PROMPT_SECONDS = 0.05
+active_generations = 0
+
+SWAP_SECONDS = 0.0
+loaded_model = None
+swaps = 0
+
+
+def contention():
+    """How much slower each generation runs with the current number in flight."""
+    return max(1.0, active_generations / PARALLEL_CAPACITY)
+
+
+# Rendered prompt of the previous /api/chat request (the simulated KV cache)
+last_prompt = ""
+
+
+def prompt_eval_tokens(messages):
+    """Tokens to evaluate for `messages`, reusing the prefix shared with the last prompt."""
+    global last_prompt
+    prompt = "".join(f"<|{m.get('role')}|>{m.get('content')}" for m in messages)
+    shared = 0
+    for a, b in zip(prompt, last_prompt):
+        if a != b:
+            break
+        shared += 1
+    last_prompt = prompt
+    return max(1, (len(prompt) - shared + 3) // 4)
+
+
+async def app(scope, receive, send):
+    global active_generations, loaded_model, swaps
+    if scope["type"] != "http":
+        return
+    path = scope["path"]
+
+    # Read the request body
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+    if path == "/api/version":
+        body = json.dumps({"version": "mock"}).encode()
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    if path == "/api/tags":
+        body = json.dumps({"models": [{"name": "llama3.2:latest"}]}).encode()
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    if path == "/api/ps":
+        models = [{"name": loaded_model, "model": loaded_model}] if loaded_model else []
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps({"models": models}).encode()})
+        return
+
+    if path == "/api/embeddings":
+        # Letter-frequency vector: crude, but paraphrases with the same words score high
+        prompt = json.loads(body).get("prompt", "").lower()
+        vector = [float(prompt.count(c)) for c in "abcdefghijklmnopqrstuvwxyz"]
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps({"embedding": vector}).encode()})
+        return
+
+    if path == "/api/generate":
+        request = json.loads(body)
+        if not request.get("prompt"):
+            # Preload: no prompt just loads the model
+            body = json.dumps({"model": request.get("model"), "done": True, "load_duration": 0}).encode()
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        # Only the new prompt is evaluated; the returned context grows by prompt + reply
+        prompt_tokens = max(1, (len(request.get("system", "")) + len(request["prompt"]) + 3) // 4)
+        context = request.get("context", []) + list(range(prompt_tokens + TOKENS_PER_REPLY))
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson")]})
+        for i in range(TOKENS_PER_REPLY):
+            if TOKEN_DELAY:
+                await asyncio.sleep(TOKEN_DELAY)
+            line = json.dumps({"response": f"tok{i} ", "done": False})
+            await send({"type": "http.response.body", "body": (line + "\n").encode(), "more_body": True})
+        final = json.dumps({"response": "", "done": True, "context": context,
+                            "eval_count": TOKENS_PER_REPLY, "eval_duration": 1_000_000_000,
+                            "prompt_eval_count": prompt_tokens,
+                            "prompt_eval_duration": prompt_tokens * PROMPT_EVAL_NS_PER_TOKEN})
+        await send({"type": "http.response.body", "body": (final + "\n").encode()})
+        return
+
+    if path == "/api/chat":
+        request = json.loads(body)
+        prompt_tokens = prompt_eval_tokens(request.get("messages", []))
+        load_ns = 0
+        model = request.get("model", "")
+        if ":" not in model:
+            model += ":latest"
+        if model != loaded_model:
+            if loaded_model is not None:
+                swaps += 1
+            loaded_model = model
+            if SWAP_SECONDS:
+                await asyncio.sleep(SWAP_SECONDS)
+                load_ns = int(SWAP_SECONDS * 1e9)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson")]})
+        active_generations += 1
+        try:
+            if PARALLEL_CAPACITY:
+                await asyncio.sleep(PROMPT_SECONDS * contention())
+            for i in range(TOKENS_PER_REPLY):
+                if PARALLEL_CAPACITY:
+                    await asyncio.sleep(contention() / STREAM_TOKENS_PER_SECOND)
+                elif TOKEN_DELAY:
+                    await asyncio.sleep(TOKEN_DELAY)
+                line = json.dumps({"message": {"role": "assistant", "content": f"tok{i} "}, "done": False})
+                await send({"type": "http.response.body", "body": (line + "\n").encode(), "more_body": True})
+        finally:
+            active_generations -= 1
+        final = json.dumps({"message": {"role": "assistant", "content": ""}, "done": True,
+                            "load_duration": load_ns, "eval_count": TOKENS_PER_REPLY, "eval_duration": 1_000_000_000,
+                            "prompt_eval_count": prompt_tokens,
+                            "prompt_eval_duration": prompt_tokens * PROMPT_EVAL_NS_PER_TOKEN})
+        await send({"type": "http.response.body", "body": (final + "\n").encode()})
+        return
+
+    await send({"type": "http.response.start", "status": 404, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def run_in_thread(port=11435):
+    """Start the mock server in a daemon thread and return its base URL."""
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
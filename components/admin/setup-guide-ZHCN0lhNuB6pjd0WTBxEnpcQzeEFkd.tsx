@@ -37,7 +37,7 @@ export default function SetupGuide() {
     setMessage("")
 
     try {
-      const response = await fetch("http://localhost:8000/health")
+      const response = await fetch("http://localhost:8000/api/system-status")
 
       if (response.ok) {
         setBackendStatus("connected")
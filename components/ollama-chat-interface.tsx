@@ -106,6 +106,11 @@ export default function OllamaChatInterface({ currentLanguage }: OllamaChatInter
     }
   }, [])
 
+  // Ask the backend to load the model now so the first message doesn't pay for it
+  useEffect(() => {
+    fetch("http://localhost:8000/api/warmup", { method: "POST" }).catch(() => {})
+  }, [])
+
   // Save messages to localStorage whenever they change
   useEffect(() => {
     if (messages.length > 0) {
@@ -173,10 +178,16 @@ export default function OllamaChatInterface({ currentLanguage }: OllamaChatInter
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
-                messages: [...messages, userMessage],
+                // Upstreams only need role and content; the welcome message is UI-only
+                messages: [...messages, userMessage]
+                    .filter(m => m.id !== "welcome-message")
+                    .map(({ role, content }) => ({ role, content })),
                 model_type: selectedModel,
+                language: currentLanguage,
                 temperature: 0.7,
-                max_tokens: 2000
+                max_tokens: 2000,
+                // The server may then relay OpenRouter's own chunk events (see below)
+                passthrough: selectedModel === 'openrouter'
             }),
         });
 
@@ -196,9 +207,6 @@ export default function OllamaChatInterface({ currentLanguage }: OllamaChatInter
         }
 
         // Handle streaming response
-        const reader = response.body?.getReader();
-        if (!reader) throw new Error('No response body');
-
         let assistantMessage = {
             id: Date.now().toString(),
             role: 'assistant' as const,
@@ -206,36 +214,75 @@ export default function OllamaChatInterface({ currentLanguage }: OllamaChatInter
             timestamp: new Date()
         };
 
-        // Process the stream
-        while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-
-            // Convert the chunk to text
-            const chunk = new TextDecoder().decode(value);
-            const lines = chunk.split('\n');
-
-            for (const line of lines) {
-                if (line.startsWith('data: ')) {
+        // Events are numbered; if the connection drops mid-answer the server keeps
+        // generating and we resume after the last event we saw
+        const streamId = response.headers.get('X-Stream-Id');
+        let lastEventId = 0;
+
+        // Read SSE events until [DONE]; returns false if the stream ended early
+        const readEvents = async (res: Response) => {
+            const reader = res.body?.getReader();
+            if (!reader) throw new Error('No response body');
+            const decoder = new TextDecoder();
+            let buffered = '';
+            let eventId = 0;
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) return false;
+
+                buffered += decoder.decode(value, { stream: true });
+                const lines = buffered.split('\n');
+                buffered = lines.pop() ?? '';
+
+                for (const line of lines) {
+                    if (line.startsWith('id: ')) {
+                        eventId = Number(line.slice(4));
+                        continue;
+                    }
+                    if (!line.startsWith('data: ')) continue;
                     const data = line.slice(6);
+                    lastEventId = eventId;
                     if (data === '[DONE]') {
                         // Update messages with the complete assistant message
                         setMessages(prev => [...prev, assistantMessage]);
-                        break;
+                        return true;
                     }
+                    let parsed;
                     try {
-                        const parsed = JSON.parse(data);
-                        if (parsed.text) {
-                            assistantMessage.content += parsed.text;
-                            // Update the message in real-time
-                            setMessages(prev => [...prev.slice(0, -1), { ...assistantMessage }]);
-                        }
+                        parsed = JSON.parse(data);
                     } catch (e) {
                         console.error('Error parsing chunk:', e);
                         throw new Error('Error processing AI response');
                     }
+                    // The server reports failures after the stream started as an error event
+                    if (parsed.error) {
+                        throw new Error(parsed.error.message || 'The AI response was interrupted');
+                    }
+                    // Relayed OpenRouter events carry the delta in choices[0].delta.content
+                    const text = parsed.text ?? parsed.choices?.[0]?.delta?.content;
+                    if (text) {
+                        assistantMessage.content += text;
+                        // Update the message in real-time
+                        setMessages(prev => [...prev.slice(0, -1), { ...assistantMessage }]);
+                    }
                 }
             }
+        };
+
+        let stream: Response = response;
+        for (let attempt = 0; ; attempt++) {
+            try {
+                if (await readEvents(stream)) break;
+            } catch (e) {
+                // Only network failures (TypeError from fetch/read) are worth resuming
+                if (!(e instanceof TypeError)) throw e;
+            }
+            if (!streamId || attempt >= 3) throw new Error('The AI response was interrupted');
+            await new Promise(resolve => setTimeout(resolve, 500 * (attempt + 1)));
+            stream = await fetch(`/api/chat/${streamId}/events`, {
+                headers: { 'Last-Event-ID': String(lastEventId) }
+            });
+            if (!stream.ok) throw new Error('The AI response was interrupted');
         }
 
     } catch (error) {
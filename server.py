@@ -1,173 +1,3008 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse
-from typing import List, Optional, Dict
+from typing import List, Literal, Optional, Dict
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+from contextlib import asynccontextmanager
+from collections import Counter, OrderedDict, deque
 import httpx
 import json
+import asyncio
+import uuid
+import math
+import hashlib
+import time
+import mmap
+import re
+import sqlite3
+import sys
+import operator
+import random
+import threading
+from array import array
 from datetime import datetime
 from sse_starlette.sse import EventSourceResponse
 import os
 from dotenv import load_dotenv
 import logging
 
+# HTTP/2 needs the optional "h2" package (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# numpy does the semantic cache search; a slow pure-Python fallback is kept
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # Load environment variables
 load_dotenv()
 
-app = FastAPI()
+# Ollama API configuration
+OLLAMA_API_URL = "http://localhost:11434"
+# Local models a chat request may pick with "model"; the first is the default for chats, warm-up,
+# summaries and status checks alike, so they don't make Ollama swap models
+OLLAMA_MODELS = [m.strip() for m in os.getenv("OLLAMA_MODELS", "llama3.2").split(",") if m.strip()]
+OLLAMA_MODEL = OLLAMA_MODELS[0]
+
+# OpenRouter API configuration
+OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_MODELS_URL = "https://openrouter.ai/api/v1/models"
+OPENROUTER_MODEL = "deepseek/deepseek-v3-base:free"
+OPENROUTER_API_KEY = "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"
+
+if not OPENROUTER_API_KEY:
+    raise ValueError("OPENROUTER_API_KEY environment variable is not set")
+
+# Upstream connection pool configuration
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "true").lower() == "true"
+
+# SSE token coalescing (off by default; a request can opt in with "coalesce": true)
+SSE_COALESCE = os.getenv("SSE_COALESCE", "false").lower() == "true"
+SSE_COALESCE_WINDOW_MS = float(os.getenv("SSE_COALESCE_WINDOW_MS", "30"))
+SSE_COALESCE_MAX_BYTES = int(os.getenv("SSE_COALESCE_MAX_BYTES", "512"))
+
+# /api/chat bodies over this size are refused with 413; the body is read incrementally,
+# so an oversized one is cut off as soon as it crosses the limit
+CHAT_MAX_BODY_BYTES = int(os.getenv("CHAT_MAX_BODY_BYTES", str(1024 * 1024)))
+
+# Ollama admission control: generations run at once / requests allowed to wait
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+OLLAMA_MAX_QUEUE_DEPTH = int(os.getenv("OLLAMA_MAX_QUEUE_DEPTH", "16"))
+QUEUE_EVENT_INTERVAL = 1.0
+
+# Adaptive (AIMD) Ollama concurrency: OLLAMA_MAX_CONCURRENCY is the starting limit, which grows
+# while per-stream speed and time to first token meet their targets and shrinks when they don't
+OLLAMA_ADAPTIVE_CONCURRENCY = os.getenv("OLLAMA_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+OLLAMA_MIN_CONCURRENCY = int(os.getenv("OLLAMA_MIN_CONCURRENCY", "1"))
+OLLAMA_CONCURRENCY_CEILING = int(os.getenv("OLLAMA_CONCURRENCY_CEILING", "16"))
+OLLAMA_TARGET_TOKENS_PER_SECOND = float(os.getenv("OLLAMA_TARGET_TOKENS_PER_SECOND", "5"))
+OLLAMA_TARGET_TTFT = float(os.getenv("OLLAMA_TARGET_TTFT", "5"))
+
+# Weighted fair queueing between users (client_identity: "token:<sha256 prefix>" or "ip:<address>").
+# FAIR_QUEUE_USER_TIERS maps identities to tiers, e.g. "token:3f2a9c1b0d4e5f60=premium"; everyone
+# else is in FAIR_QUEUE_DEFAULT_TIER. With FAIR_QUEUE_SJF, shorter expected jobs go first.
+FAIR_QUEUE_TIER_WEIGHTS = {
+    tier.strip(): float(weight)
+    for tier, _, weight in (item.partition(":") for item in os.getenv("FAIR_QUEUE_TIER_WEIGHTS", "standard:1,premium:4").split(","))
+    if tier.strip()
+}
+FAIR_QUEUE_DEFAULT_TIER = os.getenv("FAIR_QUEUE_DEFAULT_TIER", "standard")
+FAIR_QUEUE_USER_TIERS = {
+    user.strip(): tier.strip()
+    for user, _, tier in (item.partition("=") for item in os.getenv("FAIR_QUEUE_USER_TIERS", "").split(","))
+    if user.strip()
+}
+FAIR_QUEUE_SJF = os.getenv("FAIR_QUEUE_SJF", "false").lower() == "true"
+FAIR_QUEUE_TRACKED_USERS = int(os.getenv("FAIR_QUEUE_TRACKED_USERS", "100"))
+
+# Exact-match response cache for /api/chat
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "true").lower() == "true"
+CHAT_CACHE_MAX_BYTES = int(os.getenv("CHAT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "3600"))
+CHAT_CACHE_REQUIRE_DETERMINISTIC = os.getenv("CHAT_CACHE_REQUIRE_DETERMINISTIC", "true").lower() == "true"
+CHAT_CACHE_REPLAY_DELAY_MS = float(os.getenv("CHAT_CACHE_REPLAY_DELAY_MS", "0"))
+
+# Resumable /api/chat streams: events are numbered and the last STREAM_RESUME_BUFFER_EVENTS are kept
+# until STREAM_RESUME_GRACE seconds after the answer ends; a dropped client has that long to reconnect
+# with Last-Event-ID before its generation is stopped
+STREAM_RESUME_ENABLED = os.getenv("STREAM_RESUME_ENABLED", "true").lower() == "true"
+STREAM_RESUME_GRACE = float(os.getenv("STREAM_RESUME_GRACE", "30"))
+STREAM_RESUME_BUFFER_EVENTS = int(os.getenv("STREAM_RESUME_BUFFER_EVENTS", "2048"))
+
+# Concurrent conversations one /ws/chat socket may run
+WS_MAX_CHANNELS = int(os.getenv("WS_MAX_CHANNELS", "8"))
+
+# Identical in-flight /api/chat requests (same key as the response cache) share one upstream generation
+CHAT_SINGLEFLIGHT = os.getenv("CHAT_SINGLEFLIGHT", "true").lower() == "true"
+
+# Let /api/chat clients that send {"passthrough": true} get OpenRouter's SSE events relayed verbatim
+OPENROUTER_PASSTHROUGH = os.getenv("OPENROUTER_PASSTHROUGH", "false").lower() == "true"
+
+# Semantic response cache (needs an Ollama embedding model, e.g. `ollama pull nomic-embed-text`)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "semantic_cache")
+SEMANTIC_CACHE_CAPACITY = int(os.getenv("SEMANTIC_CACHE_CAPACITY", "10000"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_REQUIRE_DETERMINISTIC = os.getenv("SEMANTIC_CACHE_REQUIRE_DETERMINISTIC", "false").lower() == "true"
+OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+
+# Background status probing; status endpoints serve the cached result
+STATUS_PROBE_INTERVAL = float(os.getenv("STATUS_PROBE_INTERVAL", "15"))
+
+# Backend routing: "requested" honours model_type, "prefer_local" spills Ollama overflow to OpenRouter
+ROUTER_POLICY = os.getenv("ROUTER_POLICY", "requested")
+ROUTER_FAILOVER = os.getenv("ROUTER_FAILOVER", "true").lower() == "true"
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+ROUTER_SPILL_QUEUE_DEPTH = int(os.getenv("ROUTER_SPILL_QUEUE_DEPTH", "4"))
+
+# Hedged requests: start the failover backend too if the first has no token after the delay.
+# HEDGE_DELAY_MS=0 uses the primary's running p90 TTFT (never below HEDGE_MIN_DELAY_MS).
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_DELAY_MS = float(os.getenv("HEDGE_DELAY_MS", "0"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "250"))
+HEDGE_BUDGET_PERCENT = float(os.getenv("HEDGE_BUDGET_PERCENT", "10"))
+
+# Per-upstream circuit breaker, and jittered retries of failures before the first byte
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "2"))
+RETRY_BASE_DELAY_MS = float(os.getenv("RETRY_BASE_DELAY_MS", "200"))
+RETRY_MAX_DELAY_MS = float(os.getenv("RETRY_MAX_DELAY_MS", "2000"))
+
+# Streaming deadlines in seconds: connect, upstream request to first token, longest gap
+# between tokens, and the whole request. Clients can shorten the total with X-Deadline-Ms.
+DEADLINE_CONNECT = float(os.getenv("DEADLINE_CONNECT", "5"))
+DEADLINE_FIRST_TOKEN = float(os.getenv("DEADLINE_FIRST_TOKEN", "120"))
+DEADLINE_TOKEN_GAP = float(os.getenv("DEADLINE_TOKEN_GAP", "30"))
+DEADLINE_TOTAL = float(os.getenv("DEADLINE_TOTAL", "600"))
+
+# Prompt context budget: older turns beyond CONTEXT_MAX_TOKENS are replaced by a rolling summary.
+# CONTEXT_MAX_TOKENS=0 forwards the whole history unchanged.
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+CONTEXT_MIN_RECENT_MESSAGES = int(os.getenv("CONTEXT_MIN_RECENT_MESSAGES", "2"))
+CONTEXT_SUMMARY_ENABLED = os.getenv("CONTEXT_SUMMARY_ENABLED", "true").lower() == "true"
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "256"))
+CONTEXT_SUMMARY_CACHE_SIZE = int(os.getenv("CONTEXT_SUMMARY_CACHE_SIZE", "1000"))
+# Trim in blocks of this many messages so the kept prefix only shifts every few turns
+CONTEXT_TRIM_BLOCK = int(os.getenv("CONTEXT_TRIM_BLOCK", "6"))
+
+# Persona used when a chat request doesn't name one from PERSONAS
+PROMPT_DEFAULT_PERSONA = os.getenv("PROMPT_DEFAULT_PERSONA", "default")
+
+# Model warm-up: preload at startup, send keep_alive with every request, and ping loaded
+# models while chats arrived within OLLAMA_ACTIVE_WINDOW seconds
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "10m")
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "true").lower() == "true"
+OLLAMA_PRELOAD_MODELS = [m.strip() for m in os.getenv("OLLAMA_PRELOAD_MODELS", OLLAMA_MODEL).split(",") if m.strip()]
+OLLAMA_KEEPALIVE_PING_INTERVAL = float(os.getenv("OLLAMA_KEEPALIVE_PING_INTERVAL", "240"))
+OLLAMA_ACTIVE_WINDOW = float(os.getenv("OLLAMA_ACTIVE_WINDOW", "1800"))
+# A generation whose load_duration exceeds this counts as a cold start
+OLLAMA_COLD_LOAD_MS = float(os.getenv("OLLAMA_COLD_LOAD_MS", "500"))
+
+# Queued requests for a model in OLLAMA_MODELS that is already loaded (per /api/ps, polled every
+# OLLAMA_PS_INTERVAL seconds) may overtake one that would force a swap, for at most
+# OLLAMA_AFFINITY_WINDOW seconds and OLLAMA_AFFINITY_MAX_BYPASS times per request
+OLLAMA_PS_INTERVAL = float(os.getenv("OLLAMA_PS_INTERVAL", "5"))
+OLLAMA_AFFINITY_WINDOW = float(os.getenv("OLLAMA_AFFINITY_WINDOW", "10"))
+OLLAMA_AFFINITY_MAX_BYPASS = int(os.getenv("OLLAMA_AFFINITY_MAX_BYPASS", "8"))
+
+# Continue stored conversations from Ollama's /api/generate context instead of re-sending
+# the history; contexts longer than OLLAMA_CONTEXT_MAX_TOKENS fall back to /api/chat
+OLLAMA_CONTEXT_CONTINUATION = os.getenv("OLLAMA_CONTEXT_CONTINUATION", "false").lower() == "true"
+OLLAMA_CONTEXT_MAX_BYTES = int(os.getenv("OLLAMA_CONTEXT_MAX_BYTES", str(64 * 1024 * 1024)))
+OLLAMA_CONTEXT_MAX_TOKENS = int(os.getenv("OLLAMA_CONTEXT_MAX_TOKENS", "4096"))
+
+# Server-side conversations for {conversation_id, message} requests; written through to SQLite,
+# with the most recently used ones kept in memory
+CONVERSATION_STORE_ENABLED = os.getenv("CONVERSATION_STORE_ENABLED", "true").lower() == "true"
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "conversations.sqlite3")
+CONVERSATION_MEMORY_MAX_BYTES = int(os.getenv("CONVERSATION_MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))
+CONVERSATION_USER_MAX_BYTES = int(os.getenv("CONVERSATION_USER_MAX_BYTES", str(1024 * 1024)))
+
+# One long-lived client per upstream, created by the app lifespan
+upstream_clients: Dict[str, httpx.AsyncClient] = {}
+
+def create_upstream_client(http2=False):
+    """Build a keep-alive client with the configured pool limits."""
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY
+    )
+    # No read timeout: streams are bounded per phase by enforce_deadlines instead
+    timeout = httpx.Timeout(None, connect=DEADLINE_CONNECT, write=DEADLINE_CONNECT, pool=DEADLINE_CONNECT)
+    return httpx.AsyncClient(limits=limits, http2=http2 and HTTP2_AVAILABLE, timeout=timeout)
+
+def get_upstream_client(name):
+    """Return the pooled client for an upstream, creating it if the lifespan hasn't run."""
+    client = upstream_clients.get(name)
+    if client is None or client.is_closed:
+        # Ollama is plain HTTP on localhost, so only OpenRouter negotiates HTTP/2 (ALPN over TLS)
+        client = create_upstream_client(http2=UPSTREAM_HTTP2 and name == "openrouter")
+        upstream_clients[name] = client
+    return client
+
+@asynccontextmanager
+async def lifespan(app):
+    global semantic_index, conversation_store
+    get_upstream_client("ollama")
+    get_upstream_client("openrouter")
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_index = SemanticIndex(SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_CAPACITY)
+    if CONVERSATION_STORE_ENABLED:
+        conversation_store = ConversationStore(CONVERSATION_DB_PATH, CONVERSATION_MEMORY_MAX_BYTES, CONVERSATION_USER_MAX_BYTES)
+    tasks = [asyncio.create_task(prober.run_forever()) for prober in status_probers.values()]
+    tasks.append(asyncio.create_task(warmup_manager.run_forever(preload=OLLAMA_PRELOAD)))
+    tasks.append(asyncio.create_task(model_residency.run_forever()))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for client in upstream_clients.values():
+            await client.aclose()
+        upstream_clients.clear()
+        if semantic_index is not None:
+            semantic_index.close()
+            semantic_index = None
+        if conversation_store is not None:
+            await conversation_store.flush()
+            conversation_store.close()
+            conversation_store = None
+
+app = FastAPI(lifespan=lifespan)
+
+# Configure CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # In production, replace with your frontend URL
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Stream-Id", "Retry-After", "X-Backend", "X-Route-Reason", "X-Conversation-Id"],
+)
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+class NDJSONDecoder:
+    """Incrementally split a byte stream into newline-delimited JSON objects.
+
+    Chunks may carry several lines or part of one. Only the unterminated tail
+    is kept between calls, so each byte is copied at most once. Framing is
+    done on raw bytes, and a newline never occurs inside a multi-byte UTF-8
+    sequence, so split characters are reassembled before decoding.
+    """
+
+    def __init__(self):
+        self._pending = []
+
+    def feed(self, chunk):
+        """Return the objects completed by this chunk."""
+        objects = []
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                break
+            if self._pending:
+                self._pending.append(chunk[start:end])
+                line = b"".join(self._pending)
+                self._pending = []
+            else:
+                line = chunk[start:end]
+            self._decode(line, objects)
+            start = end + 1
+        if start < len(chunk):
+            self._pending.append(chunk[start:])
+        return objects
+
+    def flush(self):
+        """Decode a final line that had no trailing newline."""
+        objects = []
+        if self._pending:
+            self._decode(b"".join(self._pending), objects)
+            self._pending = []
+        return objects
+
+    def _decode(self, line, objects):
+        if not line.strip():
+            return
+        try:
+            objects.append(json.loads(line))
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping malformed NDJSON line: {line[:200]!r}")
+
+async def iter_ndjson(response):
+    """Yield each JSON object from a streaming NDJSON httpx response."""
+    decoder = NDJSONDecoder()
+    async for chunk in response.aiter_bytes():
+        for data in decoder.feed(chunk):
+            yield data
+    for data in decoder.flush():
+        yield data
+
+class DeadlineExceeded(Exception):
+    """A streaming phase ("first_token", "token_gap" or "total") ran out of time."""
+
+    messages = {
+        "first_token": "No first token within {:g}s",
+        "token_gap": "No new token within {:g}s",
+        "total": "Generation did not finish within {:g}s"
+    }
+
+    def __init__(self, phase, seconds):
+        super().__init__(self.messages[phase].format(seconds))
+        self.phase = phase
+        self.seconds = seconds
+
+class Deadlines:
+    """Per-request streaming deadlines; `total_at` is absolute (event loop time)."""
+
+    def __init__(self, first_token=None, token_gap=None, total=None):
+        self.first_token = DEADLINE_FIRST_TOKEN if first_token is None else first_token
+        self.token_gap = DEADLINE_TOKEN_GAP if token_gap is None else token_gap
+        self.total = DEADLINE_TOTAL if total is None else total
+        self.total_at = asyncio.get_running_loop().time() + self.total
+
+    @classmethod
+    def from_request(cls, http_request):
+        """Server defaults, with the total shortened by a client X-Deadline-Ms header."""
+        total = DEADLINE_TOTAL
+        header = http_request.headers.get("x-deadline-ms")
+        if header:
+            try:
+                total = min(total, max(0.0, float(header) / 1000))
+            except ValueError:
+                pass
+        return cls(total=total)
+
+    def remaining(self):
+        return self.total_at - asyncio.get_running_loop().time()
+
+async def enforce_deadlines(tokens, deadlines):
+    """Bound an upstream stream by time to first token, gap between tokens and total time.
+
+    A breach closes the upstream (freeing whatever it holds) and raises
+    DeadlineExceeded; a connect timeout is counted and passed through so it
+    can be retried.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = tokens.__aiter__()
+    phase, limit = "first_token", deadlines.first_token
+    phase_at = loop.time() + limit
+    try:
+        while True:
+            timeout = min(phase_at, deadlines.total_at) - loop.time()
+            try:
+                item = await asyncio.wait_for(iterator.__anext__(), max(timeout, 0))
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                if deadlines.total_at <= phase_at:
+                    phase, limit = "total", deadlines.total
+                metrics[f"deadline_{phase}_exceeded"] += 1
+                raise DeadlineExceeded(phase, limit)
+            except httpx.ConnectTimeout:
+                metrics["deadline_connect_exceeded"] += 1
+                raise
+            if isinstance(item, str):
+                phase, limit = "token_gap", deadlines.token_gap
+                phase_at = loop.time() + limit
+            yield item
+    finally:
+        await iterator.aclose()
+
+class UpstreamError(Exception):
+    """An upstream LLM API answered with an error (HTTP status or an error object in the stream)."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+# Chat with Ollama LLM
+async def stream_ollama_response(messages, temperature=0.7, max_tokens=2000, stats=None, model=OLLAMA_MODEL):
+    """Yield text deltas from Ollama's streaming /api/chat endpoint.
+
+    If `stats` is a dict it is filled with the timing fields of Ollama's
+    final (done) object, e.g. eval_count and eval_duration, and
+    stats["done"] is set once Ollama signals the answer is complete.
+    """
+    # Prepare the request payload
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {
+            "temperature": temperature,
+            "num_predict": max_tokens
+        }
+    }
+    
+    client = get_upstream_client("ollama")
+    async with client.stream("POST", f"{OLLAMA_API_URL}/api/chat", json=payload) as response:
+        if response.status_code != 200:
+            error_detail = await response.aread()
+            raise UpstreamError(response.status_code, f"Ollama API error: {error_detail}")
+        
+        async for data in iter_ndjson(response):
+            if "error" in data:
+                raise UpstreamError(502, f"Ollama API error: {data['error']}")
+            if "message" in data and "content" in data["message"]:
+                yield data["message"]["content"]
+            if data.get("done") and stats is not None:
+                stats.update({k: v for k, v in data.items() if k.endswith(("_count", "_duration"))})
+                stats["done"] = True
+
+async def stream_ollama_generate(prompt, system=None, context=None, temperature=0.7, max_tokens=2000, stats=None, model=OLLAMA_MODEL):
+    """Yield text deltas from Ollama's streaming /api/generate endpoint.
+
+    `context` is the token array a previous generate call returned; the
+    model continues from it, so only `prompt` needs evaluating. Like
+    stream_ollama_response, `stats` gets the final timing fields and
+    "done", plus the new "context" array.
+    """
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {
+            "temperature": temperature,
+            "num_predict": max_tokens
+        }
+    }
+    if context is not None:
+        payload["context"] = context.tolist()
+    elif system:
+        payload["system"] = system
+
+    client = get_upstream_client("ollama")
+    async with client.stream("POST", f"{OLLAMA_API_URL}/api/generate", json=payload) as response:
+        if response.status_code != 200:
+            error_detail = await response.aread()
+            raise UpstreamError(response.status_code, f"Ollama API error: {error_detail}")
+
+        async for data in iter_ndjson(response):
+            if "error" in data:
+                raise UpstreamError(502, f"Ollama API error: {data['error']}")
+            if data.get("response"):
+                yield data["response"]
+            if data.get("done") and stats is not None:
+                stats.update({k: v for k, v in data.items() if k.endswith(("_count", "_duration"))})
+                if "context" in data:
+                    stats["context"] = data["context"]
+                stats["done"] = True
+
+# New function for OpenRouter streaming
+async def stream_openrouter_response(messages, temperature=0.7, max_tokens=2000, stats=None):
+    """Yield text deltas from OpenRouter's streaming chat completions endpoint.
+
+    If `stats` is a dict, stats["done"] is set when OpenRouter sends [DONE].
+    """
+    try:
+        async with open_openrouter_stream(messages, temperature, max_tokens) as response:
+            async for line in response.aiter_lines():
+                if line.strip():
+                    if line.startswith("data: "):
+                        line = line[6:]  # Remove "data: " prefix
+                    if line == "[DONE]":
+                        if stats is not None:
+                            stats["done"] = True
+                        break
+                    try:
+                        data = json.loads(line)
+                        if "error" in data:
+                            raise UpstreamError(502, f"OpenRouter API error: {data['error']}")
+                        if "choices" in data and len(data["choices"]) > 0:
+                            content = data["choices"][0].get("delta", {}).get("content", "")
+                            if content:
+                                yield content
+                    except json.JSONDecodeError:
+                        continue
+    except Exception as e:
+        logger.error(f"Error in OpenRouter streaming: {str(e)}", exc_info=True)
+        raise
+
+@asynccontextmanager
+async def open_openrouter_stream(messages, temperature, max_tokens):
+    """POST a streaming chat completion to OpenRouter; raises UpstreamError on a non-200 answer."""
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "HTTP-Referer": "http://localhost:3000",
+        "Content-Type": "application/json"
+    }
+
+    payload = {
+        "model": OPENROUTER_MODEL,
+        "messages": messages,
+        "stream": True,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+
+    logger.debug(f"Making OpenRouter request with model: {OPENROUTER_MODEL}")
+
+    client = get_upstream_client("openrouter")
+    async with client.stream("POST", OPENROUTER_API_URL, json=payload, headers=headers) as response:
+        if response.status_code != 200:
+            error_detail = await response.aread()
+            logger.error(f"OpenRouter API error: {error_detail}")
+            raise UpstreamError(response.status_code, f"OpenRouter API error: {error_detail.decode()}")
+        yield response
+
+class RawEvents(str):
+    """Upstream SSE events relayed as-is by stream_openrouter_passthrough.
+
+    A str, so deadlines, hedging, backend health and singleflight treat it
+    like a text delta; sse_frames sends it unchanged instead of wrapping it
+    in a {"text": ...} frame. `tokens` is how many content deltas it holds.
+    """
+
+    def __new__(cls, events, tokens):
+        raw = super().__new__(cls, events)
+        raw.tokens = tokens
+        return raw
+
+def count_deltas(events):
+    """Content deltas in a run of OpenAI-style chunk events, by scanning rather than parsing.
+
+    Role-only and finish chunks carry "content":"" and are not counted.
+    """
+    return events.count('"content":"') - events.count('"content":""')
+
+async def stream_openrouter_passthrough(messages, temperature=0.7, max_tokens=2000, stats=None):
+    """Relay OpenRouter's SSE events without decoding them.
+
+    Yields RawEvents holding whole `data: {...}` events in OpenAI chunk
+    format, as many as each read from upstream completes. Only two things
+    are looked for: the `data: [DONE]` line, which ends the stream (it is
+    not relayed; sse_frames sends its own) and sets stats["done"], and an
+    `"error":` key, whose event alone is parsed to raise UpstreamError.
+    Neither can be faked by the model's text, since content strings are
+    JSON-escaped and never contain a raw newline or an unescaped quote.
+    Events without content (keep-alive comments, the role-only first
+    chunk) are held back until the next content arrives, so they don't
+    count as output for time-to-first-token and hedging; whatever is held
+    back when the stream ends (e.g. the finish_reason/usage chunk) is
+    still relayed, so the client sees every event OpenRouter sent.
+    """
+    async with open_openrouter_stream(messages, temperature, max_tokens) as response:
+        pending = ""
+        async for text in response.aiter_text():
+            pending += text
+            end = pending.rfind("\n\n")
+            if end < 0:
+                continue
+            events = pending[:end + 2]
+            done = events.find("\ndata: [DONE]")
+            done = 0 if events.startswith("data: [DONE]") else done + 1 if done >= 0 else None
+            if done is not None:
+                events = events[:done]
+            error = events.find('"error":')
+            if error >= 0:
+                start = events.rfind("\n\n", 0, error)
+                start = start + 2 if start >= 0 else 0
+                before = events[:start]
+                if before:
+                    yield RawEvents(before, count_deltas(before))
+                event = events[start:events.find("\n\n", error)]
+                try:
+                    detail = json.loads(event[event.find("{"):])["error"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    detail = event
+                raise UpstreamError(502, f"OpenRouter API error: {detail}")
+            tokens = count_deltas(events)
+            if tokens or (done is not None and events):
+                yield RawEvents(events, tokens)
+            if done is not None:
+                if stats is not None:
+                    stats["done"] = True
+                return
+            if tokens:
+                pending = pending[end + 2:]
+        # Closed without [DONE]: relay the rest, ending its last event so sse_frames' [DONE] stays separate
+        if pending:
+            yield RawEvents(pending if pending.endswith("\n\n") else pending + "\n\n", count_deltas(pending))
+
+async def sse_frames(tokens):
+    """Encode text deltas as the `data: {"text": ...}` frames the UI expects.
+
+    Dict items are control events (e.g. queue position) and are sent as-is,
+    and RawEvents from the OpenRouter pass-through are already SSE. An
+    upstream failure after the response has started can no longer change
+    the HTTP status, so it is sent as a `data: {"error": ...}` event instead.
+    """
+    try:
+        try:
+            async for item in tokens:
+                if isinstance(item, dict):
+                    yield f"data: {json.dumps(item)}\n\n"
+                elif isinstance(item, RawEvents):
+                    yield item
+                else:
+                    yield f"data: {json.dumps({'text': item})}\n\n"
+        except Exception as e:
+            logger.error(f"Chat stream failed mid-response: {str(e)}")
+            metrics["chat_stream_errors"] += 1
+            yield f"data: {json.dumps({'error': stream_error(e)})}\n\n"
+        yield f"data: [DONE]\n\n"
+    finally:
+        await tokens.aclose()
+
+def stream_error(error):
+    """The structured body of an SSE error event."""
+    if isinstance(error, UpstreamError):
+        return {"type": "upstream_error", "status": error.status_code, "message": error.detail}
+    if isinstance(error, DeadlineExceeded):
+        return {"type": "deadline_exceeded", "phase": error.phase, "message": str(error)}
+    if isinstance(error, httpx.TransportError):
+        return {"type": "upstream_unreachable", "message": str(error) or type(error).__name__}
+    return {"type": "internal_error", "message": str(error)}
+
+async def coalesce_tokens(tokens, window=None, max_bytes=None):
+    """Merge small text deltas into fewer, larger ones.
+
+    The first delta is passed through immediately so time-to-first-token is
+    unchanged. After that, text is buffered until the time window elapses or
+    the buffer reaches max_bytes, whichever comes first. The window is
+    enforced even while upstream is idle, so text never sits in the buffer
+    longer than `window` seconds. Control events (dicts) flush the buffer
+    and are passed through in order.
+    """
+    window = SSE_COALESCE_WINDOW_MS / 1000 if window is None else window
+    max_bytes = SSE_COALESCE_MAX_BYTES if max_bytes is None else max_bytes
+    loop = asyncio.get_running_loop()
+    iterator = tokens.__aiter__()
+    buffer = []
+    buffered_bytes = 0
+    deadline = None
+    first = True
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # Window elapsed while waiting for upstream
+                yield "".join(buffer)
+                buffer, buffered_bytes, deadline = [], 0, None
+                continue
+            task, pending = pending, None
+            try:
+                text = task.result()
+            except StopAsyncIteration:
+                break
+            if isinstance(text, dict):
+                if buffer:
+                    yield "".join(buffer)
+                    buffer, buffered_bytes, deadline = [], 0, None
+                yield text
+                continue
+            if first:
+                first = False
+                yield text
+                continue
+            if not buffer:
+                deadline = loop.time() + window
+            buffer.append(text)
+            buffered_bytes += len(text.encode("utf-8"))
+            if buffered_bytes >= max_bytes or loop.time() >= deadline:
+                yield "".join(buffer)
+                buffer, buffered_bytes, deadline = [], 0, None
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+class ChatStream:
+    """An in-flight /api/chat generation that can be cancelled.
+
+    StreamingResponse cancels the body iterator when the client disconnects,
+    and the explicit cancel endpoint sets `cancelled`. Either way guard()
+    closes the upstream stream at once, which drops the HTTP connection and
+    makes Ollama/OpenRouter stop generating.
+
+    `upstream` is False for cache replays: cancelling those saves no
+    generation, so they are left out of the cancellation counters.
+    """
+
+    # Moving average of completed generation length per model type
+    typical_tokens = {}
+
+    def __init__(self, model_type, max_tokens=2000, upstream=True):
+        self.id = uuid.uuid4().hex
+        self.model_type = model_type
+        self.max_tokens = max_tokens
+        self.upstream = upstream
+        self.tokens_emitted = 0
+        self.finished = False
+        self.cancelled = asyncio.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    async def guard(self, tokens):
+        """Relay upstream deltas until the upstream finishes or the stream is cancelled."""
+        active_streams[self.id] = self
+        iterator = tokens.__aiter__()
+        cancel_wait = asyncio.ensure_future(self.cancelled.wait())
+        step = None
+        try:
+            while True:
+                step = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait({step, cancel_wait}, return_when=asyncio.FIRST_COMPLETED)
+                if not step.done():
+                    break
+                try:
+                    text = step.result()
+                except StopAsyncIteration:
+                    self.finished = True
+                    break
+                finally:
+                    step = None
+                if isinstance(text, RawEvents):
+                    self.tokens_emitted += text.tokens
+                elif isinstance(text, str):
+                    self.tokens_emitted += 1
+                yield text
+        finally:
+            for task in (step, cancel_wait):
+                if task is not None and not task.done():
+                    task.cancel()
+                    try:
+                        await task
+                    except (asyncio.CancelledError, StopAsyncIteration):
+                        pass
+            await iterator.aclose()
+            active_streams.pop(self.id, None)
+            if self.upstream:
+                self._record()
+
+    def _record(self):
+        typical = ChatStream.typical_tokens.get(self.model_type)
+        if self.finished:
+            if typical is None:
+                ChatStream.typical_tokens[self.model_type] = float(self.tokens_emitted)
+            else:
+                ChatStream.typical_tokens[self.model_type] = typical + 0.2 * (self.tokens_emitted - typical)
+            return
+        reason = "cancel_requests" if self.cancelled.is_set() else "client_disconnects"
+        metrics[f"chat_streams_ended_by_{reason}"] += 1
+        if self.model_type == "ollama":
+            typical = ollama_queue.tokens_per_generation
+        expected = min(typical if typical is not None else self.max_tokens, self.max_tokens)
+        # Estimate from typical answer length; the upper bound assumes the model would run to max_tokens
+        metrics["chat_tokens_saved_estimate"] += int(max(expected - self.tokens_emitted, 0))
+        metrics["chat_tokens_saved_upper_bound"] += max(self.max_tokens - self.tokens_emitted, 0)
+        logger.info(f"Stream {self.id} cancelled after {self.tokens_emitted} tokens")
+
+class AdmissionTicket:
+    """A request's place in an AdmissionQueue."""
+
+    def __init__(self, queue, user, weight, cost, seq, model=None):
+        self.queue = queue
+        self.user = user
+        self.weight = weight
+        self.cost = cost
+        self.seq = seq
+        self.model = model
+        self.bypassed = 0
+        self.enqueued = time.monotonic()
+        self.granted = asyncio.Event()
+        self.released = False
+
+    def release(self):
+        self.queue.release(self)
+
+class AIMDLimiter:
+    """Additive-increase / multiplicative-decrease concurrency limit.
+
+    Each finished generation is a sample. A good one (per-stream tokens/s
+    and TTFT within target) taken while the limit was actually in use adds
+    1/limit, so the limit grows by about one per round of `limit`
+    generations. A bad one multiplies it by `backoff`, at most once per
+    round, so one slow batch only counts once.
+    """
+
+    def __init__(self, initial, minimum, maximum, target_tps, target_ttft, backoff=0.75):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.target_tps = target_tps
+        self.target_ttft = target_ttft
+        self.backoff = backoff
+        self.since_decrease = 0
+        self.history = deque(maxlen=100)
+        self.history.append((time.time(), self.current()))
+
+    def current(self):
+        return int(self.limit)
+
+    def record(self, tokens_per_second, ttft, saturated):
+        """Fold in one generation; returns the (integer) limit to use."""
+        before = self.current()
+        self.since_decrease += 1
+        if tokens_per_second < self.target_tps or ttft > self.target_ttft:
+            if self.since_decrease >= before:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self.since_decrease = 0
+        elif saturated:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        if self.current() != before:
+            self.history.append((time.time(), self.current()))
+        return self.current()
+
+    def snapshot(self):
+        return {
+            "limit": self.current(),
+            "target_tokens_per_second": self.target_tps,
+            "target_ttft": self.target_ttft,
+            "history": [[datetime.fromtimestamp(t).isoformat(), limit] for t, limit in self.history]
+        }
+
+
+def model_tag(name):
+    """Ollama model name with its tag, so "llama3.2" and "llama3.2:latest" compare equal."""
+    return name if ":" in name else f"{name}:latest"
+
+class ModelResidency:
+    """Which Ollama models are loaded, from /api/ps, and how much swapping them costs.
+
+    The poll is only a hint between generations; a generation that just
+    loaded its model marks it resident straight away. A cold load while
+    another model was resident counts as a swap and is assumed to have
+    evicted it, until the next poll says otherwise.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.resident = set()
+        self.checked_at = None
+        self.swaps = Counter()
+        self.swap_ms = 0.0
+
+    async def refresh(self):
+        client = get_upstream_client("ollama")
+        response = await client.get(f"{OLLAMA_API_URL}/api/ps", timeout=httpx.Timeout(5.0, connect=DEADLINE_CONNECT))
+        response.raise_for_status()
+        self.resident = {model_tag(m["name"]) for m in response.json().get("models", [])}
+        self.checked_at = time.time()
+
+    def loaded(self, model, load_ms, cold):
+        """Note a finished generation of `model` that spent `load_ms` loading it."""
+        model = model_tag(model)
+        if cold and self.resident - {model}:
+            self.swaps[model] += 1
+            self.swap_ms += load_ms
+            metrics["ollama_model_swaps"] += 1
+            metrics["ollama_model_swap_ms"] += round(load_ms)
+            self.resident = {model}
+        else:
+            self.resident.add(model)
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.debug(f"Polling Ollama running models failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def snapshot(self):
+        return {
+            "resident": sorted(self.resident),
+            "checked_at": datetime.fromtimestamp(self.checked_at).isoformat() if self.checked_at else None,
+            "swaps": dict(self.swaps),
+            "swap_seconds": round(self.swap_ms / 1000, 1)
+        }
+
+class AdmissionQueue:
+    """Bounded admission control for a backend that serves few generations at once.
+
+    Up to `concurrency` tickets hold a slot; up to `max_depth` more wait in
+    line. Waiting tickets are granted by weighted fair queueing between
+    users: each grant charges its user cost/weight of virtual time, and the
+    waiting ticket that would finish earliest in virtual time goes next, so
+    a user firing many requests cannot starve the others and a user with
+    weight 4 gets four grants for every one of a weight-1 user. A single
+    user's tickets are served in order of arrival, or shortest first with
+    `sjf`, where a ticket's cost is its expected size (every ticket costs 1
+    otherwise). Wait estimates come from moving averages of generation speed
+    and length, updated by record(). With a `limiter`, `concurrency` follows
+    the limiter via adapt().
+
+    With a `residency` (ModelResidency), the fair choice may be overtaken by
+    the fairest waiting ticket for a model that is loaded or running, so
+    requests for one model run back to back instead of swapping weights in
+    and out. A ticket is overtaken only while it has waited less than
+    `affinity_window` seconds and at most `max_bypass` times. Positions
+    reported to clients follow the fair order and ignore this.
+    """
+
+    def __init__(self, name, concurrency, max_depth, default_tokens_per_second=10.0, default_tokens_per_generation=300,
+                 limiter=None, sjf=False, tracked_users=100, residency=None, affinity_window=0.0, max_bypass=0):
+        self.name = name
+        self.limiter = limiter
+        self.concurrency = limiter.current() if limiter is not None else concurrency
+        self.max_depth = max_depth
+        self.sjf = sjf
+        self.active = 0
+        self.waiters = []
+        # user -> that user's waiting tickets, in arrival order
+        self.flows = {}
+        # user -> virtual finish time of their last grant
+        self.finish = {}
+        self.virtual_time = 0.0
+        self.seq = 0
+        self.residency = residency
+        self.affinity_window = affinity_window
+        self.max_bypass = max_bypass
+        # model -> granted tickets generating with it
+        self.running = Counter()
+        self.tracked_users = tracked_users
+        self.waits = OrderedDict()
+        self.tokens_per_second = default_tokens_per_second
+        self.tokens_per_generation = default_tokens_per_generation
+
+    def try_acquire(self, user="system", weight=1.0, size=None, model=None):
+        """Return a ticket, or None when the queue is already at max_depth.
+
+        `size` is the expected job size in tokens; it only matters with sjf.
+        `model` is the Ollama model the ticket will run, for affinity.
+        """
+        cost = max(size, 1.0) if self.sjf and size else 1.0
+        self.seq += 1
+        ticket = AdmissionTicket(self, user, max(weight, 0.01), cost, self.seq, model and model_tag(model))
+        if self.active < self.concurrency and not self.waiters:
+            self.grant(ticket)
+        elif len(self.waiters) >= self.max_depth:
+            return None
+        else:
+            self.waiters.append(ticket)
+            self.flows.setdefault(user, []).append(ticket)
+        return ticket
+
+    def release(self, ticket):
+        """Give back a slot, or leave the line. Safe to call more than once."""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted.is_set():
+            self.active -= 1
+            if ticket.model:
+                self.running[ticket.model] -= 1
+                if not self.running[ticket.model]:
+                    del self.running[ticket.model]
+        else:
+            self.leave(self.flows, ticket)
+            self.waiters.remove(ticket)
+        self.grant_waiting()
+
+    @staticmethod
+    def leave(flows, ticket):
+        flow = flows[ticket.user]
+        flow.remove(ticket)
+        if not flow:
+            del flows[ticket.user]
+
+    def pick(self, flows, virtual_time, finish):
+        """The next ticket to grant from `flows`, with its virtual start and finish."""
+        best = None
+        for user, flow in flows.items():
+            ticket = min(flow, key=lambda t: t.cost) if self.sjf else flow[0]
+            start = max(virtual_time, finish.get(user, 0.0))
+            end = start + ticket.cost / ticket.weight
+            if best is None or (end, ticket.seq) < (best[2], best[0].seq):
+                best = (ticket, start, end)
+        return best
+
+    def grant(self, ticket):
+        start = max(self.virtual_time, self.finish.get(ticket.user, 0.0))
+        self.virtual_time = start
+        self.finish[ticket.user] = start + ticket.cost / ticket.weight
+        # Users who are idle and owe nothing behave exactly like new ones
+        if len(self.finish) > len(self.flows) + self.concurrency:
+            self.finish = {u: f for u, f in self.finish.items() if f > self.virtual_time or u in self.flows}
+        self.active += 1
+        if ticket.model:
+            self.running[ticket.model] += 1
+        self.record_wait(ticket.user, time.monotonic() - ticket.enqueued)
+        ticket.granted.set()
+
+    def next_ticket(self):
+        """The fair choice, unless a ticket for a loaded model may overtake it."""
+        ticket = self.pick(self.flows, self.virtual_time, self.finish)[0]
+        if self.residency is None or ticket.model is None:
+            return ticket
+        loaded = set(self.running) or self.residency.resident
+        if not loaded or ticket.model in loaded:
+            return ticket
+        if ticket.bypassed >= self.max_bypass or time.monotonic() - ticket.enqueued >= self.affinity_window:
+            metrics["ollama_affinity_starvation_grants"] += 1
+            return ticket
+        flows = {}
+        for user, flow in self.flows.items():
+            same = [t for t in flow if t.model in loaded]
+            if same:
+                flows[user] = same
+        if not flows:
+            return ticket
+        ticket.bypassed += 1
+        metrics["ollama_affinity_bypasses"] += 1
+        return self.pick(flows, self.virtual_time, self.finish)[0]
+
+    def grant_waiting(self):
+        while self.waiters and self.active < self.concurrency:
+            ticket = self.next_ticket()
+            self.leave(self.flows, ticket)
+            self.waiters.remove(ticket)
+            self.grant(ticket)
+
+    def schedule(self):
+        """Waiting tickets in the order they would be granted if nobody else arrived."""
+        flows = {user: list(flow) for user, flow in self.flows.items()}
+        virtual_time, finish = self.virtual_time, dict(self.finish)
+        order = []
+        while flows:
+            ticket, virtual_time, finish[ticket.user] = self.pick(flows, virtual_time, finish)
+            self.leave(flows, ticket)
+            order.append(ticket)
+        return order
+
+    def position(self, ticket):
+        return self.schedule().index(ticket) + 1
+
+    def record_wait(self, user, seconds):
+        waits = self.waits.pop(user, None) or deque(maxlen=200)
+        waits.append(seconds)
+        self.waits[user] = waits
+        while len(self.waits) > self.tracked_users:
+            self.waits.popitem(last=False)
+
+    def wait_percentiles(self):
+        """Per-user queue wait percentiles (seconds) over recent grants, most recent users last."""
+        result = {}
+        for user, waits in self.waits.items():
+            ordered = sorted(waits)
+            result[user] = {"grants": len(ordered)}
+            for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+                result[user][name] = round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+        return result
+
+    def estimated_wait(self, position):
+        """Seconds until a request at `position` is likely to get a slot."""
+        rounds = math.ceil(position / max(self.concurrency, 1))
+        return rounds * self.tokens_per_generation / max(self.tokens_per_second, 0.1)
+
+    def record(self, tokens, seconds, alpha=0.2):
+        """Fold a finished generation into the moving averages."""
+        if tokens <= 0 or seconds <= 0:
+            return
+        self.tokens_per_second += alpha * (tokens / seconds - self.tokens_per_second)
+        self.tokens_per_generation += alpha * (tokens - self.tokens_per_generation)
+
+    def adapt(self, tokens_per_second, ttft):
+        """Feed one generation's speed to the limiter (call while it still holds its slot)."""
+        if self.limiter is None:
+            return
+        saturated = self.active >= self.concurrency or bool(self.waiters)
+        self.concurrency = self.limiter.record(tokens_per_second, ttft, saturated)
+        self.grant_waiting()
+
+    def snapshot(self):
+        return {
+            "concurrency": self.concurrency,
+            "limiter": self.limiter.snapshot() if self.limiter is not None else None,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "queued_by_user": {user: len(flow) for user, flow in self.flows.items()},
+            "max_depth": self.max_depth,
+            "sjf": self.sjf,
+            "running_models": dict(self.running),
+            "user_waits": self.wait_percentiles(),
+            "tokens_per_second": round(self.tokens_per_second, 2),
+            "tokens_per_generation": round(self.tokens_per_generation, 1)
+        }
+
+def create_ollama_limiter():
+    if not OLLAMA_ADAPTIVE_CONCURRENCY:
+        return None
+    return AIMDLimiter(
+        OLLAMA_MAX_CONCURRENCY,
+        OLLAMA_MIN_CONCURRENCY,
+        OLLAMA_CONCURRENCY_CEILING,
+        OLLAMA_TARGET_TOKENS_PER_SECOND,
+        OLLAMA_TARGET_TTFT
+    )
+
+model_residency = ModelResidency(OLLAMA_PS_INTERVAL)
+
+ollama_queue = AdmissionQueue("ollama", OLLAMA_MAX_CONCURRENCY, OLLAMA_MAX_QUEUE_DEPTH, limiter=create_ollama_limiter(),
+                              sjf=FAIR_QUEUE_SJF, tracked_users=FAIR_QUEUE_TRACKED_USERS, residency=model_residency,
+                              affinity_window=OLLAMA_AFFINITY_WINDOW, max_bypass=OLLAMA_AFFINITY_MAX_BYPASS)
+
+def user_weight(user):
+    """Fair-queueing weight of a client_identity(), from its tier."""
+    tier = FAIR_QUEUE_USER_TIERS.get(user, FAIR_QUEUE_DEFAULT_TIER)
+    return FAIR_QUEUE_TIER_WEIGHTS.get(tier, 1.0)
+
+async def queued_ollama_response(ticket, messages, stats=None, continuation=None, deadlines=None, **kwargs):
+    """Wait for an Ollama slot, reporting queue position, then stream the response.
+
+    With a `continuation` ({"prompt", "system", "context"}) the turn goes to
+    /api/generate instead of /api/chat. The total deadline covers the wait
+    in line; the per-phase ones start once the slot is granted.
+    """
+    queue = ticket.queue
+    deadlines = deadlines or Deadlines()
+    try:
+        last_position = None
+        while not ticket.granted.is_set():
+            position = queue.position(ticket)
+            if position != last_position:
+                last_position = position
+                yield {"queue": {"position": position, "estimated_wait": round(queue.estimated_wait(position), 1)}}
+            if deadlines.remaining() <= 0:
+                metrics["deadline_total_exceeded"] += 1
+                raise DeadlineExceeded("total", deadlines.total)
+            try:
+                await asyncio.wait_for(ticket.granted.wait(), min(QUEUE_EVENT_INTERVAL, deadlines.remaining()))
+            except asyncio.TimeoutError:
+                pass
+
+        stats = {} if stats is None else stats
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        ttft = None
+        first_token_at = None
+        token_count = 0
+        warmup_manager.touch()
+        if continuation is not None:
+            metrics["ollama_context_continuations"] += 1
+            tokens = stream_ollama_generate(stats=stats, **continuation, **kwargs)
+        else:
+            tokens = stream_ollama_response(messages, stats=stats, **kwargs)
+        tokens = enforce_deadlines(tokens, deadlines)
+        try:
+            async for text in tokens:
+                if ttft is None:
+                    first_token_at = loop.time()
+                    ttft = first_token_at - started
+                token_count += 1
+                yield text
+        finally:
+            await tokens.aclose()
+        if ttft is not None:
+            load_ms = stats.get("load_duration", 0) / 1e6
+            warmup_manager.record_ttft(ttft, load_ms)
+            if queue.residency is not None:
+                queue.residency.loaded(kwargs.get("model", OLLAMA_MODEL), load_ms, load_ms > OLLAMA_COLD_LOAD_MS)
+            streamed = loop.time() - first_token_at
+            # A model load says nothing about how many generations the node can run at once
+            if token_count > 1 and streamed > 0 and load_ms <= OLLAMA_COLD_LOAD_MS:
+                queue.adapt((token_count - 1) / streamed, ttft)
+        if stats.get("eval_duration"):
+            queue.record(stats.get("eval_count", token_count), stats["eval_duration"] / 1e9)
+        else:
+            queue.record(token_count, loop.time() - started)
+    finally:
+        queue.release(ticket)
+
+# In-flight chat streams by id, for POST /api/chat/{stream_id}/cancel
+active_streams: Dict[str, ChatStream] = {}
+
+# In-process counters, exposed on /api/metrics
+metrics = Counter()
+
+class ResumableStream:
+    """An SSE body that keeps running when its client goes away, so the client can resume.
+
+    A background task numbers the frames (`id: N`) and keeps the last
+    `max_events` in a ring buffer. Listeners replay the buffer after the
+    event id they last saw and then follow live. Once no listener is left
+    the body keeps going for `grace` seconds and is stopped if nobody has
+    come back; a finished stream is kept `grace` seconds for late resumes.
+    `on_close` runs when the body is over.
+    """
+
+    def __init__(self, stream_id, body, on_close=None, grace=30.0, max_events=2048):
+        self.id = stream_id
+        self.body = body
+        self.on_close = on_close
+        self.grace = grace
+        self.frames = deque(maxlen=max_events)
+        self.last_id = 0
+        self.done = False
+        self.listeners = 0
+        self._changed = asyncio.Event()
+        self._timer = None
+        self._task = asyncio.ensure_future(self._pump())
+
+    async def _pump(self):
+        try:
+            async for frame in self.body:
+                self.last_id += 1
+                self.frames.append((self.last_id, f"id: {self.last_id}\n{frame}"))
+                self._notify()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self.body.aclose()
+            if self.on_close is not None:
+                self.on_close()
+            self.done = True
+            self._notify()
+            self._expire_later()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _expire_later(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(self.grace, self._expire)
+
+    def _expire(self):
+        self._timer = None
+        if self.listeners:
+            return
+        if self.done:
+            resumable_streams.pop(self.id, None)
+        else:
+            metrics["stream_resume_abandoned"] += 1
+            self._task.cancel()
+
+    def can_resume(self, last_event_id):
+        """Whether every event after `last_event_id` is still in the buffer."""
+        oldest = self.frames[0][0] if self.frames else self.last_id + 1
+        return 0 <= last_event_id <= self.last_id and last_event_id + 1 >= oldest
+
+    def listen(self, last_event_id=0):
+        """Attach a listener; returns (frames, leave). `leave` is idempotent, as for SharedGeneration.subscribe."""
+        self.listeners += 1
+        if self._timer is not None and not self.done:
+            self._timer.cancel()
+            self._timer = None
+        left = False
+
+        def leave():
+            nonlocal left
+            if left:
+                return
+            left = True
+            self.listeners -= 1
+            if not self.listeners:
+                self._expire_later()
+
+        return self._follow(last_event_id, leave), leave
+
+    async def _follow(self, last_seen, leave):
+        try:
+            while True:
+                changed = self._changed
+                for event_id, frame in list(self.frames):
+                    if event_id > last_seen:
+                        last_seen = event_id
+                        yield frame
+                if self.done and last_seen >= self.last_id:
+                    return
+                await changed.wait()
+        finally:
+            leave()
+
+# Resumable /api/chat bodies by stream id, for GET /api/chat/{stream_id}/events
+resumable_streams: Dict[str, ResumableStream] = {}
+
+def stream_chat_response(tokens, model_type, coalesce=False, on_close=None, max_tokens=2000, upstream=True):
+    """Wrap upstream deltas in cancellation, optional coalescing and SSE framing.
+
+    `on_close` runs once the response is over, even if the body was never
+    iterated (e.g. the client vanished before the first byte). With
+    STREAM_RESUME_ENABLED the body runs as a ResumableStream, so the
+    generation outlives a dropped connection.
+    """
+    chat_stream = ChatStream(model_type, max_tokens, upstream)
+    tokens = chat_stream.guard(tokens)
+    if coalesce:
+        tokens = coalesce_tokens(tokens)
+    body = sse_frames(tokens)
+
+    if STREAM_RESUME_ENABLED:
+        resumable = ResumableStream(chat_stream.id, body, on_close, STREAM_RESUME_GRACE, STREAM_RESUME_BUFFER_EVENTS)
+        resumable_streams[chat_stream.id] = resumable
+        frames, leave = resumable.listen()
+
+        async def detach():
+            await frames.aclose()
+            leave()
+
+        return StreamingResponse(
+            frames,
+            media_type="text/event-stream",
+            headers={"X-Stream-Id": chat_stream.id},
+            background=BackgroundTask(detach)
+        )
+
+    # The background task runs after a disconnect too, so the generator chain
+    # is closed deterministically rather than whenever it is garbage collected
+    async def close():
+        await body.aclose()
+        if on_close is not None:
+            on_close()
+
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        headers={"X-Stream-Id": chat_stream.id},
+        background=BackgroundTask(close)
+    )
+
+def normalize_messages(messages):
+    """Reduce messages to role and whitespace-normalized content."""
+    return [
+        {"role": str(m.get("role", "")).lower(), "content": " ".join(str(m.get("content", "")).split())}
+        for m in messages
+    ]
+
+def cache_key(messages, model_type, model, temperature, max_tokens):
+    """Stable hash of everything that determines a generation's output."""
+    canonical = json.dumps(
+        [normalize_messages(messages), model_type, model, temperature, max_tokens],
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Memory-bounded LRU cache of completed responses with a TTL.
+
+    Entries are the list of text deltas as the upstream produced them, so a
+    replay looks like the original stream.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, chunks, size = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return chunks
+
+    def put(self, key, chunks):
+        size = sum(len(c.encode("utf-8")) for c in chunks)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, chunks, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            metrics["chat_cache_evictions"] += 1
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def snapshot(self):
+        return {"entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes, "ttl": self.ttl}
+
+response_cache = ResponseCache(CHAT_CACHE_MAX_BYTES, CHAT_CACHE_TTL)
+
+def is_cacheable(temperature):
+    if not CHAT_CACHE_ENABLED:
+        return False
+    return temperature == 0 or not CHAT_CACHE_REQUIRE_DETERMINISTIC
+
+async def collect_response(tokens, on_complete, stats):
+    """Pass deltas through and hand the full list to each callback if the answer is complete.
+
+    `stats` is the dict given to the upstream generator; an answer counts as
+    complete only if upstream signalled it (stats["done"]) and it isn't
+    empty. Truncated, failed and cancelled streams are never cached.
+    """
+    chunks = []
+    try:
+        async for item in tokens:
+            if isinstance(item, str):
+                chunks.append(item)
+            yield item
+    finally:
+        await tokens.aclose()
+    if not stats.get("done") or not "".join(chunks).strip():
+        metrics["chat_cache_skipped_incomplete"] += 1
+        return
+    for callback in on_complete:
+        callback(chunks)
+
+async def replay_cached(chunks):
+    """Replay a cached response, optionally paced like a live generation."""
+    delay = CHAT_CACHE_REPLAY_DELAY_MS / 1000
+    for i, chunk in enumerate(chunks):
+        if delay and i:
+            await asyncio.sleep(delay)
+        metrics["chat_cache_bytes_served"] += len(chunk.encode("utf-8"))
+        yield chunk
+
+class SharedGeneration:
+    """One upstream generation fanned out to any number of subscribers.
+
+    A background task pumps the upstream tokens into a buffer; each
+    subscriber replays the buffer from the start and then follows it live,
+    so a late joiner gets the whole answer. A subscriber leaving (client
+    disconnect, cancel) only detaches it; the upstream stops once the last
+    one has left. `on_closed` runs once no one can join any more.
+    """
+
+    def __init__(self, generation, on_closed=None):
+        self.generation = generation
+        self.items = []
+        self.error = None
+        self.done = False
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._on_closed = on_closed
+        self._started = False
+        self._stopped = False
+        self._task = asyncio.ensure_future(self._pump())
+
+    async def _pump(self):
+        # A task cancelled before its first step never enters the try, so a stop
+        # that comes that early is a flag; the finally must always run
+        self._started = True
+        tokens = self.generation.tokens
+        try:
+            if self._stopped:
+                return
+            async for item in tokens:
+                self.items.append(item)
+                self._notify()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            await tokens.aclose()
+            if self.generation.on_close is not None:
+                self.generation.on_close()
+            self.done = True
+            self._notify()
+            self._close()
+
+    def _close(self):
+        if self._on_closed is not None:
+            self._on_closed()
+            self._on_closed = None
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def subscribe(self):
+        """Attach a subscriber; returns (tokens, leave).
+
+        `tokens` yields every item so far (text only; past control events
+        are stale), then follows live. `leave` detaches the subscriber and
+        is safe to call more than once; closing `tokens` calls it, but a
+        response that never starts its body must call it itself.
+        """
+        self.subscribers += 1
+        left = False
+
+        def leave():
+            nonlocal left
+            if left:
+                return
+            left = True
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                self._close()
+                self._stopped = True
+                if self._started:
+                    self._task.cancel()
+
+        return self._follow(len(self.items), leave), leave
+
+    async def _follow(self, joined_at, leave):
+        position = 0
+        try:
+            while True:
+                changed = self._changed
+                while position < len(self.items):
+                    item = self.items[position]
+                    position += 1
+                    if position > joined_at or isinstance(item, str):
+                        yield item
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            leave()
+
+class Singleflight:
+    """Share one SharedGeneration between identical in-flight requests.
+
+    The first request for a key opens the generation; requests arriving
+    while it is being opened or is streaming join it. A failure to open is
+    raised to every waiting request alike. If every waiter is cancelled
+    before subscribing, the opening (or the generation it opened) stops.
+    """
+
+    def __init__(self):
+        self.inflight = {}
+        self.waiters = Counter()
+
+    async def join(self, key, open_generation):
+        """Return (SharedGeneration, joined) for `key`, opening it with `open_generation()` if needed."""
+        entry = self.inflight.get(key)
+        joined = entry is not None
+        if entry is None:
+            entry = asyncio.ensure_future(self._open(key, open_generation))
+            self.inflight[key] = entry
+            metrics["singleflight_leaders"] += 1
+        # shield: one waiter going away must not cancel the opening others wait on
+        self.waiters[key] += 1
+        try:
+            shared = await asyncio.shield(entry)
+        except asyncio.CancelledError:
+            if self.waiters[key] == 1:
+                if not entry.done():
+                    entry.cancel()
+                elif not entry.cancelled() and entry.exception() is None:
+                    # Opened, but no one is left to subscribe; leaving stops it unless others did
+                    entry.result().subscribe()[1]()
+            raise
+        finally:
+            self.waiters[key] -= 1
+            if not self.waiters[key]:
+                del self.waiters[key]
+        if joined:
+            metrics["singleflight_joins"] += 1
+            if shared.items:
+                metrics["singleflight_late_joins"] += 1
+        return shared, joined
+
+    async def _open(self, key, open_generation):
+        try:
+            generation = await open_generation()
+        except BaseException:
+            self.inflight.pop(key, None)
+            raise
+        return SharedGeneration(generation, on_closed=lambda: self.inflight.pop(key, None))
+
+    def snapshot(self):
+        return {"enabled": CHAT_SINGLEFLIGHT, "inflight": len(self.inflight)}
+
+singleflight = Singleflight()
+
+class SemanticIndex:
+    """Cosine-similarity index over float32 vectors in a memory-mapped file.
+
+    Vectors live contiguously in `<path>.vec` (capacity x dim float32) and
+    are L2-normalized on insert, so a dot product is the cosine similarity.
+    Slot metadata (scope and answer) is appended to `<path>.jsonl`; the
+    newest line for a slot wins, and the file is compacted once it holds
+    twice as many lines as there are slots. When full, the oldest slot is
+    overwritten. Search is brute force, restricted to the query's scope.
+
+    Methods block (file I/O, vector math) and are meant to be called via
+    asyncio.to_thread; a lock serializes them.
+    """
+
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.dim = None
+        self.seq = 0
+        self.lines = 0
+        self.slots = {}
+        self.scope_slots = {}
+        self._file = None
+        self._mmap = None
+        self.vectors = None
+        self._lock = threading.Lock()
+        self.closed = False
+        self._load()
+
+    def _open(self, dim):
+        size = self.capacity * dim * 4
+        mode = "r+b" if os.path.exists(self.path + ".vec") else "w+b"
+        self._file = open(self.path + ".vec", mode)
+        if os.path.getsize(self.path + ".vec") != size:
+            self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        self.vectors = memoryview(self._mmap).cast("f")
+        self.dim = dim
+
+    def _load(self):
+        if not os.path.exists(self.path + ".jsonl"):
+            return
+        entries = {}
+        dim = None
+        with open(self.path + ".jsonl", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if dim is not None and entry["dim"] != dim:
+                    # Embedding model changed; older vectors are incomparable
+                    entries = {}
+                dim = entry["dim"]
+                entries[entry["slot"]] = entry
+                self.lines += 1
+        vec_path = self.path + ".vec"
+        if dim is None or not os.path.exists(vec_path) or os.path.getsize(vec_path) != self.capacity * dim * 4:
+            # Metadata without matching vectors can't be searched; start empty
+            logger.warning(f"Semantic cache vectors missing or resized, resetting {self.path}")
+            open(self.path + ".jsonl", "w").close()
+            self.lines = 0
+            return
+        self._open(dim)
+        for slot, entry in entries.items():
+            if slot < self.capacity:
+                self._assign(slot, entry["seq"], entry["scope"], entry["answer"])
+                self.seq = max(self.seq, entry["seq"] + 1)
+        logger.info(f"Loaded {len(self.slots)} semantic cache entries from {self.path}")
+
+    def _assign(self, slot, seq, scope, answer):
+        old = self.slots.get(slot)
+        if old is not None:
+            self.scope_slots[old[1]].discard(slot)
+        self.slots[slot] = (seq, scope, answer)
+        self.scope_slots.setdefault(scope, set()).add(slot)
+
+    @staticmethod
+    def _normalize(vector):
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def search(self, scope, vector, threshold):
+        """Return the stored answer most similar to `vector`, if above threshold."""
+        with self._lock:
+            return self._search(scope, vector, threshold)
+
+    def _search(self, scope, vector, threshold):
+        candidates = self.scope_slots.get(scope)
+        if not candidates or len(vector) != self.dim:
+            return None
+        query = self._normalize(vector)
+        dim = self.dim
+        if np is not None:
+            slots = np.fromiter(candidates, dtype=np.int64)
+            matrix = np.frombuffer(self._mmap, dtype=np.float32).reshape(self.capacity, dim)
+            scores = matrix[slots] @ np.asarray(query, dtype=np.float32)
+            best = int(np.argmax(scores))
+            best_slot, best_score = int(slots[best]), float(scores[best])
+        else:
+            best_slot, best_score = None, -1.0
+            for slot in candidates:
+                score = sum(map(operator.mul, self.vectors[slot * dim:(slot + 1) * dim], query))
+                if score > best_score:
+                    best_slot, best_score = slot, score
+        if best_score < threshold:
+            return None
+        return self.slots[best_slot][2]
+
+    def add(self, scope, vector, answer):
+        with self._lock:
+            if self.closed:
+                return
+            self._add(scope, vector, answer)
+
+    def _add(self, scope, vector, answer):
+        if self.dim is None:
+            self._open(len(vector))
+        if len(vector) != self.dim:
+            return
+        slot = self.seq % self.capacity
+        self.vectors[slot * self.dim:(slot + 1) * self.dim] = array("f", self._normalize(vector))
+        entry = {"seq": self.seq, "slot": slot, "dim": self.dim, "scope": scope, "answer": answer}
+        self._assign(slot, self.seq, scope, answer)
+        self.seq += 1
+        with open(self.path + ".jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.lines += 1
+        if self.lines > 2 * self.capacity:
+            self._compact()
+
+    def _compact(self):
+        tmp_path = self.path + ".jsonl.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for slot, (seq, scope, answer) in self.slots.items():
+                entry = {"seq": seq, "slot": slot, "dim": self.dim, "scope": scope, "answer": answer}
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path + ".jsonl")
+        self.lines = len(self.slots)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            if self._mmap is not None:
+                self.vectors.release()
+                self._mmap.flush()
+                self._mmap.close()
+                self._file.close()
+                self._mmap = None
+                self._file = None
+
+    def snapshot(self):
+        return {"entries": len(self.slots), "capacity": self.capacity, "dim": self.dim, "scopes": len(self.scope_slots)}
+
+# Created by the lifespan when SEMANTIC_CACHE_ENABLED is set
+semantic_index: Optional[SemanticIndex] = None
+
+async def embed_text(text):
+    """Embed text with the local Ollama embedding model."""
+    client = get_upstream_client("ollama")
+    response = await client.post(
+        f"{OLLAMA_API_URL}/api/embeddings",
+        json={"model": OLLAMA_EMBED_MODEL, "prompt": text, "keep_alive": OLLAMA_KEEP_ALIVE},
+        timeout=5.0
+    )
+    response.raise_for_status()
+    return response.json()["embedding"]
+
+def first_turn_question(messages):
+    """The user's question if this is the first turn, else None.
+
+    Later turns depend on the conversation so far and can't be answered from
+    a cache keyed on the last message alone.
+    """
+    user_messages = [m for m in messages if m.get("role") == "user"]
+    if len(user_messages) != 1 or messages[-1] is not user_messages[0]:
+        return None
+    return " ".join(str(user_messages[0].get("content", "")).split()) or None
+
+# Strong references to fire-and-forget tasks so they aren't garbage collected
+background_tasks = set()
+
+def run_in_background(func, *args):
+    """Run a blocking call in a worker thread without awaiting it."""
+    task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def lookup_semantic_cache(messages, language, temperature, scope):
+    """Return (answer, None) on a hit, or (None, store_callback) on a miss.
+
+    Both are None when the semantic cache doesn't apply (disabled, unknown
+    language, later turn, non-deterministic request when that is required)
+    or the embedding model is unavailable; chat then proceeds uncached.
+    """
+    if semantic_index is None or not language:
+        return None, None
+    if SEMANTIC_CACHE_REQUIRE_DETERMINISTIC and temperature != 0:
+        return None, None
+    question = first_turn_question(messages)
+    if question is None:
+        return None, None
+    try:
+        vector = await embed_text(question)
+    except Exception as e:
+        logger.debug(f"Semantic cache skipped, embedding failed: {str(e)}")
+        metrics["semantic_cache_embedding_errors"] += 1
+        return None, None
+    index = semantic_index
+    answer = await asyncio.to_thread(index.search, scope, vector, SEMANTIC_CACHE_THRESHOLD)
+    if answer is not None:
+        metrics["semantic_cache_hits"] += 1
+        return answer, None
+    metrics["semantic_cache_misses"] += 1
+    return None, lambda chunks: run_in_background(index.add, scope, vector, "".join(chunks))
+
+# Language names for the system prompt, keyed by the UI's language ids
+PROMPT_LANGUAGES = {
+    "english": "English",
+    "spanish": "Spanish",
+    "french": "French",
+    "german": "German",
+    "chinese": "Simplified Chinese",
+    "japanese": "Japanese",
+    "arabic": "Arabic",
+    "hindi": "Hindi",
+    "russian": "Russian"
+}
+
+PERSONAS = {
+    "default": (
+        "You are FemCare's assistant for women's health. Give accurate, helpful and empathetic answers "
+        "about periods, fertility, pregnancy, menopause and general wellbeing. Help users make sense of "
+        "symptoms and suggest which kind of specialist to see, but never present yourself as a replacement "
+        "for a doctor, and urge emergency care for severe pain, heavy bleeding or other alarming symptoms."
+    )
+}
+
+# One system message per (language, persona), built once and reused, so the
+# prompt prefix is byte-identical on every turn and Ollama can reuse its KV cache
+system_prefixes = {}
+
+def system_prefix(language, persona):
+    key = (
+        language if language in PROMPT_LANGUAGES else None,
+        persona if persona in PERSONAS else PROMPT_DEFAULT_PERSONA
+    )
+    prefix = system_prefixes.get(key)
+    if prefix is None:
+        content = PERSONAS[key[1]]
+        if key[0] is not None:
+            content += f" Always answer in {PROMPT_LANGUAGES[key[0]]}."
+        prefix = system_prefixes[key] = {"role": "system", "content": content}
+    return prefix
+
+def assemble_prompt(messages, language=None, persona=None):
+    """The upstream prompt: the stable system prefix, then each message's role and content.
+
+    Client-only fields (id, timestamp) are dropped; they never reach the
+    model and only bloat the payload.
+    """
+    prompt = [system_prefix(language, persona)]
+    for m in messages:
+        prompt.append({"role": m.get("role", "user"), "content": m.get("content", "")})
+    return prompt
+
+def client_identity(request):
+    """Who is asking: a hash of the bearer token if there is one, else the client IP."""
+    auth = request.headers.get("authorization", "")
+    if auth.lower().startswith("bearer ") and auth[7:].strip():
+        return "token:" + hashlib.sha256(auth[7:].strip().encode("utf-8")).hexdigest()[:16]
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+class StoredMessage:
+    """One conversation turn; roles are interned so every turn shares the same few strings."""
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        self.content = content
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content}
+
+# Rough per-message cost beyond the text itself: the slotted object and its list slot
+STORED_MESSAGE_OVERHEAD = 64
+
+class Conversation:
+    __slots__ = ("id", "user", "messages", "size")
+
+    def __init__(self, conversation_id, user, messages=()):
+        self.id = conversation_id
+        self.user = user
+        self.messages = []
+        self.size = 0
+        self.extend(messages)
+
+    def extend(self, messages):
+        for role, content in messages:
+            self.messages.append(StoredMessage(role, content))
+            self.size += STORED_MESSAGE_OVERHEAD + len(content)
+
+    def to_dicts(self):
+        return [m.to_dict() for m in self.messages]
+
+class ConversationStore:
+    """Conversations by id, written through to SQLite with an in-memory LRU in front.
+
+    Memory is bounded in total (max_bytes) and per user (user_max_bytes); the
+    least recently used conversations are dropped from memory first and
+    reloaded from SQLite when asked for again. A conversation with a write
+    still in flight is never dropped, so a reload can't miss its last turns.
+
+    The _read/_write methods block and run in worker threads; a lock
+    serializes them on the shared connection.
+    """
+
+    def __init__(self, path, max_bytes, user_max_bytes):
+        self.max_bytes = max_bytes
+        self.user_max_bytes = user_max_bytes
+        self.memory = OrderedDict()
+        self.total_bytes = 0
+        self.user_bytes = Counter()
+        self.unsaved = Counter()
+        self.writes = set()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS conversations (id TEXT PRIMARY KEY, user TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages (conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, PRIMARY KEY (conversation_id, seq)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def _read(self, conversation_id):
+        with self._lock:
+            row = self._conn.execute("SELECT user FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+            if row is None:
+                return None
+            messages = self._conn.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY seq", (conversation_id,)
+            ).fetchall()
+        return row[0], messages
+
+    def _write(self, conversation_id, user, start, messages):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO conversations (id, user) VALUES (?, ?)", (conversation_id, user))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (conversation_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(conversation_id, start + i, role, content) for i, (role, content) in enumerate(messages)]
+            )
+            self._conn.commit()
+
+    async def flush(self):
+        """Wait for every background write to land."""
+        await asyncio.gather(*self.writes, return_exceptions=True)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    async def get(self, conversation_id, user):
+        """The user's conversation, or None if it doesn't exist or belongs to someone else."""
+        conversation = self.memory.get(conversation_id)
+        if conversation is not None:
+            self.memory.move_to_end(conversation_id)
+            metrics["conversation_memory_hits"] += 1
+        else:
+            row = await asyncio.to_thread(self._read, conversation_id)
+            if row is None:
+                return None
+            metrics["conversation_disk_loads"] += 1
+            # Another request may have loaded it while we were reading
+            conversation = self.memory.get(conversation_id) or Conversation(conversation_id, row[0], row[1])
+            self._admit(conversation)
+        return conversation if conversation.user == user else None
+
+    def create(self, user):
+        conversation = Conversation(uuid.uuid4().hex, user)
+        self._admit(conversation)
+        metrics["conversations_created"] += 1
+        return conversation
+
+    def append(self, conversation, messages):
+        """Add turns in memory now and persist them in the background."""
+        start = len(conversation.messages)
+        before = conversation.size
+        rows = [(m["role"], m["content"]) for m in messages]
+        conversation.extend(rows)
+        if conversation.id in self.memory:
+            self.total_bytes += conversation.size - before
+            self.user_bytes[conversation.user] += conversation.size - before
+        self._admit(conversation)
+
+        self.unsaved[conversation.id] += 1
+
+        def saved(task):
+            self.unsaved[conversation.id] -= 1
+            if self.unsaved[conversation.id] <= 0:
+                del self.unsaved[conversation.id]
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(f"Saving conversation {conversation.id} failed: {task.exception()}")
+
+        task = asyncio.ensure_future(asyncio.to_thread(self._write, conversation.id, conversation.user, start, rows))
+        self.writes.add(task)
+        task.add_done_callback(self.writes.discard)
+        task.add_done_callback(saved)
+
+    def _admit(self, conversation):
+        if conversation.id in self.memory:
+            self.memory.move_to_end(conversation.id)
+        else:
+            self.memory[conversation.id] = conversation
+            self.total_bytes += conversation.size
+            self.user_bytes[conversation.user] += conversation.size
+        self._evict(conversation)
+
+    def _evict(self, keep):
+        user = keep.user
+        if self.user_bytes[user] > self.user_max_bytes:
+            for conversation in list(self.memory.values()):
+                if self.user_bytes[user] <= self.user_max_bytes:
+                    break
+                if conversation.user == user:
+                    self._drop(conversation, keep)
+        if self.total_bytes > self.max_bytes:
+            for conversation in list(self.memory.values()):
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self._drop(conversation, keep)
+
+    def _drop(self, conversation, keep):
+        if conversation is keep or conversation.id in self.unsaved:
+            return
+        del self.memory[conversation.id]
+        self.total_bytes -= conversation.size
+        self.user_bytes[conversation.user] -= conversation.size
+        if self.user_bytes[conversation.user] <= 0:
+            del self.user_bytes[conversation.user]
+        metrics["conversation_memory_evictions"] += 1
 
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, replace with your frontend URL
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    def snapshot(self):
+        return {
+            "in_memory": len(self.memory),
+            "memory_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "users": len(self.user_bytes),
+            "unsaved": len(self.unsaved)
+        }
 
-# Ollama API configuration
-OLLAMA_API_URL = "http://localhost:11434"
-OLLAMA_MODEL = "llama3.2"
+conversation_store: Optional[ConversationStore] = None
 
-# OpenRouter API configuration
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
-OPENROUTER_MODEL = "deepseek/deepseek-v3-base:free"
-OPENROUTER_API_KEY = "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"
+class ContinuationStore:
+    """Ollama /api/generate context arrays per conversation, LRU-bounded by bytes.
 
-if not OPENROUTER_API_KEY:
-    raise ValueError("OPENROUTER_API_KEY environment variable is not set")
+    Arrays are kept as array('i') (4 bytes a token instead of a Python int
+    object each). An entry is only valid for the conversation length and
+    (model, system prompt) it was produced with; anything else is stale and
+    the turn falls back to /api/chat with the full history.
+    """
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+    def __init__(self, max_bytes, max_tokens):
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.entries = OrderedDict()
+        self.total_bytes = 0
 
-# Chat with Ollama LLM
-async def stream_ollama_response(messages, system_prompt=None, temperature=0.7, max_tokens=2000):
-    # Prepare the request payload
-    payload = {
-        "model": OLLAMA_MODEL,
-        "messages": messages,
-        "stream": True,
-        "options": {
-            "temperature": temperature,
-            "num_predict": max_tokens
+    def get(self, conversation_id, message_count, prefix):
+        entry = self.entries.get(conversation_id)
+        if entry is None:
+            metrics["ollama_context_misses"] += 1
+            return None
+        tokens, count, entry_prefix = entry
+        if count != message_count or entry_prefix != prefix:
+            metrics["ollama_context_stale"] += 1
+            self._remove(conversation_id)
+            return None
+        self.entries.move_to_end(conversation_id)
+        metrics["ollama_context_hits"] += 1
+        return tokens
+
+    def put(self, conversation_id, context, message_count, prefix):
+        self._remove(conversation_id)
+        if len(context) > self.max_tokens:
+            # The model would truncate it anyway; /api/chat trims properly
+            metrics["ollama_context_too_long"] += 1
+            return
+        tokens = array("i", context)
+        self.entries[conversation_id] = (tokens, message_count, prefix)
+        self.total_bytes += tokens.itemsize * len(tokens)
+        while self.total_bytes > self.max_bytes and self.entries:
+            self._remove(next(iter(self.entries)))
+            metrics["ollama_context_evictions"] += 1
+
+    def _remove(self, conversation_id):
+        entry = self.entries.pop(conversation_id, None)
+        if entry is not None:
+            self.total_bytes -= entry[0].itemsize * len(entry[0])
+
+    def snapshot(self):
+        return {
+            "enabled": OLLAMA_CONTEXT_CONTINUATION,
+            "conversations": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes
         }
-    }
-    
-    if system_prompt:
-        payload["system"] = system_prompt
-    
-    async with httpx.AsyncClient() as client:
-        async with client.stream("POST", f"{OLLAMA_API_URL}/api/chat", json=payload, timeout=60.0) as response:
-            if response.status_code != 200:
-                error_detail = await response.aread()
-                raise HTTPException(status_code=response.status_code, detail=f"Ollama API error: {error_detail}")
-            
-            async for chunk in response.aiter_bytes():
-                if chunk:
-                    try:
-                        data = json.loads(chunk)
-                        if "message" in data and "content" in data["message"]:
-                            yield f"data: {json.dumps({'text': data['message']['content']})}\n\n"
-                    except json.JSONDecodeError:
-                        continue
-            
-            yield f"data: [DONE]\n\n"
 
-# New function for OpenRouter streaming
-async def stream_openrouter_response(messages, system_prompt=None, temperature=0.7, max_tokens=2000):
+continuation_store = ContinuationStore(OLLAMA_CONTEXT_MAX_BYTES, OLLAMA_CONTEXT_MAX_TOKENS)
+
+# Characters per token differ a lot by script: CJK ideographs and kana/hangul are
+# roughly a token each, Arabic and Devanagari about two characters per token,
+# Latin-script text about four.
+SCRIPT_TOKEN_COSTS = [
+    (re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]"), 1.0),
+    (re.compile(r"[\u0600-\u06ff\u0750-\u077f]"), 0.5),
+    (re.compile(r"[\u0900-\u097f]"), 0.5),
+]
+MESSAGE_TOKEN_OVERHEAD = 4
+
+def estimate_tokens(text):
+    """Cheap script-aware token estimate for budgeting, not billing."""
+    total = 0.0
+    remaining = len(text)
+    for pattern, cost in SCRIPT_TOKEN_COSTS:
+        count = len(pattern.findall(text))
+        total += count * cost
+        remaining -= count
+    return math.ceil(total + remaining / 4)
+
+def message_tokens(message):
+    return MESSAGE_TOKEN_OVERHEAD + estimate_tokens(message.get("content") or "")
+
+class ContextManager:
+    """Fit a chat history into a prompt-token budget.
+
+    Leading system messages and the newest turns are kept; older turns are
+    replaced by a summary. Summaries are cached by a hash of the turns they
+    cover and roll forward: a new summary is built from the longest cached
+    one plus the turns dropped since. Summaries are produced in the
+    background, so the request that first trims a history goes out with the
+    previous (shorter) summary, or none.
+    """
+
+    def __init__(self, max_tokens, min_recent, summary_tokens, cache_size, summarize=None, block=1):
+        self.max_tokens = max_tokens
+        self.min_recent = max(1, min_recent)
+        self.block = max(1, block)
+        self.summary_tokens = summary_tokens if summarize is not None else 0
+        self.cache_size = cache_size
+        self.summarize = summarize
+        self.summaries = OrderedDict()
+        self.pending = set()
+
+    def fit(self, messages):
+        """Return (messages, tokens_before, tokens_after)."""
+        split = 0
+        while split < len(messages) and messages[split].get("role") == "system":
+            split += 1
+        system, turns = messages[:split], messages[split:]
+        system_cost = sum(message_tokens(m) for m in system)
+        costs = [message_tokens(m) for m in turns]
+        before = system_cost + sum(costs)
+        if self.max_tokens <= 0 or before <= self.max_tokens:
+            return messages, before, before
+
+        # Walk back from the newest turn, leaving room for the summary
+        budget = self.max_tokens - system_cost - self.summary_tokens
+        cut = len(turns)
+        used = 0
+        while cut > 0 and (len(turns) - cut < self.min_recent or used + costs[cut - 1] <= budget):
+            cut -= 1
+            used += costs[cut]
+        # Round the cut up to a block boundary: the next few turns then trim at
+        # the same place and share this prompt prefix (and its summary)
+        rounded = -(-cut // self.block) * self.block
+        if len(turns) - rounded >= self.min_recent:
+            cut = rounded
+        if cut == 0:
+            return messages, before, before
+
+        summary = self._summary_for(turns[:cut])
+        fitted = list(system)
+        if summary:
+            fitted.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        fitted.extend(turns[cut:])
+        return fitted, before, sum(message_tokens(m) for m in fitted)
+
+    def _summary_for(self, dropped):
+        digest = hashlib.sha256()
+        digests = []
+        for message in dropped:
+            digest.update(json.dumps([message.get("role"), message.get("content")], ensure_ascii=False).encode("utf-8"))
+            digests.append(digest.hexdigest())
+
+        # Longest already-summarised prefix of the dropped turns
+        covered, summary = 0, None
+        for i in range(len(digests) - 1, -1, -1):
+            if digests[i] in self.summaries:
+                covered, summary = i + 1, self.summaries[digests[i]]
+                self.summaries.move_to_end(digests[i])
+                break
+        if covered < len(dropped) and self.summarize is not None and digests[-1] not in self.pending:
+            self.pending.add(digests[-1])
+            task = asyncio.ensure_future(self._extend(digests[-1], summary, dropped[covered:]))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+        return summary
+
+    async def _extend(self, key, previous, messages):
+        try:
+            summary = await self.summarize(previous, messages)
+        except Exception as e:
+            logger.debug(f"Context summary failed: {str(e)}")
+            metrics["context_summary_errors"] += 1
+            return
+        finally:
+            self.pending.discard(key)
+        if not summary:
+            return
+        self.summaries[key] = summary
+        while len(self.summaries) > self.cache_size:
+            self.summaries.popitem(last=False)
+        metrics["context_summaries_created"] += 1
+
+    def snapshot(self):
+        return {
+            "max_tokens": self.max_tokens,
+            "cached_summaries": len(self.summaries),
+            "pending_summaries": len(self.pending)
+        }
+
+async def summarize_with_ollama(previous, messages):
+    """Fold `messages` into the running summary using a spare Ollama slot.
+
+    Returns None without calling Ollama when no slot is free right away;
+    chats always take priority and the summary is retried on a later turn.
+    """
+    ticket = ollama_queue.try_acquire(model=OLLAMA_MODEL)
+    if ticket is None or not ticket.granted.is_set():
+        if ticket is not None:
+            ticket.release()
+        metrics["context_summaries_deferred"] += 1
+        return None
+    transcript = "\n".join(f"{m.get('role')}: {m.get('content')}" for m in messages)
+    if previous:
+        transcript = f"Summary so far: {previous}\n{transcript}"
+    prompt = [
+        {"role": "system", "content": "Summarise this conversation between a user and a healthcare assistant in a few sentences. "
+                                      "Keep symptoms, dates, medications and anything the user asked to remember. "
+                                      "Write in the language of the conversation."},
+        {"role": "user", "content": transcript}
+    ]
+    stats = {}
     try:
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "HTTP-Referer": "http://localhost:3000",
-            "Content-Type": "application/json"
+        tokens = stream_ollama_response(prompt, temperature=0, max_tokens=CONTEXT_SUMMARY_MAX_TOKENS, stats=stats, model=OLLAMA_MODEL)
+        chunks = [text async for text in enforce_deadlines(tokens, Deadlines())]
+    finally:
+        ticket.release()
+    return "".join(chunks).strip() if stats.get("done") else None
+
+context_manager = ContextManager(
+    CONTEXT_MAX_TOKENS,
+    CONTEXT_MIN_RECENT_MESSAGES,
+    CONTEXT_SUMMARY_MAX_TOKENS,
+    CONTEXT_SUMMARY_CACHE_SIZE,
+    summarize=summarize_with_ollama if CONTEXT_SUMMARY_ENABLED else None,
+    block=CONTEXT_TRIM_BLOCK
+)
+
+def fit_context(messages):
+    """Trim a history to the context budget, recording prompt-token metrics."""
+    fitted, before, after = context_manager.fit(messages)
+    metrics["context_prompt_tokens_before"] += before
+    metrics["context_prompt_tokens_after"] += after
+    if after < before:
+        metrics["context_trimmed_requests"] += 1
+        metrics["context_messages_dropped"] += len(messages) - len(fitted)
+    return fitted
+
+class BackendBusy(Exception):
+    """A backend refused the request up front (e.g. its queue is full)."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class BreakerOpen(BackendBusy):
+    """The backend's circuit breaker is open; rejected without calling it."""
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one upstream.
+
+    Closed: calls go through; `failure_threshold` consecutive failures open
+    it. Open: calls are rejected at once for `reset_timeout` seconds. Then
+    half-open: one trial call is let through (another one only if it hasn't
+    reported back within `reset_timeout`); its success closes the breaker,
+    its failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.trial_at = None
+
+    def allow(self):
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self.trial_at = now
+            return True
+        if self.state == "half_open":
+            if now - self.trial_at < self.reset_timeout:
+                return False
+            self.trial_at = now
+        return True
+
+    def retry_after(self):
+        if self.state == "closed":
+            return 1
+        since = time.monotonic() - (self.opened_at if self.state == "open" else self.trial_at)
+        return max(1, math.ceil(self.reset_timeout - since))
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info(f"Circuit breaker for {self.name} closed")
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            logger.warning(f"Circuit breaker for {self.name} opened after {self.failures} failures")
+            metrics[f"breaker_{self.name}_opened"] += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": self.retry_after() if self.state != "closed" else None
         }
-        
-        payload = {
-            "model": OPENROUTER_MODEL,
-            "messages": messages,
-            "stream": True,
-            "temperature": temperature,
-            "max_tokens": max_tokens
+
+class BackendHealth:
+    """Rolling error rate, time-to-first-token and in-flight count for one backend."""
+
+    def __init__(self, name):
+        self.name = name
+        self.breaker = CircuitBreaker(name, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+        self.in_flight = 0
+        self.error_rate = 0.0
+        self.ttft = None
+        self.ttft_samples = deque(maxlen=200)
+        self.requests = 0
+        self.failures = 0
+
+    def record_ttft(self, seconds, alpha=0.2):
+        self.ttft = seconds if self.ttft is None else self.ttft + alpha * (seconds - self.ttft)
+        self.ttft_samples.append(seconds)
+
+    def ttft_quantile(self, q):
+        """Quantile of recent TTFTs, or None before enough samples exist."""
+        if len(self.ttft_samples) < 20:
+            return None
+        ordered = sorted(self.ttft_samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def record_result(self, ok, alpha=0.2):
+        self.requests += 1
+        if not ok:
+            self.failures += 1
+        self.error_rate += alpha * ((0.0 if ok else 1.0) - self.error_rate)
+
+    def healthy(self):
+        if self.breaker.state == "open":
+            return False
+        prober = status_probers.get(self.name)
+        if prober is not None and prober.snapshot is not None and prober.snapshot["status"] != "online":
+            return False
+        return self.error_rate < ROUTER_MAX_ERROR_RATE
+
+    def snapshot(self):
+        p90 = self.ttft_quantile(0.9)
+        return {
+            "healthy": self.healthy(),
+            "in_flight": self.in_flight,
+            "error_rate": round(self.error_rate, 3),
+            "ttft": round(self.ttft, 3) if self.ttft is not None else None,
+            "ttft_p90": round(p90, 3) if p90 is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "breaker": self.breaker.snapshot()
         }
-        
-        logger.debug(f"Making OpenRouter request with model: {OPENROUTER_MODEL}")
-        
-        async with httpx.AsyncClient() as client:
-            async with client.stream("POST", OPENROUTER_API_URL, json=payload, headers=headers, timeout=60.0) as response:
-                if response.status_code != 200:
-                    error_detail = await response.aread()
-                    logger.error(f"OpenRouter API error: {error_detail}")
-                    raise HTTPException(status_code=response.status_code, detail=f"OpenRouter API error: {error_detail.decode()}")
-                
-                async for line in response.aiter_lines():
-                    if line.strip():
-                        if line.startswith("data: "):
-                            line = line[6:]  # Remove "data: " prefix
-                        if line == "[DONE]":
-                            yield f"data: [DONE]\n\n"
-                            break
-                        try:
-                            data = json.loads(line)
-                            if "choices" in data and len(data["choices"]) > 0:
-                                content = data["choices"][0].get("delta", {}).get("content", "")
-                                if content:
-                                    yield f"data: {json.dumps({'text': content})}\n\n"
-                        except json.JSONDecodeError:
-                            continue
+
+backend_health = {"ollama": BackendHealth("ollama"), "openrouter": BackendHealth("openrouter")}
+
+def route_candidates(requested):
+    """Backends to try in order, each with the reason it was picked.
+
+    "requested" policy: the model_type the client asked for, moved behind
+    the other backend when it is unhealthy. "prefer_local" policy: Ollama,
+    spilling to OpenRouter when Ollama is unhealthy or more than
+    ROUTER_SPILL_QUEUE_DEPTH requests are already waiting for it.
+    """
+    available = ["ollama"] + (["openrouter"] if OPENROUTER_API_KEY else [])
+    if requested not in available:
+        requested = "ollama"
+    if ROUTER_POLICY == "prefer_local":
+        primary, reason = "ollama", "preferred"
+        if len(ollama_queue.waiters) > ROUTER_SPILL_QUEUE_DEPTH and "openrouter" in available:
+            primary, reason = "openrouter", "spill:queue"
+    else:
+        primary, reason = requested, "requested"
+    if not ROUTER_FAILOVER:
+        return [(primary, reason)]
+    # Only healthy backends are worth failing over to
+    others = [b for b in available if b != primary and backend_health[b].healthy()]
+    if others and not backend_health[primary].healthy():
+        return [(others[0], "failover:unhealthy"), (primary, "failover:error")]
+    return [(primary, reason)] + [(b, "failover:error") for b in others]
+
+async def track_backend(health, tokens):
+    """Feed a backend's in-flight count, TTFT, error rate and breaker from its stream.
+
+    A client error (is_client_error) means the upstream answered fine and
+    is not counted against it, so one user's oversized history can't open
+    the breaker for everyone.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    waiting_for_first = True
+    health.in_flight += 1
+    try:
+        async for item in tokens:
+            if waiting_for_first and isinstance(item, str):
+                waiting_for_first = False
+                health.record_ttft(loop.time() - started)
+                health.breaker.record_success()
+            yield item
+        health.record_result(ok=True)
     except Exception as e:
-        logger.error(f"Error in OpenRouter streaming: {str(e)}", exc_info=True)
+        if is_client_error(e):
+            health.record_result(ok=True)
+            health.breaker.record_success()
+        else:
+            health.record_result(ok=False)
+            health.breaker.record_failure()
         raise
+    finally:
+        health.in_flight -= 1
+        await tokens.aclose()
 
-# Modified chat endpoint to support both models
-@app.post("/api/chat")
-async def chat_with_llm(request: Dict):
+async def start_stream(tokens, until_text=False, release=None):
+    """Pull the first item so upstream errors surface before any byte is sent.
+
+    With until_text, keep pulling (and buffering control events) until the
+    first text token, so a hedged racer only wins on real output. Once the
+    `release` event is set (no hedge can race this stream any more), a
+    buffered control event counts as the start, so e.g. queue positions
+    reach the client while it waits in line.
+    """
+    iterator = tokens.__aiter__()
+    primed = []
+    step = None
     try:
-        messages = request.get("messages", [])
-        model_type = request.get("model_type", "ollama")
-        
-        logger.debug(f"Received chat request - Model: {model_type}, Messages: {len(messages)}")
-        
-        if model_type == "openrouter":
-            if not OPENROUTER_API_KEY:
-                logger.error("OpenRouter API key not configured")
-                return JSONResponse(
-                    status_code=500,
-                    content={"error": "OpenRouter API key not configured in environment"}
-                )
-            
+        while True:
+            step = asyncio.ensure_future(iterator.__anext__())
+            if until_text and primed and release is not None:
+                released = asyncio.ensure_future(release.wait())
+                try:
+                    await asyncio.wait({step, released}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    released.cancel()
+                if not step.done():
+                    break
             try:
-                # Log the request (but not the API key)
-                logger.debug(f"Making OpenRouter request with {len(messages)} messages")
-                
-                # Return streaming response directly
-                return StreamingResponse(
-                    stream_openrouter_response(messages),
-                    media_type="text/event-stream"
-                )
-                    
-            except Exception as e:
-                logger.error(f"Error in OpenRouter chat: {str(e)}", exc_info=True)
-                error_message = f"Error calling OpenRouter: {str(e)}"
-                logger.error(error_message)
-                return JSONResponse(
-                    status_code=500,
-                    content={"error": error_message}
-                )
-        else:
-            # Handle Ollama case
+                item = await step
+            except StopAsyncIteration:
+                step = None
+                break
+            step = None
+            primed.append(item)
+            if not until_text or isinstance(item, str) or (release is not None and release.is_set()):
+                break
+    except BaseException:
+        # Cancelled (e.g. a losing racer) or failed: stop the pull in flight and close upstream
+        if step is not None and not step.done():
+            step.cancel()
             try:
-                return StreamingResponse(
-                    stream_ollama_response(messages),
-                    media_type="text/event-stream"
-                )
-            except Exception as e:
-                logger.error(f"Error in Ollama chat: {str(e)}", exc_info=True)
-                error_message = f"Error calling Ollama: {str(e)}"
-                logger.error(error_message)
-                return JSONResponse(
-                    status_code=500,
-                    content={"error": error_message}
-                )
+                await step
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+        await iterator.aclose()
+        raise
+
+    async def chained():
+        # `step` is the pull still in flight when a release ended the wait
+        pending = step
+        try:
+            for item in primed:
+                yield item
+            if pending is not None:
+                try:
+                    item = await pending
+                except StopAsyncIteration:
+                    return
+                finally:
+                    pending = None
+                yield item
+            if primed:
+                async for item in iterator:
+                    yield item
+        finally:
+            if pending is not None:
+                pending.cancel()
+                try:
+                    await pending
+                except (asyncio.CancelledError, StopAsyncIteration):
+                    pass
+            await iterator.aclose()
+
+    return chained()
+
+class HedgeBudget:
+    """Retry-budget style cap: each request earns `ratio` of a hedge, each hedge spends one.
+
+    Hedges can therefore never exceed `ratio` of primary requests; `max_credit`
+    bounds how many can burst after a quiet spell.
+    """
+
+    def __init__(self, ratio, max_credit=10.0):
+        self.ratio = ratio
+        self.max_credit = max_credit
+        self.credit = 0.0
+        self.requests = 0
+        self.hedges = 0
+
+    def record_request(self):
+        self.requests += 1
+        self.credit = min(self.max_credit, self.credit + self.ratio)
+
+    def try_spend(self):
+        if self.credit + 1e-9 < 1.0:
+            return False
+        self.credit -= 1.0
+        self.hedges += 1
+        return True
+
+    def snapshot(self):
+        return {
+            "enabled": HEDGE_ENABLED,
+            "budget_percent": self.ratio * 100,
+            "credit": round(self.credit, 2),
+            "requests": self.requests,
+            "hedges": self.hedges
+        }
+
+hedge_budget = HedgeBudget(HEDGE_BUDGET_PERCENT / 100)
+
+def hedge_delay(backend):
+    """Seconds to wait for the primary's first token before hedging."""
+    if HEDGE_DELAY_MS > 0:
+        return HEDGE_DELAY_MS / 1000
+    p90 = backend_health[backend].ttft_quantile(0.9)
+    if p90 is None:
+        return max(HEDGE_MIN_DELAY_MS / 1000, 1.0)
+    return max(HEDGE_MIN_DELAY_MS / 1000, p90)
+
+class Generation:
+    """An opened upstream generation: its primed token stream and how it was routed."""
+
+    def __init__(self, tokens, backend, reason, stats, on_close):
+        self.tokens = tokens
+        self.backend = backend
+        self.reason = reason
+        self.stats = stats
+        self.on_close = on_close
+
+def expected_job_tokens(messages, params):
+    """Rough size of a generation for shortest-job-first: prompt evaluation runs about
+    ten times faster than generation, so prompt tokens count a tenth."""
+    max_tokens = params.get("max_tokens") or ollama_queue.tokens_per_generation
+    return sum(message_tokens(m) for m in messages) / 10 + max_tokens
+
+def open_backend(backend, messages, params, stats, continuation=None, deadlines=None, user="anonymous"):
+    """Return (tokens, on_close) for one backend, or raise BackendBusy.
+
+    `user` is the client_identity() the Ollama queue schedules fairly by.
+    params["passthrough"] asks OpenRouter for raw events; Ollama ignores it.
+    """
+    passthrough = params.get("passthrough", False)
+    params = {k: v for k, v in params.items() if k != "passthrough"}
+    if backend == "ollama":
+        ticket = ollama_queue.try_acquire(user, user_weight(user), expected_job_tokens(messages, params), params.get("model", OLLAMA_MODEL))
+        if ticket is None:
+            metrics["ollama_queue_rejections"] += 1
+            retry_after = math.ceil(ollama_queue.estimated_wait(ollama_queue.max_depth + 1))
+            raise BackendBusy("Ollama is busy, please try again shortly", max(retry_after, 1))
+        return queued_ollama_response(ticket, messages, stats=stats, continuation=continuation, deadlines=deadlines, **params), ticket.release
+    # Log the request (but not the API key)
+    logger.debug(f"Making OpenRouter request with {len(messages)} messages")
+    # "model" picks a local model; OpenRouter always gets OPENROUTER_MODEL
+    params = {k: v for k, v in params.items() if k != "model"}
+    stream = stream_openrouter_passthrough if passthrough else stream_openrouter_response
+    return enforce_deadlines(stream(messages, stats=stats, **params), deadlines or Deadlines()), None
+
+def is_retryable(error):
+    """Transient upstream failures worth another attempt on the same backend."""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, UpstreamError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+def is_client_error(error):
+    """A 4xx caused by the request itself (400 context length, 401, 402, 404...), not by the backend's health."""
+    return isinstance(error, UpstreamError) and 400 <= error.status_code < 500 and not is_retryable(error)
+
+def retry_delay(attempt):
+    """Full-jitter exponential backoff, in seconds."""
+    cap = min(RETRY_MAX_DELAY_MS, RETRY_BASE_DELAY_MS * 2 ** attempt)
+    return random.uniform(0, cap) / 1000
+
+async def start_generation(messages, model_type, params, continuation=None, deadlines=None, user="anonymous"):
+    """Route a chat request and open it, retrying and failing over before the first byte.
+
+    Candidates are raced as tasks. A transient failure before the first
+    token is retried on the same backend up to RETRY_MAX_ATTEMPTS times
+    with jittered backoff; after that (or when the backend is busy or its
+    breaker is open) the next candidate starts. With HEDGE_ENABLED, budget
+    permitting, the next candidate also starts when the current one is still
+    silent after hedge_delay(). The first to produce output wins and every
+    other racer is cancelled at once.
+
+    When every candidate fails, raises BackendBusy if any backend was merely
+    busy or had its breaker open (so the client gets a 503 with
+    Retry-After), else the last error.
+    `continuation` is handed to Ollama only; other backends get `messages`.
+    `user` is passed to open_backend for fair queueing.
+    """
+    loop = asyncio.get_running_loop()
+    spare = route_candidates(model_type)
+    primary = spare[0][0]
+    racers = {}
+    errors = []
+    # Set once no hedge can race the current stream, see start_stream
+    release = asyncio.Event()
+
+    def launch(backend, reason, attempt=0, delay=0.0):
+        generation = Generation(None, backend, reason, {}, None)
+        generation.attempt = attempt
+
+        async def run():
+            if delay:
+                await asyncio.sleep(delay)
+            health = backend_health[backend]
+            if not health.breaker.allow():
+                metrics[f"breaker_{backend}_rejections"] += 1
+                raise BreakerOpen(f"{backend} is unavailable, please try again shortly", health.breaker.retry_after())
+            tokens, generation.on_close = open_backend(backend, messages, params, generation.stats, continuation, deadlines, user)
+            return await start_stream(track_backend(health, tokens), until_text=HEDGE_ENABLED, release=release)
+
+        racers[asyncio.ensure_future(run())] = generation
+
+    def launch_next(reason=None):
+        if not spare:
+            return False
+        backend, candidate_reason = spare.pop(0)
+        launch(backend, reason or candidate_reason)
+        return True
+
+    launch_next()
+    hedge_at = None
+    if HEDGE_ENABLED and spare:
+        hedge_budget.record_request()
+        hedge_at = loop.time() + hedge_delay(primary)
+    try:
+        while racers:
+            if hedge_at is None and len(racers) == 1:
+                release.set()
+            timeout = None if hedge_at is None else max(0.0, hedge_at - loop.time())
+            done, _ = await asyncio.wait(list(racers), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedge_at = None
+                if not spare:
+                    pass
+                elif not hedge_budget.try_spend():
+                    metrics["hedges_skipped_budget"] += 1
+                elif launch_next("hedge"):
+                    metrics["hedges_sent"] += 1
+                continue
+            winner = None
+            for task in done:
+                generation = racers.pop(task)
+                error = task.exception()
+                if error is None and winner is None:
+                    generation.tokens = task.result()
+                    winner = generation
+                    continue
+                if generation.on_close is not None:
+                    generation.on_close()
+                if error is None:
+                    await task.result().aclose()
+                    continue
+                if not isinstance(error, BackendBusy):
+                    logger.error(f"Error starting {generation.backend} chat: {str(error)}")
+                if is_retryable(error) and generation.attempt < RETRY_MAX_ATTEMPTS:
+                    metrics[f"upstream_retries_{generation.backend}"] += 1
+                    launch(generation.backend, generation.reason, generation.attempt + 1, retry_delay(generation.attempt))
+                    continue
+                errors.append(error)
+            if winner is not None:
+                metrics[f"router_{winner.backend}_{winner.reason.replace(':', '_')}"] += 1
+                if racers or winner.reason == "hedge":
+                    metrics[f"hedges_won_by_{'secondary' if winner.reason == 'hedge' else 'primary'}"] += 1
+                return winner
+            if not racers:
+                hedge_at = None
+                if launch_next():
+                    metrics["router_failovers_from_error"] += 1
+    finally:
+        # Losers (or everything, if we were cancelled) are stopped immediately
+        for task, generation in racers.items():
+            task.cancel()
+            if generation.on_close is not None:
+                generation.on_close()
+        results = await asyncio.gather(*racers, return_exceptions=True)
+        for result in results:
+            if hasattr(result, "aclose"):
+                await result.aclose()
+        if results:
+            metrics["hedge_losers_cancelled"] += len(results)
+    busy = [e for e in errors if isinstance(e, BackendBusy)]
+    raise busy[0] if busy else errors[-1]
+
+class ChatMessage(BaseModel):
+    """One chat turn as upstreams see it; UI fields such as id and timestamp are dropped."""
+
+    model_config = ConfigDict(extra="ignore")
+
+    role: Literal["system", "user", "assistant"] = "user"
+    content: str = ""
+
+class ChatRequest(BaseModel):
+    """Body of POST /api/chat. Unknown fields are ignored."""
+
+    model_config = ConfigDict(extra="ignore")
+
+    messages: List[ChatMessage] = []
+    message: Optional[ChatMessage] = None
+    conversation_id: Optional[str] = None
+    model_type: str = "ollama"
+    model: Optional[str] = None
+    language: Optional[str] = None
+    persona: Optional[str] = None
+    coalesce: bool = SSE_COALESCE
+    passthrough: bool = False
+    temperature: float = Field(0.7, ge=0.0, le=2.0)
+    max_tokens: int = Field(2000, ge=1, le=32768)
+
+    @field_validator("message", mode="before")
+    @classmethod
+    def text_message(cls, value):
+        return {"role": "user", "content": value} if isinstance(value, str) else value
+
+    @field_validator("messages")
+    @classmethod
+    def drop_greeting(cls, messages):
+        """Drop assistant turns before the first user turn: the UI's canned welcome message,
+        which the model never said and which clients resend with every request."""
+        for i, m in enumerate(messages):
+            if m.role == "user":
+                return [m for m in messages[:i] if m.role != "assistant"] + messages[i:]
+        return [m for m in messages if m.role != "assistant"]
+
+class BodyTooLarge(Exception):
+    pass
+
+async def read_body(request, limit):
+    """The request body, read chunk by chunk; raises BodyTooLarge once it passes `limit` bytes."""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > limit:
+        raise BodyTooLarge()
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise BodyTooLarge()
+    return bytes(body)
+
+class ChatRefused(Exception):
+    """A chat request turned down before any output; becomes a JSON error response."""
+
+    def __init__(self, status_code, content, headers=None, conversation=None):
+        super().__init__(content.get("error"))
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.conversation = conversation
+
+class OpenedChat:
+    """A chat answer ready to stream: its deltas and where they come from.
+
+    `backend` and `reason` are None for answers replayed from a cache.
+    `passthrough` is True when `tokens` yields RawEvents.
+    """
+
+    def __init__(self, tokens, on_close, model_type, backend=None, reason=None, conversation=None, passthrough=False):
+        self.tokens = tokens
+        self.on_close = on_close
+        self.model_type = backend or model_type
+        self.backend = backend
+        self.reason = reason
+        self.conversation = conversation
+        self.passthrough = passthrough
+
+async def open_chat(request, user, deadlines, passthrough=False):
+    """Resolve a ChatRequest into an OpenedChat, for any transport.
+
+    Old clients send the whole history as `messages`. New clients send
+    `{conversation_id, message}` (omitting conversation_id to start a new
+    conversation) and the history is rebuilt from the conversation store.
+    `model` picks one of OLLAMA_MODELS for the local backend. Raises
+    ChatRefused for anything that fails before the first byte.
+
+    With `passthrough` (and OPENROUTER_PASSTHROUGH on), an OpenRouter answer
+    is relayed as RawEvents, unless the server needs its text: for the
+    response caches or to store it in a conversation. Those requests, and
+    answers that fall back to Ollama, stream text deltas as usual.
+    """
+    model_type = request.model_type
+    temperature = request.temperature
+    max_tokens = request.max_tokens
+    language = request.language
+    persona = request.persona if request.persona in PERSONAS else PROMPT_DEFAULT_PERSONA
+    ollama_model = request.model or OLLAMA_MODEL
+    if ollama_model not in OLLAMA_MODELS:
+        raise ChatRefused(400, {"error": f"Unknown model {ollama_model}; choose one of {', '.join(OLLAMA_MODELS)}"})
+    model = OPENROUTER_MODEL if model_type == "openrouter" else ollama_model
+
+    conversation = None
+    if request.message is not None:
+        if conversation_store is None:
+            raise ChatRefused(400, {"error": "Conversation store is disabled; send the full messages history"})
+        user_message = request.message.model_dump()
+        conversation_id = request.conversation_id
+        if conversation_id:
+            conversation = await conversation_store.get(conversation_id, user)
+            if conversation is None:
+                raise ChatRefused(404, {"error": f"No conversation with id {conversation_id}"})
+        else:
+            conversation = conversation_store.create(user)
+        messages = conversation.to_dicts() + [user_message]
+    else:
+        messages = [m.model_dump() for m in request.messages]
+
+    logger.debug(f"Received chat request - Model: {model_type}, Messages: {len(messages)}")
+    messages = assemble_prompt(messages, language, persona)
+
+    # Both turns are stored together once an answer is complete, so a
+    # failed or cancelled generation leaves the conversation unchanged
+    remember = None
+    if conversation is not None:
+        def remember(chunks):
+            conversation_store.append(conversation, [user_message, {"role": "assistant", "content": "".join(chunks)}])
+
+    # Callbacks that receive the deltas of a generation that completes
+    on_complete = []
+    if is_cacheable(temperature):
+        key = cache_key(messages, model_type, model, temperature, max_tokens)
+        chunks = response_cache.get(key)
+        if chunks is not None:
+            metrics["chat_cache_hits"] += 1
+            if remember is not None:
+                remember(chunks)
+            return OpenedChat(replay_cached(chunks), None, model_type, conversation=conversation)
+        metrics["chat_cache_misses"] += 1
+        on_complete.append(lambda chunks: response_cache.put(key, chunks))
+
+    answer, store = await lookup_semantic_cache(messages, language, temperature, f"{language}:{persona}:{model_type}:{model}")
+    if answer is not None:
+        if remember is not None:
+            remember([answer])
+        return OpenedChat(replay_cached([answer]), None, model_type, conversation=conversation)
+    if store is not None:
+        on_complete.append(store)
+
+    params = {"temperature": temperature, "max_tokens": max_tokens, "model": ollama_model}
+    if passthrough and OPENROUTER_PASSTHROUGH and model_type == "openrouter" and not on_complete and remember is None:
+        params["passthrough"] = True
+    continuation = None
+    context_prefix = (ollama_model, messages[0]["content"])
+    if OLLAMA_CONTEXT_CONTINUATION and conversation is not None:
+        context = continuation_store.get(conversation.id, len(conversation.messages), context_prefix)
+        # A new conversation starts on /api/generate too, so there is a context to continue
+        if context is not None or not conversation.messages:
+            continuation = {"prompt": user_message["content"], "system": messages[0]["content"], "context": context}
+    flight_key = cache_key(messages, model_type, model, temperature, max_tokens)
+    if params.get("passthrough"):
+        flight_key += ":raw"
+    messages = fit_context(messages)
+    shared = None
+    try:
+        if CHAT_SINGLEFLIGHT:
+            shared, _ = await singleflight.join(
+                flight_key,
+                lambda: start_generation(messages, model_type, params, continuation, deadlines, user)
+            )
+            generation = shared.generation
+        else:
+            generation = await start_generation(messages, model_type, params, continuation, deadlines, user)
+    except BackendBusy as e:
+        raise ChatRefused(503, {"error": str(e)}, {"Retry-After": str(e.retry_after)}, conversation)
+    except UpstreamError as e:
+        raise ChatRefused(e.status_code, {"error": str(e.detail)}, conversation=conversation)
+    except DeadlineExceeded as e:
+        raise ChatRefused(504, {"error": str(e), "phase": e.phase}, conversation=conversation)
+    except httpx.TransportError as e:
+        raise ChatRefused(502, {"error": f"Could not reach {model_type}: {str(e) or type(e).__name__}"}, conversation=conversation)
+    except Exception as e:
+        error_message = f"Error calling {model_type}: {str(e)}"
+        logger.error(error_message)
+        raise ChatRefused(500, {"error": error_message}, conversation=conversation)
+
+    # An answer from a fallback backend must not be cached under the requested model
+    if generation.backend != model_type:
+        on_complete = []
+    if remember is not None:
+        on_complete.append(remember)
+        if OLLAMA_CONTEXT_CONTINUATION and generation.backend == "ollama":
+            def keep_context(chunks):
+                if "context" in generation.stats:
+                    continuation_store.put(conversation.id, generation.stats["context"], len(conversation.messages), context_prefix)
+            on_complete.append(keep_context)
+    if shared is not None:
+        # The shared generation releases its backend slot itself; this response only leaves it
+        tokens, on_close = shared.subscribe()
+    else:
+        tokens, on_close = generation.tokens, generation.on_close
+    if on_complete:
+        tokens = collect_response(tokens, on_complete, generation.stats)
+    passthrough = params.get("passthrough", False) and generation.backend == "openrouter"
+    if passthrough:
+        metrics["chat_passthrough_streams"] += 1
+    return OpenedChat(tokens, on_close, model_type, generation.backend, generation.reason, conversation, passthrough)
+
+# Modified chat endpoint to support both models
+@app.post("/api/chat")
+async def chat_with_llm(http_request: Request):
+    """Stream a chat answer as SSE.
+
+    The body is a ChatRequest (see open_chat). The conversation id of a
+    `{conversation_id, message}` request comes back in the X-Conversation-Id
+    header.
+    """
+    try:
+        try:
+            request = ChatRequest.model_validate_json(await read_body(http_request, CHAT_MAX_BODY_BYTES))
+        except BodyTooLarge:
+            metrics["chat_body_too_large"] += 1
+            return JSONResponse(status_code=413, content={"error": f"Request body is larger than {CHAT_MAX_BODY_BYTES} bytes"})
+        except ValidationError as e:
+            return JSONResponse(status_code=422, content={"error": "Invalid chat request", "detail": json.loads(e.json(include_url=False))})
+        deadlines = Deadlines.from_request(http_request)
+        try:
+            chat = await open_chat(request, client_identity(http_request), deadlines, request.passthrough)
+        except ChatRefused as e:
+            response = JSONResponse(status_code=e.status_code, content=e.content, headers=e.headers)
+            if e.conversation is not None:
+                response.headers["X-Conversation-Id"] = e.conversation.id
+            return response
+
+        # Raw events are already batched per upstream read; coalescing only applies to text deltas
+        coalesce = request.coalesce and not chat.passthrough
+        response = stream_chat_response(chat.tokens, chat.model_type, coalesce, on_close=chat.on_close,
+                                        max_tokens=request.max_tokens, upstream=chat.backend is not None)
+        if chat.backend is not None:
+            response.headers["X-Backend"] = chat.backend
+            response.headers["X-Route-Reason"] = chat.reason
+        if chat.conversation is not None:
+            response.headers["X-Conversation-Id"] = chat.conversation.id
+        return response
     except Exception as e:
         logger.error(f"Server error: {str(e)}", exc_info=True)
         error_message = f"Server error: {str(e)}"
@@ -177,70 +3012,494 @@ async def chat_with_llm(request: Dict):
             content={"error": error_message}
         )
 
+def compact(message):
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+class ChatSocket:
+    """One /ws/chat connection carrying any number of conversations.
+
+    Client messages are JSON objects with an `op`:
+      {"op": "chat", "c": <channel>, ...ChatRequest fields}  start an answer on channel c
+      {"op": "cancel", "c": <channel>}                        stop that answer
+      {"op": "status"}                                        backend status and queue
+    Server messages are compact JSON tagged with the channel:
+      {"c": c, "s": stream_id, "b": backend, "r": reason, "v": conversation_id}  answer started
+      {"c": c, "t": text}         a delta
+      {"c": c, "queue": {...}}    control events, as on /api/chat
+      {"c": c, "e": {...}}        an error (before or during the answer)
+      {"c": c, "d": 1}            the answer is over
+      {"op": "status", ...}       reply to a status request
+    Answers come from open_chat() and ChatStream like on /api/chat, so
+    caching, queueing, singleflight and cancellation all apply. There is no
+    Last-Event-ID resume; a closed socket stops its answers.
+    """
+
+    def __init__(self, socket, user):
+        self.socket = socket
+        self.user = user
+        self.channels = {}
+        self.outbox = asyncio.Queue()
+
+    async def run(self):
+        writer = asyncio.ensure_future(self._write())
+        try:
+            while True:
+                try:
+                    text = await self.socket.receive_text()
+                except KeyError:
+                    # starlette's receive_text on a binary frame
+                    self.send({"op": "error", "e": {"type": "bad_message", "message": "Messages must be text frames"}})
+                    continue
+                try:
+                    self.handle(json.loads(text))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    self.send({"op": "error", "e": {"type": "bad_message", "message": "Messages must be JSON objects"}})
+                except Exception as e:
+                    # One bad message must not take down the other conversations on the socket
+                    logger.error(f"Chat socket message failed: {str(e)}", exc_info=True)
+                    self.send({"op": "error", "e": {"type": "bad_message", "message": str(e)}})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            tasks = [task for task, _ in self.channels.values()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+
+    def send(self, message):
+        self.outbox.put_nowait(compact(message))
+
+    async def _write(self):
+        while True:
+            await self.socket.send_text(await self.outbox.get())
+
+    def handle(self, message):
+        op = message.get("op") if isinstance(message, dict) else None
+        channel = message.get("c") if isinstance(message, dict) else None
+        if op in ("chat", "cancel") and (not isinstance(channel, (int, str)) or isinstance(channel, bool)):
+            self.send({"op": "error", "e": {"type": "bad_message", "message": "`c` must be an integer or a string"}})
+        elif op == "chat":
+            if channel in self.channels:
+                self.send({"c": channel, "e": {"type": "channel_busy", "message": f"Channel {channel} already has an answer in progress"}})
+            elif len(self.channels) >= WS_MAX_CHANNELS:
+                self.send({"c": channel, "e": {"type": "too_many_channels", "message": f"At most {WS_MAX_CHANNELS} answers at once per connection"}})
+            else:
+                try:
+                    request = ChatRequest.model_validate(message)
+                except ValidationError as e:
+                    self.send({"c": channel, "e": {"type": "invalid_request", "status": 422, "detail": json.loads(e.json(include_url=False))}})
+                    return
+                self.channels[channel] = (asyncio.ensure_future(self._answer(channel, request)), None)
+        elif op == "cancel":
+            task, chat_stream = self.channels.get(channel, (None, None))
+            if chat_stream is not None:
+                chat_stream.cancel()
+            elif task is not None:
+                # Still routing, queued or waiting for the first token: stop opening it
+                task.cancel()
+        elif op == "status":
+            asyncio.ensure_future(self._status())
+        else:
+            self.send({"op": "error", "e": {"type": "bad_message", "message": f"Unknown op {op}"}})
+
+    async def _answer(self, channel, request):
+        metrics["ws_chat_requests"] += 1
+        try:
+            try:
+                chat = await open_chat(request, self.user, Deadlines())
+            except asyncio.CancelledError:
+                self.send({"c": channel, "d": 1})
+                raise
+            except ChatRefused as e:
+                error = {"type": "refused", "status": e.status_code, **e.content}
+                if e.headers and "Retry-After" in e.headers:
+                    error["retry_after"] = int(e.headers["Retry-After"])
+                self.send({"c": channel, "e": error})
+                return
+            chat_stream = ChatStream(chat.model_type, request.max_tokens, chat.backend is not None)
+            self.channels[channel] = (self.channels[channel][0], chat_stream)
+            tokens = chat_stream.guard(chat.tokens)
+            if request.coalesce:
+                tokens = coalesce_tokens(tokens)
+            self.send({"c": channel, "s": chat_stream.id, "b": chat.backend, "r": chat.reason,
+                       "v": chat.conversation.id if chat.conversation is not None else None})
+            try:
+                async for item in tokens:
+                    if isinstance(item, dict):
+                        self.send(dict(item, c=channel))
+                    else:
+                        self.send({"c": channel, "t": item})
+            except Exception as e:
+                logger.error(f"Chat socket answer failed mid-response: {str(e)}")
+                metrics["chat_stream_errors"] += 1
+                self.send({"c": channel, "e": stream_error(e)})
+            finally:
+                await tokens.aclose()
+                if chat.on_close is not None:
+                    chat.on_close()
+            self.send({"c": channel, "d": 1})
+        finally:
+            self.channels.pop(channel, None)
+
+    async def _status(self):
+        ollama, openrouter = await asyncio.gather(status_probers["ollama"].get(), status_probers["openrouter"].get(),
+                                                  return_exceptions=True)
+        self.send({
+            "op": "status",
+            "ollama": ollama.get("status") if isinstance(ollama, dict) else "offline",
+            "openrouter": openrouter.get("status") if isinstance(openrouter, dict) else "offline",
+            "queue": {"active": ollama_queue.active, "queued": len(ollama_queue.waiters), "concurrency": ollama_queue.concurrency},
+            "channels": len(self.channels)
+        })
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """Chat over one WebSocket, multiplexing conversations; see ChatSocket for the protocol."""
+    await websocket.accept()
+    metrics["ws_connections"] += 1
+    await ChatSocket(websocket, client_identity(websocket)).run()
+
+@app.post("/api/chat/{stream_id}/cancel")
+async def cancel_chat(stream_id: str):
+    """Stop an in-flight chat generation, e.g. from the UI's stop button."""
+    chat_stream = active_streams.get(stream_id)
+    if chat_stream is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": f"No active chat stream with id {stream_id}"}
+        )
+    chat_stream.cancel()
+    return {"status": "cancelled", "stream_id": stream_id, "tokens_emitted": chat_stream.tokens_emitted}
+
+@app.get("/api/chat/{stream_id}/events")
+async def resume_chat(stream_id: str, http_request: Request):
+    """Resume a chat stream after a dropped connection.
+
+    Replays the events after the Last-Event-ID header (or `last_event_id`
+    query parameter) from the stream's buffer, then follows it live; the
+    upstream is not contacted again.
+    """
+    resumable = resumable_streams.get(stream_id)
+    if resumable is None:
+        return JSONResponse(status_code=404, content={"error": f"No resumable chat stream with id {stream_id}"})
+    last_event_id = http_request.headers.get("last-event-id") or http_request.query_params.get("last_event_id") or "0"
+    if not last_event_id.isdigit():
+        return JSONResponse(status_code=400, content={"error": "Last-Event-ID must be an event number"})
+    if not resumable.can_resume(int(last_event_id)):
+        metrics["stream_resume_gaps"] += 1
+        return JSONResponse(status_code=410, content={"error": "Events after this id are no longer buffered; please ask again"})
+    metrics["stream_resumes"] += 1
+    frames, leave = resumable.listen(int(last_event_id))
+
+    async def detach():
+        await frames.aclose()
+        leave()
+
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        headers={"X-Stream-Id": stream_id},
+        background=BackgroundTask(detach)
+    )
+
+@app.get("/api/metrics")
+async def get_metrics():
+    return {
+        "counters": dict(metrics),
+        "active_streams": len(active_streams),
+        "resumable_streams": len(resumable_streams),
+        "queues": {"ollama": ollama_queue.snapshot()},
+        "backends": {name: health.snapshot() for name, health in backend_health.items()},
+        "hedging": hedge_budget.snapshot(),
+        "context": context_manager.snapshot(),
+        "conversations": conversation_store.snapshot() if conversation_store is not None else None,
+        "warmup": warmup_manager.snapshot(),
+        "ollama_models": model_residency.snapshot(),
+        "ollama_context": continuation_store.snapshot(),
+        "response_cache": response_cache.snapshot(),
+        "singleflight": singleflight.snapshot(),
+        "semantic_cache": semantic_index.snapshot() if semantic_index is not None else None
+    }
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
-@app.get("/api/ollama-status")
-async def check_ollama_status():
-    """Check if Ollama service is available and running."""
+async def probe_ollama():
+    """Check Ollama's version and whether the configured model is pulled."""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{OLLAMA_API_URL}/api/version", timeout=3.0)
-            
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    "status": "online",
-                    "message": "Ollama service is running",
-                    "version": data.get("version", "unknown"),
-                    "model": OLLAMA_MODEL
-                }
-            else:
-                return {
-                    "status": "offline",
-                    "message": f"Ollama service returned status code {response.status_code}"
-                }
+        client = get_upstream_client("ollama")
+        response = await client.get(f"{OLLAMA_API_URL}/api/version", timeout=3.0)
+        
+        if response.status_code == 200:
+            data = response.json()
+            snapshot = {
+                "status": "online",
+                "message": "Ollama service is running",
+                "version": data.get("version", "unknown"),
+                "model": OLLAMA_MODEL
+            }
+            tags = await client.get(f"{OLLAMA_API_URL}/api/tags", timeout=3.0)
+            if tags.status_code == 200:
+                names = {m.get("name", "") for m in tags.json().get("models", [])}
+                snapshot["model_available"] = OLLAMA_MODEL in names or f"{OLLAMA_MODEL}:latest" in names
+            return snapshot
+        else:
+            return {
+                "status": "offline",
+                "message": f"Ollama service returned status code {response.status_code}"
+            }
     except Exception as e:
         return {
             "status": "offline",
             "message": f"Failed to connect to Ollama service: {str(e)}"
         }
 
-# Add OpenRouter status endpoint
-@app.get("/api/openrouter-status")
-async def check_openrouter_status():
-    """Check if OpenRouter service is available."""
+async def probe_openrouter():
+    """Check that OpenRouter answers an authenticated models request."""
     try:
         headers = {
             "Authorization": f"Bearer {OPENROUTER_API_KEY}",
             "Content-Type": "application/json"
         }
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://openrouter.ai/api/v1/models",
-                headers=headers,
-                timeout=3.0
-            )
-            
-            if response.status_code == 200:
-                return {
-                    "status": "online",
-                    "message": "OpenRouter service is running",
-                    "model": OPENROUTER_MODEL
-                }
-            else:
-                return {
-                    "status": "offline",
-                    "message": f"OpenRouter service returned status code {response.status_code}"
-                }
+        client = get_upstream_client("openrouter")
+        response = await client.get(
+            OPENROUTER_MODELS_URL,
+            headers=headers,
+            timeout=3.0
+        )
+        
+        if response.status_code == 200:
+            return {
+                "status": "online",
+                "message": "OpenRouter service is running",
+                "model": OPENROUTER_MODEL
+            }
+        else:
+            return {
+                "status": "offline",
+                "message": f"OpenRouter service returned status code {response.status_code}"
+            }
     except Exception as e:
         return {
             "status": "offline",
             "message": f"Failed to connect to OpenRouter service: {str(e)}"
         }
 
+class StatusProber:
+    """Cached upstream status, refreshed by one background task.
+
+    Status endpoints serve the cached snapshot, so upstream status traffic
+    no longer grows with the number of open tabs. Concurrent refreshes
+    share a single in-flight probe (singleflight).
+    """
+
+    def __init__(self, name, probe, interval):
+        self.name = name
+        self.probe = probe
+        self.interval = interval
+        self.snapshot = None
+        self.checked_at = None
+        self._inflight = None
+
+    async def refresh(self):
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._run())
+        # shield: a caller going away must not cancel the probe others wait on
+        return await asyncio.shield(self._inflight)
+
+    async def _run(self):
+        try:
+            self.snapshot = await self.probe()
+            self.checked_at = time.time()
+            metrics[f"status_probes_{self.name}"] += 1
+            return self.snapshot
+        finally:
+            self._inflight = None
+
+    async def get(self):
+        """Return the snapshot with its age; probe now if it is missing or stale."""
+        if self.snapshot is None or time.time() - self.checked_at > 2 * self.interval:
+            await self.refresh()
+        return dict(self.snapshot, checked_at=datetime.fromtimestamp(self.checked_at).isoformat(), age=round(time.time() - self.checked_at, 1))
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Status probe for {self.name} failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+status_probers = {
+    "ollama": StatusProber("ollama", probe_ollama, STATUS_PROBE_INTERVAL),
+    "openrouter": StatusProber("openrouter", probe_openrouter, STATUS_PROBE_INTERVAL)
+}
+
+class WarmupManager:
+    """Keep Ollama models loaded so chats don't pay the model load.
+
+    Models are preloaded at startup, on POST /api/warmup and by keep-alive
+    pings, which run only while chats have arrived within `active_window`
+    seconds and no Ollama request went out for `interval` seconds (every
+    request refreshes keep_alive itself). Concurrent warm-ups of one model
+    share a single request.
+    """
+
+    def __init__(self, models, keep_alive, interval, active_window, cold_load_ms):
+        self.models = models
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.active_window = active_window
+        self.cold_load_ms = cold_load_ms
+        self.last_activity = None
+        self.last_request = None
+        self.loaded = {}
+        self.ttft = {"cold": deque(maxlen=200), "warm": deque(maxlen=200)}
+        self._inflight = {}
+
+    def touch(self):
+        """Note an Ollama chat request (which itself refreshes keep_alive)."""
+        self.last_activity = self.last_request = time.monotonic()
+
+    def record_ttft(self, seconds, load_ms):
+        kind = "cold" if load_ms > self.cold_load_ms else "warm"
+        self.ttft[kind].append(seconds)
+        metrics[f"ollama_{kind}_starts"] += 1
+
+    async def warm(self, model):
+        """Load `model` (a no-op for Ollama if it is resident); returns the load time in ms."""
+        if model not in self._inflight:
+            self._inflight[model] = asyncio.ensure_future(self._load(model))
+        return await asyncio.shield(self._inflight[model])
+
+    async def _load(self, model):
+        try:
+            client = get_upstream_client("ollama")
+            # Loading a model is the slow part of a first token, so it gets that deadline
+            timeout = httpx.Timeout(DEADLINE_FIRST_TOKEN, connect=DEADLINE_CONNECT)
+            if model == OLLAMA_EMBED_MODEL:
+                request = client.post(f"{OLLAMA_API_URL}/api/embeddings", json={"model": model, "prompt": "", "keep_alive": self.keep_alive}, timeout=timeout)
+            else:
+                # A generate request without a prompt just loads the model
+                request = client.post(f"{OLLAMA_API_URL}/api/generate", json={"model": model, "keep_alive": self.keep_alive}, timeout=timeout)
+            response = await request
+            response.raise_for_status()
+            load_ms = response.json().get("load_duration", 0) / 1e6
+            self.last_request = time.monotonic()
+            self.loaded[model] = time.time()
+            metrics["ollama_warmups"] += 1
+            if load_ms > self.cold_load_ms:
+                metrics["ollama_warmups_loaded_model"] += 1
+            return load_ms
+        finally:
+            del self._inflight[model]
+
+    async def warm_all(self):
+        results = await asyncio.gather(*(self.warm(m) for m in self.models), return_exceptions=True)
+        for model, result in zip(self.models, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Warming up {model} failed: {str(result)}")
+        return dict(zip(self.models, results))
+
+    async def run_forever(self, preload=True):
+        if preload:
+            await self.warm_all()
+        while True:
+            await asyncio.sleep(self.interval / 4)
+            try:
+                now = time.monotonic()
+                if self.last_activity is None or now - self.last_activity > self.active_window:
+                    continue
+                # No request has succeeded yet (e.g. the preload failed): ping now
+                if self.last_request is not None and now - self.last_request < self.interval:
+                    continue
+                metrics["ollama_keepalive_pings"] += 1
+                await self.warm_all()
+            except Exception as e:
+                logger.error(f"Ollama keep-alive failed: {str(e)}", exc_info=True)
+
+    def snapshot(self):
+        def summary(samples):
+            ordered = sorted(samples)
+            if not ordered:
+                return {"count": 0, "p50": None, "p90": None}
+            return {
+                "count": len(ordered),
+                "p50": round(ordered[len(ordered) // 2], 3),
+                "p90": round(ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))], 3)
+            }
+
+        return {
+            "models": self.models,
+            "keep_alive": self.keep_alive,
+            "loaded_at": {m: datetime.fromtimestamp(t).isoformat() for m, t in self.loaded.items()},
+            "ttft_cold": summary(self.ttft["cold"]),
+            "ttft_warm": summary(self.ttft["warm"])
+        }
+
+warmup_manager = WarmupManager(
+    OLLAMA_PRELOAD_MODELS,
+    OLLAMA_KEEP_ALIVE,
+    OLLAMA_KEEPALIVE_PING_INTERVAL,
+    OLLAMA_ACTIVE_WINDOW,
+    OLLAMA_COLD_LOAD_MS
+)
+
+@app.post("/api/warmup")
+async def warmup():
+    """Load the chat model ahead of the first message, e.g. when the chat tab opens."""
+    warmup_manager.last_activity = time.monotonic()
+    try:
+        load_ms = await warmup_manager.warm(OLLAMA_MODEL)
+    except Exception as e:
+        logger.warning(f"Warm-up of {OLLAMA_MODEL} failed: {str(e)}")
+        return JSONResponse(status_code=503, content={"model": OLLAMA_MODEL, "status": "error", "error": str(e)})
+    return {
+        "model": OLLAMA_MODEL,
+        "status": "warm",
+        "was_cold": load_ms > OLLAMA_COLD_LOAD_MS,
+        "load_ms": round(load_ms, 1)
+    }
+
+@app.get("/api/ollama-status")
+async def check_ollama_status():
+    """Check if Ollama service is available and running."""
+    return dict(await status_probers["ollama"].get(), breaker=backend_health["ollama"].breaker.snapshot())
+
+# Add OpenRouter status endpoint
+@app.get("/api/openrouter-status")
+async def check_openrouter_status():
+    """Check if OpenRouter service is available."""
+    return dict(await status_probers["openrouter"].get(), breaker=backend_health["openrouter"].breaker.snapshot())
+
+@app.get("/api/system-status")
+async def system_status():
+    """Backend, Ollama, model and OpenRouter state in one response (used by the setup guide)."""
+    ollama, openrouter = await asyncio.gather(status_probers["ollama"].get(), status_probers["openrouter"].get())
+    model_available = ollama.get("model_available", False)
+    if ollama["status"] != "online":
+        message = ollama["message"]
+    elif not model_available:
+        message = f"Model {OLLAMA_MODEL} not found, run `ollama pull {OLLAMA_MODEL}`"
+    else:
+        message = "All systems operational"
+    return {
+        "backend": "connected",
+        "ollama": "connected" if ollama["status"] == "online" else "disconnected",
+        # Key name kept for the setup guide
+        "llama3": "available" if model_available else "unavailable",
+        "openrouter": "connected" if openrouter["status"] == "online" else "disconnected",
+        "model": OLLAMA_MODEL,
+        "message": message,
+        "timestamp": datetime.now().isoformat(),
+        "details": {"ollama": ollama, "openrouter": openrouter},
+        "breakers": {name: health.breaker.snapshot() for name, health in backend_health.items()}
+    }
+
 # Run the server
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,46 @@
+import asyncio
+
+from server import AIMDLimiter, AdmissionQueue
+
+
+def test_grows_about_one_per_round_while_saturated_and_on_target():
+    limiter = AIMDLimiter(2, 1, 8, target_tps=10, target_ttft=1)
+    for _ in range(3):
+        limiter.record(20, 0.5, saturated=True)
+    assert limiter.current() == 3
+    # Good samples with spare capacity say nothing about a higher limit
+    for _ in range(10):
+        limiter.record(20, 0.5, saturated=False)
+    assert limiter.current() == 3
+
+
+def test_backs_off_at_most_once_per_round():
+    limiter = AIMDLimiter(8, 1, 16, target_tps=10, target_ttft=1)
+    for _ in range(8):
+        limiter.record(2, 0.5, saturated=True)
+    assert limiter.current() == 6
+    limiter.record(20, 5.0, saturated=True)
+    assert limiter.current() == 6
+
+
+def test_limit_stays_within_bounds_and_history_records_changes():
+    limiter = AIMDLimiter(2, 2, 3, target_tps=10, target_ttft=1)
+    for _ in range(50):
+        limiter.record(20, 0.1, saturated=True)
+    assert limiter.current() == 3
+    for _ in range(50):
+        limiter.record(1, 0.1, saturated=True)
+    assert limiter.current() == 2
+    assert [limit for _, limit in limiter.snapshot()["history"]] == [2, 3, 2]
+
+
+def test_queue_follows_limiter_and_grants_waiters():
+    async def scenario():
+        queue = AdmissionQueue("test", 99, 5, limiter=AIMDLimiter(1, 1, 4, target_tps=10, target_ttft=1))
+        first, second = queue.try_acquire(), queue.try_acquire()
+        assert queue.concurrency == 1 and not second.granted.is_set()
+        queue.adapt(20, 0.5)
+        assert queue.concurrency == 2 and second.granted.is_set()
+        assert queue.snapshot()["limiter"]["limit"] == 2
+
+    asyncio.run(scenario())
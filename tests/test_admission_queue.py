@@ -0,0 +1,61 @@
+import asyncio
+
+from server import AdmissionQueue
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_grants_up_to_concurrency_then_queues_then_rejects():
+    async def scenario():
+        queue = AdmissionQueue("test", concurrency=2, max_depth=1)
+        a, b, c = queue.try_acquire(), queue.try_acquire(), queue.try_acquire()
+        assert a.granted.is_set() and b.granted.is_set()
+        assert not c.granted.is_set() and queue.position(c) == 1
+        assert queue.try_acquire() is None
+        return queue, a, c
+
+    queue, a, c = run(scenario())
+    assert queue.active == 2
+
+
+def test_release_grants_waiters_in_fifo_order():
+    async def scenario():
+        queue = AdmissionQueue("test", concurrency=1, max_depth=5)
+        first = queue.try_acquire()
+        waiters = [queue.try_acquire() for _ in range(3)]
+        assert [queue.position(t) for t in waiters] == [1, 2, 3]
+        first.release()
+        assert waiters[0].granted.is_set() and not waiters[1].granted.is_set()
+        assert queue.position(waiters[2]) == 2
+        return queue
+
+    queue = run(scenario())
+    assert queue.active == 1 and len(queue.waiters) == 2
+
+
+def test_waiter_leaving_line_and_double_release():
+    async def scenario():
+        queue = AdmissionQueue("test", concurrency=1, max_depth=5)
+        holder = queue.try_acquire()
+        leaving, staying = queue.try_acquire(), queue.try_acquire()
+        leaving.release()
+        leaving.release()
+        assert queue.position(staying) == 1
+        holder.release()
+        holder.release()
+        assert staying.granted.is_set()
+        return queue
+
+    queue = run(scenario())
+    assert queue.active == 1 and not queue.waiters
+
+
+def test_record_moves_estimates():
+    queue = AdmissionQueue("test", concurrency=2, max_depth=5,
+                           default_tokens_per_second=10, default_tokens_per_generation=100)
+    assert queue.estimated_wait(1) == 10
+    assert queue.estimated_wait(3) == 20
+    queue.record(100, 5)
+    assert queue.tokens_per_second == 12
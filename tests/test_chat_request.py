@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from server import BodyTooLarge, ChatRequest, read_body
+
+
+def test_messages_keep_only_role_and_content_and_drop_the_greeting():
+    request = ChatRequest.model_validate_json(json.dumps({
+        "messages": [
+            {"id": "welcome-message", "role": "assistant", "content": "Hello!", "timestamp": "2024-03-01T09:00:00Z"},
+            {"id": "1", "role": "user", "content": "Is a 34 day cycle normal?", "timestamp": "2024-03-01T09:01:00Z"},
+            {"id": "2", "role": "assistant", "content": "Yes.", "timestamp": "2024-03-01T09:01:05Z"}
+        ],
+        "ui_theme": "dark"
+    }))
+    assert [m.model_dump() for m in request.messages] == [
+        {"role": "user", "content": "Is a 34 day cycle normal?"},
+        {"role": "assistant", "content": "Yes."}
+    ]
+
+
+def test_generation_params_and_text_message():
+    request = ChatRequest.model_validate({"message": "hi", "temperature": 0, "max_tokens": 50})
+    assert request.message.model_dump() == {"role": "user", "content": "hi"}
+    assert (request.temperature, request.max_tokens) == (0, 50)
+    for bad in ({"temperature": 3}, {"max_tokens": 0}, {"messages": [{"role": "tool", "content": "x"}]}):
+        with pytest.raises(ValidationError):
+            ChatRequest.model_validate(bad)
+
+
+class FakeRequest:
+    def __init__(self, chunks, content_length=None):
+        self.chunks = chunks
+        self.headers = {"content-length": str(content_length)} if content_length is not None else {}
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def test_read_body_stops_at_the_limit():
+    assert asyncio.run(read_body(FakeRequest([b"ab", b"cd"]), 4)) == b"abcd"
+    with pytest.raises(BodyTooLarge):
+        asyncio.run(read_body(FakeRequest([b"ab", b"cd", b"e"]), 4))
+    with pytest.raises(BodyTooLarge):
+        asyncio.run(read_body(FakeRequest([], content_length=5), 4))
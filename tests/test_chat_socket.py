@@ -0,0 +1,193 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+from server import ChatSocket, OpenedChat
+
+
+class FakeSocket:
+    def __init__(self):
+        self.inbox = asyncio.Queue()
+        self.sent = []
+
+    async def receive_text(self):
+        message = await self.inbox.get()
+        if message is None:
+            raise server.WebSocketDisconnect()
+        return message
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    def ask(self, **message):
+        self.inbox.put_nowait(json.dumps(message))
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    closed = []
+
+    async def open_chat(request, user, deadlines):
+        async def tokens():
+            for i in range(50):
+                await asyncio.sleep(0.005)
+                yield f"{request.messages[-1].content}{i} "
+
+        return OpenedChat(tokens(), lambda: closed.append(request.messages[-1].content), "ollama", backend="ollama")
+
+    monkeypatch.setattr(server, "open_chat", open_chat)
+    return closed
+
+
+def frames(sent, channel):
+    return [m for m in sent if m.get("c") == channel]
+
+
+def test_answers_on_different_channels_interleave_on_one_socket(answers):
+    async def scenario():
+        socket = FakeSocket()
+        session = asyncio.ensure_future(ChatSocket(socket, "ip:1").run())
+        socket.ask(op="chat", c=1, messages=[{"role": "user", "content": "a"}])
+        socket.ask(op="chat", c=2, messages=[{"role": "user", "content": "b"}])
+        while sum(1 for m in socket.sent if m.get("d")) < 2:
+            await asyncio.sleep(0.01)
+        socket.inbox.put_nowait(None)
+        await session
+        return socket.sent
+
+    sent = asyncio.run(scenario())
+    for channel, prefix in ((1, "a"), (2, "b")):
+        mine = frames(sent, channel)
+        assert mine[0]["b"] == "ollama" and mine[0]["s"]
+        assert "".join(m["t"] for m in mine if "t" in m) == "".join(f"{prefix}{i} " for i in range(50))
+        assert mine[-1] == {"c": channel, "d": 1}
+    deltas = [m["c"] for m in sent if "t" in m]
+    assert deltas.index(2) < len(deltas) - deltas[::-1].index(1) - 1
+    assert sorted(answers) == ["a", "b"]
+
+
+def test_cancel_stops_one_channel_and_leaves_the_other_running(answers):
+    async def scenario():
+        socket = FakeSocket()
+        session = asyncio.ensure_future(ChatSocket(socket, "ip:1").run())
+        socket.ask(op="chat", c="x", messages=[{"role": "user", "content": "x"}])
+        socket.ask(op="chat", c="y", messages=[{"role": "user", "content": "y"}])
+        await asyncio.sleep(0.05)
+        socket.ask(op="cancel", c="x")
+        while not any(m.get("c") == "y" and m.get("d") for m in socket.sent):
+            await asyncio.sleep(0.01)
+        socket.inbox.put_nowait(None)
+        await session
+        return socket.sent
+
+    sent = asyncio.run(scenario())
+    x, y = frames(sent, "x"), frames(sent, "y")
+    assert 0 < sum(1 for m in x if "t" in m) < 50 and x[-1] == {"c": "x", "d": 1}
+    assert sum(1 for m in y if "t" in m) == 50
+    assert sorted(answers) == ["x", "y"]
+
+
+def test_disconnect_closes_running_answers(answers):
+    async def scenario():
+        socket = FakeSocket()
+        session = asyncio.ensure_future(ChatSocket(socket, "ip:1").run())
+        socket.ask(op="chat", c=1, messages=[{"role": "user", "content": "a"}])
+        await asyncio.sleep(0.03)
+        socket.inbox.put_nowait(None)
+        await session
+
+    asyncio.run(scenario())
+    assert answers == ["a"]
+
+
+def test_invalid_requests_and_messages_get_error_frames(answers):
+    async def scenario():
+        socket = FakeSocket()
+        session = asyncio.ensure_future(ChatSocket(socket, "ip:1").run())
+        socket.ask(op="chat", c=1, messages=[{"role": "robot", "content": "a"}])
+        socket.inbox.put_nowait("not json")
+        socket.ask(op="dance")
+        await asyncio.sleep(0.02)
+        socket.inbox.put_nowait(None)
+        await session
+        return socket.sent
+
+    sent = asyncio.run(scenario())
+    assert sent[0]["c"] == 1 and sent[0]["e"]["status"] == 422
+    assert [m["e"]["type"] for m in sent[1:]] == ["bad_message", "bad_message"]
+    assert answers == []
+
+
+def test_channels_per_socket_are_capped(answers, monkeypatch):
+    monkeypatch.setattr(server, "WS_MAX_CHANNELS", 1)
+
+    async def scenario():
+        socket = FakeSocket()
+        session = asyncio.ensure_future(ChatSocket(socket, "ip:1").run())
+        socket.ask(op="chat", c=1, messages=[{"role": "user", "content": "a"}])
+        socket.ask(op="chat", c=1, messages=[{"role": "user", "content": "a"}])
+        socket.ask(op="chat", c=2, messages=[{"role": "user", "content": "b"}])
+        await asyncio.sleep(0.02)
+        socket.inbox.put_nowait(None)
+        await session
+        return socket.sent
+
+    sent = asyncio.run(scenario())
+    errors = [m["e"]["type"] for m in sent if "e" in m]
+    assert errors == ["channel_busy", "too_many_channels"]
+
+
+def test_cancel_while_the_answer_is_still_opening(monkeypatch):
+    opening = []
+
+    async def open_chat(request, user, deadlines):
+        try:
+            await asyncio.sleep(1)
+        finally:
+            opening.append("stopped")
+
+    monkeypatch.setattr(server, "open_chat", open_chat)
+
+    async def scenario():
+        socket = FakeSocket()
+        session = asyncio.ensure_future(ChatSocket(socket, "ip:1").run())
+        socket.ask(op="chat", c=1, messages=[{"role": "user", "content": "a"}])
+        await asyncio.sleep(0.02)
+        socket.ask(op="cancel", c=1)
+        await asyncio.sleep(0.02)
+        socket.inbox.put_nowait(None)
+        await session
+        return socket.sent
+
+    assert asyncio.run(scenario()) == [{"c": 1, "d": 1}]
+    assert opening == ["stopped"]
+
+
+def test_bad_channels_and_binary_frames_do_not_close_the_socket(answers):
+    async def scenario():
+        socket = FakeSocket()
+        real_receive = socket.receive_text
+
+        async def receive_text():
+            message = await real_receive()
+            if message == "binary":
+                raise KeyError("text")
+            return message
+
+        socket.receive_text = receive_text
+        session = asyncio.ensure_future(ChatSocket(socket, "ip:1").run())
+        socket.ask(op="chat", c=[1], messages=[{"role": "user", "content": "a"}])
+        socket.ask(op="cancel", c={"x": 1})
+        socket.inbox.put_nowait("binary")
+        socket.ask(op="chat", c=1, messages=[{"role": "user", "content": "a"}])
+        while not any(m.get("d") for m in socket.sent):
+            await asyncio.sleep(0.01)
+        socket.inbox.put_nowait(None)
+        await session
+        return socket.sent
+
+    sent = asyncio.run(scenario())
+    assert [m["e"]["type"] for m in sent if "e" in m] == ["bad_message"] * 3
+    assert frames(sent, 1)[-1] == {"c": 1, "d": 1}
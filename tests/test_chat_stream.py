@@ -0,0 +1,78 @@
+import asyncio
+
+import server
+from server import ChatStream
+
+
+async def endless():
+    i = 0
+    while True:
+        await asyncio.sleep(0.01)
+        yield f"t{i}"
+        i += 1
+
+
+def test_cancel_stops_stream_and_closes_upstream():
+    closed = []
+
+    async def upstream():
+        try:
+            async for text in endless():
+                yield text
+        finally:
+            closed.append(True)
+
+    async def run():
+        stream = ChatStream("openrouter", max_tokens=100)
+        out = []
+        async for text in stream.guard(upstream()):
+            out.append(text)
+            if len(out) == 3:
+                assert server.active_streams[stream.id] is stream
+                stream.cancel()
+        return stream, out
+
+    server.metrics.clear()
+    stream, out = asyncio.run(run())
+    assert len(out) == 3
+    assert closed == [True]
+    assert stream.id not in server.active_streams
+    assert server.metrics["chat_streams_ended_by_cancel_requests"] == 1
+    assert server.metrics["chat_tokens_saved_upper_bound"] == 97
+
+
+def test_cancel_while_waiting_for_upstream():
+    async def stalled():
+        await asyncio.sleep(60)
+        yield "never"
+
+    async def run():
+        stream = ChatStream("openrouter")
+        asyncio.get_running_loop().call_later(0.05, stream.cancel)
+        return [text async for text in stream.guard(stalled())]
+
+    assert asyncio.run(asyncio.wait_for(run(), 5)) == []
+
+
+def test_completed_stream_is_not_counted_as_cancelled():
+    async def run():
+        stream = ChatStream("openrouter")
+        return [text async for text in stream.guard(server.replay_cached(["a", "b"]))], stream
+
+    server.metrics.clear()
+    out, stream = asyncio.run(run())
+    assert out == ["a", "b"]
+    assert stream.finished
+    assert not any(k.startswith("chat_streams_ended_by") for k in server.metrics)
+
+
+def test_cancelled_cache_replay_saves_no_tokens():
+    async def run():
+        stream = ChatStream("ollama", upstream=False)
+        async for _ in stream.guard(endless()):
+            stream.cancel()
+
+    server.metrics.clear()
+    asyncio.run(run())
+    assert server.metrics["chat_tokens_saved_estimate"] == 0
+    assert server.metrics["chat_tokens_saved_upper_bound"] == 0
@@ -0,0 +1,124 @@
+import asyncio
+
+import httpx
+import pytest
+
+import server
+from server import BackendHealth, BreakerOpen, CircuitBreaker, UpstreamError
+
+
+@pytest.fixture(autouse=True)
+def fresh_backends(monkeypatch):
+    monkeypatch.setattr(server, "backend_health",
+                        {"ollama": BackendHealth("ollama"), "openrouter": BackendHealth("openrouter")})
+    monkeypatch.setattr(server, "status_probers", {})
+    monkeypatch.setattr(server, "ROUTER_POLICY", "requested")
+    monkeypatch.setattr(server, "ROUTER_FAILOVER", False)
+    monkeypatch.setattr(server, "HEDGE_ENABLED", False)
+    monkeypatch.setattr(server, "RETRY_BASE_DELAY_MS", 1)
+
+
+def test_breaker_opens_rejects_and_recovers(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: clock[0])
+    breaker = CircuitBreaker("ollama", failure_threshold=3, reset_timeout=10)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    clock[0] += 10
+    assert breaker.allow() and breaker.state == "half_open"
+    # Only one trial at a time
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_failed_trial_reopens():
+    breaker = CircuitBreaker("ollama", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == "half_open"
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_transient_error_before_first_token_is_retried(monkeypatch):
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise httpx.ConnectError("connection refused")
+        yield "hello"
+
+    monkeypatch.setattr(server, "open_backend", lambda *args: (flaky(), None))
+
+    async def run():
+        generation = await server.start_generation([], "ollama", {})
+        return [t async for t in generation.tokens]
+
+    assert asyncio.run(run()) == ["hello"]
+    assert len(attempts) == 3
+
+
+def test_client_errors_are_not_retried(monkeypatch):
+    attempts = []
+
+    async def bad_request():
+        attempts.append(1)
+        raise UpstreamError(404, "model not found")
+        yield
+
+    monkeypatch.setattr(server, "open_backend", lambda *args: (bad_request(), None))
+    with pytest.raises(UpstreamError):
+        asyncio.run(server.start_generation([], "ollama", {}))
+    assert len(attempts) == 1
+
+
+def test_open_breaker_rejects_without_calling_upstream(monkeypatch):
+    server.backend_health["ollama"].breaker.state = "open"
+    server.backend_health["ollama"].breaker.opened_at = server.time.monotonic()
+    monkeypatch.setattr(server, "open_backend", lambda *args: pytest.fail("upstream called"))
+    with pytest.raises(BreakerOpen) as excinfo:
+        asyncio.run(server.start_generation([], "ollama", {}))
+    assert excinfo.value.retry_after >= 1
+
+
+def test_error_after_first_byte_becomes_an_sse_event():
+    async def tokens():
+        yield "partial "
+        raise UpstreamError(502, "Ollama API error: out of memory")
+
+    async def run():
+        return [frame async for frame in server.sse_frames(tokens())]
+
+    frames = asyncio.run(run())
+    assert frames[0] == 'data: {"text": "partial "}\n\n'
+    assert '"type": "upstream_error"' in frames[1] and "out of memory" in frames[1]
+    assert frames[-1] == "data: [DONE]\n\n"
+
+
+def test_client_errors_leave_the_breaker_closed(monkeypatch):
+    async def too_long():
+        raise UpstreamError(400, "context length exceeded")
+        yield
+
+    monkeypatch.setattr(server, "open_backend", lambda *args: (too_long(), None))
+    for _ in range(server.BREAKER_FAILURE_THRESHOLD + 2):
+        with pytest.raises(UpstreamError):
+            asyncio.run(server.start_generation([], "openrouter", {}))
+    health = server.backend_health["openrouter"]
+    assert health.breaker.state == "closed" and health.healthy()
+
+
+def test_server_errors_open_the_breaker(monkeypatch):
+    async def down():
+        raise UpstreamError(503, "overloaded")
+        yield
+
+    monkeypatch.setattr(server, "open_backend", lambda *args: (down(), None))
+    monkeypatch.setattr(server, "RETRY_MAX_ATTEMPTS", 0)
+    for _ in range(server.BREAKER_FAILURE_THRESHOLD):
+        with pytest.raises((UpstreamError, BreakerOpen)):
+            asyncio.run(server.start_generation([], "openrouter", {}))
+    assert server.backend_health["openrouter"].breaker.state == "open"
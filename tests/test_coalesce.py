@@ -0,0 +1,62 @@
+import asyncio
+
+from server import coalesce_tokens
+
+
+async def source(items, delay=0.0):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+async def collect(gen):
+    return [item async for item in gen]
+
+
+def test_first_token_is_immediate_and_rest_merged():
+    out = asyncio.run(collect(coalesce_tokens(source(["a", "b", "c", "d"]), window=1.0, max_bytes=1000)))
+    assert out == ["a", "bcd"]
+
+
+def test_byte_threshold_flushes():
+    out = asyncio.run(collect(coalesce_tokens(source(["a", "bb", "cc", "dd", "e"]), window=10, max_bytes=4)))
+    assert out == ["a", "bbcc", "dde"]
+
+
+def test_window_flushes_while_upstream_idle():
+    async def slow():
+        yield "a"
+        yield "b"
+        await asyncio.sleep(0.2)
+        yield "c"
+
+    out = asyncio.run(collect(coalesce_tokens(slow(), window=0.02, max_bytes=1000)))
+    assert out == ["a", "b", "c"]
+
+
+def test_control_events_flush_buffer_in_order():
+    items = ["a", "b", {"queue": {"position": 1}}, "c"]
+    out = asyncio.run(collect(coalesce_tokens(source(items), window=10, max_bytes=1000)))
+    assert out == ["a", "b", {"queue": {"position": 1}}, "c"]
+
+
+def test_closing_early_closes_upstream():
+    closed = []
+
+    async def upstream():
+        try:
+            while True:
+                yield "x"
+                await asyncio.sleep(0)
+        finally:
+            closed.append(True)
+
+    async def run():
+        gen = coalesce_tokens(upstream(), window=10, max_bytes=2)
+        await gen.__anext__()
+        await gen.__anext__()
+        await gen.aclose()
+
+    asyncio.run(run())
+    assert closed == [True]
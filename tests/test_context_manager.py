@@ -0,0 +1,70 @@
+import asyncio
+
+from server import ContextManager, estimate_tokens
+
+
+def turns(count, text="word " * 40):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i} {text}"} for i in range(count)]
+
+
+def test_estimate_is_script_aware():
+    # Same number of characters, very different token counts
+    assert estimate_tokens("月经周期正常吗") > estimate_tokens("abcdefg")
+    assert estimate_tokens("मासिक धर्म") > estimate_tokens("monthly pe")
+
+
+def test_short_history_is_unchanged():
+    manager = ContextManager(1000, 2, 0, 10)
+    messages = turns(3)
+    fitted, before, after = manager.fit(messages)
+    assert fitted is messages and before == after
+
+
+def test_keeps_system_prompt_and_newest_turns():
+    manager = ContextManager(200, 2, 0, 10)
+    messages = [{"role": "system", "content": "be kind"}] + turns(20)
+    fitted, before, after = manager.fit(messages)
+    assert fitted[0]["content"] == "be kind"
+    assert fitted[-1] is messages[-1]
+    assert after <= 200 < before
+
+
+def test_min_recent_turns_survive_a_tiny_budget():
+    manager = ContextManager(10, 2, 0, 10)
+    fitted, _, _ = manager.fit(turns(6))
+    assert [m["content"][0] for m in fitted] == ["4", "5"]
+
+
+def test_summary_rolls_forward():
+    calls = []
+
+    async def summarize(previous, messages):
+        calls.append((previous, len(messages)))
+        return f"summary of {len(messages)} after {previous}"
+
+    async def run():
+        manager = ContextManager(300, 2, 20, 10, summarize=summarize)
+        history = turns(10)
+        fitted, _, _ = manager.fit(history)
+        assert fitted[0]["role"] != "system"  # no summary yet on the first trim
+        await asyncio.sleep(0)
+        fitted, _, _ = manager.fit(history)
+        assert fitted[0]["role"] == "system" and "summary of" in fitted[0]["content"]
+        manager.fit(turns(14))
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert calls[0][0] is None
+    # The second summary extends the first instead of re-reading every turn
+    assert calls[1][0] is not None and calls[1][1] < 10
+
+
+def test_block_trimming_keeps_the_cut_stable_across_turns():
+    manager = ContextManager(600, 2, 0, 10, block=4)
+    cuts = []
+    for count in range(12, 20):
+        history = turns(count)
+        fitted, _, _ = manager.fit(history)
+        cuts.append(history.index(fitted[0]))
+    assert all(cut % 4 == 0 for cut in cuts)
+    assert len(set(cuts)) <= 3
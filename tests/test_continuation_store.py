@@ -0,0 +1,37 @@
+from server import ContinuationStore
+
+PREFIX = ("llama3.2", "system prompt")
+
+
+def test_context_is_stored_compactly_and_returned_for_the_same_state():
+    store = ContinuationStore(1 << 20, 4096)
+    store.put("c1", [1, 2, 3], 2, PREFIX)
+    tokens = store.get("c1", 2, PREFIX)
+    assert tokens.typecode == "i" and list(tokens) == [1, 2, 3]
+    assert store.total_bytes == 3 * tokens.itemsize
+
+
+def test_stale_context_is_dropped():
+    store = ContinuationStore(1 << 20, 4096)
+    store.put("c1", [1, 2, 3], 2, PREFIX)
+    # The conversation moved on without this context (e.g. a cached answer)
+    assert store.get("c1", 4, PREFIX) is None
+    assert "c1" not in store.entries
+    store.put("c1", [1, 2, 3], 2, PREFIX)
+    assert store.get("c1", 2, ("llama3.2", "other language")) is None
+
+
+def test_least_recently_used_contexts_are_evicted_by_bytes():
+    store = ContinuationStore(100, 4096)
+    store.put("old", list(range(10)), 2, PREFIX)
+    store.put("new", list(range(10)), 2, PREFIX)
+    store.get("old", 2, PREFIX)
+    store.put("newest", list(range(10)), 2, PREFIX)
+    assert set(store.entries) == {"old", "newest"}
+    assert store.total_bytes <= 100
+
+
+def test_overlong_context_is_not_kept():
+    store = ContinuationStore(1 << 20, 8)
+    store.put("c1", list(range(9)), 2, PREFIX)
+    assert store.get("c1", 2, PREFIX) is None
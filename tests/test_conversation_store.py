@@ -0,0 +1,77 @@
+import asyncio
+import sys
+
+import pytest
+
+from server import ConversationStore
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "conversations.sqlite3")
+
+
+def turn(question, answer="ok"):
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+
+
+def test_roles_are_interned(db_path):
+    async def run():
+        store = ConversationStore(db_path, 1 << 20, 1 << 20)
+        conversation = store.create("alice")
+        store.append(conversation, turn("hi"))
+        await store.flush()
+        store.close()
+        return conversation
+
+    conversation = asyncio.run(run())
+    assert conversation.messages[0].role is sys.intern("user")
+    assert not hasattr(conversation.messages[0], "__dict__")
+
+
+def test_evicted_conversation_reloads_from_sqlite(db_path):
+    async def run():
+        store = ConversationStore(db_path, 200, 1 << 20)
+        first = store.create("alice")
+        store.append(first, turn("first question " * 5))
+        await store.flush()
+        second = store.create("bob")
+        store.append(second, turn("second question " * 5))
+        await store.flush()
+        assert first.id not in store.memory
+        reloaded = await store.get(first.id, "alice")
+        store.close()
+        return first, reloaded
+
+    first, reloaded = asyncio.run(run())
+    assert reloaded is not first
+    assert reloaded.to_dicts() == first.to_dicts()
+
+
+def test_per_user_cap_only_evicts_that_user(db_path):
+    async def run():
+        store = ConversationStore(db_path, 1 << 20, 300)
+        bob = store.create("bob")
+        store.append(bob, turn("bob"))
+        alice = [store.create("alice") for _ in range(3)]
+        for conversation in alice:
+            store.append(conversation, turn("x" * 50))
+            await store.flush()
+        store.close()
+        return store, bob, alice
+
+    store, bob, alice = asyncio.run(run())
+    assert bob.id in store.memory
+    assert alice[0].id not in store.memory and alice[-1].id in store.memory
+    assert store.user_bytes["alice"] <= 300
+
+
+def test_other_users_cannot_read_a_conversation(db_path):
+    async def run():
+        store = ConversationStore(db_path, 1 << 20, 1 << 20)
+        conversation = store.create("alice")
+        result = await store.get(conversation.id, "mallory")
+        store.close()
+        return result
+
+    assert asyncio.run(run()) is None
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from server import DeadlineExceeded, Deadlines, enforce_deadlines, metrics
+
+
+async def stream(delays):
+    for i, delay in enumerate(delays):
+        await asyncio.sleep(delay)
+        yield f"tok{i}"
+
+
+def collect(delays, **limits):
+    async def run():
+        deadlines = Deadlines(**limits)
+        got = []
+        try:
+            async for token in enforce_deadlines(stream(delays), deadlines):
+                got.append(token)
+        except DeadlineExceeded as e:
+            return got, e.phase
+        return got, None
+
+    return asyncio.run(run())
+
+
+def test_stream_within_deadlines_is_untouched():
+    assert collect([0, 0, 0], first_token=1, token_gap=1, total=1) == (["tok0", "tok1", "tok2"], None)
+
+
+@pytest.mark.parametrize("delays, limits, phase, received", [
+    ([0.2], {"first_token": 0.05}, "first_token", 0),
+    ([0, 0, 0.2], {"token_gap": 0.05}, "token_gap", 2),
+    ([0.03] * 10, {"token_gap": 0.1, "total": 0.1}, "total", 2),
+])
+def test_breach_is_reported_per_phase(delays, limits, phase, received):
+    before = metrics[f"deadline_{phase}_exceeded"]
+    got, breached = collect(delays, **limits)
+    assert breached == phase
+    assert len(got) >= received
+    assert metrics[f"deadline_{phase}_exceeded"] == before + 1
+
+
+def test_breach_closes_the_upstream():
+    closed = []
+
+    async def upstream():
+        try:
+            yield "first"
+            await asyncio.sleep(1)
+            yield "never"
+        finally:
+            closed.append(True)
+
+    async def run():
+        with pytest.raises(DeadlineExceeded):
+            async for _ in enforce_deadlines(upstream(), Deadlines(token_gap=0.05)):
+                pass
+
+    asyncio.run(run())
+    assert closed == [True]
+
+
+def test_client_header_only_shortens_the_total():
+    class FakeRequest:
+        def __init__(self, headers):
+            self.headers = headers
+
+    async def run():
+        short = Deadlines.from_request(FakeRequest({"x-deadline-ms": "1500"}))
+        long = Deadlines.from_request(FakeRequest({"x-deadline-ms": "999999999"}))
+        junk = Deadlines.from_request(FakeRequest({"x-deadline-ms": "soon"}))
+        return short.total, long.total, junk.total
+
+    short, long, junk = asyncio.run(run())
+    assert short == 1.5
+    assert long == junk and long > 1.5
@@ -0,0 +1,78 @@
+import asyncio
+
+from server import AdmissionQueue
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def fill(queue, arrivals):
+    return [queue.try_acquire(user, weight, size) for user, weight, size in arrivals]
+
+
+def grant_all(queue, holder, tickets):
+    """Release the single slot over and over, returning the users in grant order."""
+    order = []
+    current = holder
+    while queue.waiters:
+        current.release()
+        current = next(t for t in tickets if t.granted.is_set() and not t.released)
+        order.append(current.user)
+    return order
+
+
+def test_heavy_user_cannot_starve_a_light_one():
+    async def scenario():
+        queue = AdmissionQueue("test", 1, 20)
+        holder = queue.try_acquire("heavy")
+        tickets = fill(queue, [("heavy", 1, None)] * 6 + [("light", 1, None)])
+        # Arrived last, but the light user has had no grants yet
+        assert queue.position(tickets[-1]) <= 2
+        return grant_all(queue, holder, tickets)
+
+    order = run(scenario())
+    assert order.index("light") <= 1
+
+
+def test_weights_share_grants_in_proportion():
+    async def scenario():
+        queue = AdmissionQueue("test", 1, 20)
+        holder = queue.try_acquire("x")
+        tickets = fill(queue, [("premium", 4, None)] * 8 + [("standard", 1, None)] * 8)
+        return grant_all(queue, holder, tickets)
+
+    order = run(scenario())
+    assert order[:10].count("premium") == 8
+
+
+def test_sjf_serves_a_users_short_jobs_first_and_favours_short_users():
+    async def scenario():
+        queue = AdmissionQueue("test", 1, 20, sjf=True)
+        queue.try_acquire("x")
+        tickets = fill(queue, [("a", 1, 2000), ("a", 1, 100), ("b", 1, 500)])
+        return [queue.position(t) for t in tickets]
+
+    assert run(scenario()) == [3, 1, 2]
+
+
+def test_without_sjf_sizes_are_ignored():
+    async def scenario():
+        queue = AdmissionQueue("test", 1, 20)
+        queue.try_acquire("x")
+        tickets = fill(queue, [("a", 1, 2000), ("a", 1, 100)])
+        return [queue.position(t) for t in tickets]
+
+    assert run(scenario()) == [1, 2]
+
+
+def test_wait_percentiles_per_user_and_bounded():
+    async def scenario():
+        queue = AdmissionQueue("test", 8, 5, tracked_users=2)
+        for user in ("a", "b", "c", "c"):
+            queue.try_acquire(user).release()
+        return queue.snapshot()["user_waits"]
+
+    waits = run(scenario())
+    assert list(waits) == ["b", "c"]
+    assert waits["c"]["grants"] == 2 and waits["c"]["p99"] >= 0
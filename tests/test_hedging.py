@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+import server
+from server import BackendHealth, HedgeBudget
+
+
+@pytest.fixture(autouse=True)
+def hedging(monkeypatch):
+    monkeypatch.setattr(server, "backend_health",
+                        {"ollama": BackendHealth("ollama"), "openrouter": BackendHealth("openrouter")})
+    monkeypatch.setattr(server, "status_probers", {})
+    monkeypatch.setattr(server, "ROUTER_POLICY", "requested")
+    monkeypatch.setattr(server, "ROUTER_FAILOVER", True)
+    monkeypatch.setattr(server, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(server, "HEDGE_DELAY_MS", 20)
+
+
+def backends(monkeypatch, delays, closed):
+    async def stream(name):
+        try:
+            yield {"queue": {"position": 1}}
+            await asyncio.sleep(delays[name])
+            yield f"{name} says hi"
+        finally:
+            closed.append(name)
+
+    def open_backend(backend, messages, params, stats, continuation=None, deadlines=None, user=None):
+        return stream(backend), None
+
+    monkeypatch.setattr(server, "open_backend", open_backend)
+
+
+def test_budget_caps_hedges_to_ratio():
+    budget = HedgeBudget(0.1)
+    sent = 0
+    for _ in range(100):
+        budget.record_request()
+        sent += budget.try_spend()
+    assert sent == 10
+
+
+def test_slow_primary_is_hedged_and_cancelled(monkeypatch):
+    closed = []
+    backends(monkeypatch, {"ollama": 5.0, "openrouter": 0.0}, closed)
+    monkeypatch.setattr(server, "hedge_budget", HedgeBudget(1.0))
+
+    async def run():
+        generation = await server.start_generation([], "ollama", {})
+        assert closed == ["ollama"]
+        return generation, [t async for t in generation.tokens]
+
+    generation, tokens = asyncio.run(run())
+    assert generation.reason == "hedge"
+    assert tokens == [{"queue": {"position": 1}}, "openrouter says hi"]
+
+
+def test_no_hedge_without_budget(monkeypatch):
+    closed = []
+    backends(monkeypatch, {"ollama": 0.1, "openrouter": 0.0}, closed)
+    monkeypatch.setattr(server, "hedge_budget", HedgeBudget(0.0))
+
+    async def run():
+        generation = await server.start_generation([], "ollama", {})
+        return generation, [t async for t in generation.tokens]
+
+    generation, tokens = asyncio.run(run())
+    assert generation.backend == "ollama"
+    assert tokens[-1] == "ollama says hi"
+    assert "openrouter" not in closed
+
+
+def test_queue_events_are_not_held_back_when_no_hedge_can_launch(monkeypatch):
+    closed = []
+    backends(monkeypatch, {"ollama": 5.0, "openrouter": 0.0}, closed)
+    monkeypatch.setattr(server, "ROUTER_FAILOVER", False)
+
+    async def run():
+        generation = await asyncio.wait_for(server.start_generation([], "ollama", {}), 0.5)
+        first = await generation.tokens.__anext__()
+        await generation.tokens.aclose()
+        return first
+
+    assert asyncio.run(run()) == {"queue": {"position": 1}}
+    assert closed == ["ollama"]
+
+
+def test_queue_events_are_released_once_the_hedge_is_skipped(monkeypatch):
+    closed = []
+    backends(monkeypatch, {"ollama": 0.3, "openrouter": 0.0}, closed)
+    monkeypatch.setattr(server, "hedge_budget", HedgeBudget(0.0))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        generation = await server.start_generation([], "ollama", {})
+        opened_after = loop.time() - started
+        return opened_after, [t async for t in generation.tokens]
+
+    opened_after, tokens = asyncio.run(run())
+    assert opened_after < 0.2
+    assert tokens == [{"queue": {"position": 1}}, "ollama says hi"]
+    assert closed == ["ollama"]
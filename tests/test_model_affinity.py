@@ -0,0 +1,84 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+from server import AdmissionQueue, ModelResidency, model_tag
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def affinity_queue(resident, window=10.0, max_bypass=8):
+    residency = ModelResidency(5)
+    residency.resident = {model_tag(m) for m in resident}
+    return AdmissionQueue("test", 1, 10, residency=residency, affinity_window=window, max_bypass=max_bypass)
+
+
+def test_request_for_loaded_model_overtakes_one_that_would_swap():
+    async def scenario():
+        queue = affinity_queue(["llama3.2"])
+        holder = queue.try_acquire("x", model="llama3.2")
+        other = queue.try_acquire("a", model="qwen2.5")
+        same = queue.try_acquire("b", model="llama3.2")
+        holder.release()
+        return other.granted.is_set(), same.granted.is_set(), other.bypassed
+
+    assert run(scenario()) == (False, True, 1)
+
+
+def test_anti_starvation_limits_bypasses_and_wait():
+    async def scenario():
+        queue = affinity_queue(["llama3.2"], max_bypass=1)
+        holder = queue.try_acquire("x", model="llama3.2")
+        other = queue.try_acquire("a", model="qwen2.5")
+        first, second = queue.try_acquire("b", model="llama3.2"), queue.try_acquire("c", model="llama3.2")
+        holder.release()
+        first.release()
+        assert other.granted.is_set() and not second.granted.is_set()
+
+        queue = affinity_queue(["llama3.2"], window=0)
+        holder = queue.try_acquire("x", model="llama3.2")
+        other = queue.try_acquire("a", model="qwen2.5")
+        queue.try_acquire("b", model="llama3.2")
+        holder.release()
+        assert other.granted.is_set()
+
+    run(scenario())
+
+
+def test_without_residency_grants_stay_fair():
+    async def scenario():
+        queue = AdmissionQueue("test", 1, 10)
+        holder = queue.try_acquire("x", model="llama3.2")
+        other = queue.try_acquire("a", model="qwen2.5")
+        queue.try_acquire("b", model="llama3.2")
+        holder.release()
+        return other.granted.is_set()
+
+    assert run(scenario())
+
+
+def test_cold_load_of_another_model_counts_as_a_swap():
+    residency = ModelResidency(5)
+    residency.loaded("llama3.2", 3000, cold=True)
+    assert residency.resident == {"llama3.2:latest"} and not residency.swaps
+    residency.loaded("qwen2.5:7b", 2000, cold=True)
+    residency.loaded("qwen2.5:7b", 0, cold=False)
+    snapshot = residency.snapshot()
+    assert snapshot["resident"] == ["qwen2.5:7b"]
+    assert snapshot["swaps"] == {"qwen2.5:7b": 1} and snapshot["swap_seconds"] == 2.0
+
+
+def test_first_configured_model_is_the_default_everywhere():
+    code = (
+        "import server\n"
+        "print(server.OLLAMA_MODEL, server.OLLAMA_PRELOAD_MODELS, server.warmup_manager.models,"
+        " server.stream_ollama_response.__defaults__[-1])\n"
+    )
+    env = dict(os.environ, OLLAMA_MODELS="qwen2.5, llama3.2")
+    env.pop("OLLAMA_PRELOAD_MODELS", None)
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True).stdout
+    assert out.split("\n")[-2] == "qwen2.5 ['qwen2.5'] ['qwen2.5'] qwen2.5"
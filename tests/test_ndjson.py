@@ -0,0 +1,40 @@
+import json
+
+from server import NDJSONDecoder
+
+
+def encode(objects):
+    return ("\n".join(json.dumps(o, ensure_ascii=False) for o in objects) + "\n").encode("utf-8")
+
+
+def decode_all(chunks):
+    decoder = NDJSONDecoder()
+    objects = []
+    for chunk in chunks:
+        objects.extend(decoder.feed(chunk))
+    objects.extend(decoder.flush())
+    return objects
+
+
+def test_several_lines_in_one_chunk():
+    objects = [{"n": i} for i in range(5)]
+    assert decode_all([encode(objects)]) == objects
+
+
+def test_line_split_across_chunks():
+    data = encode([{"text": "hello"}, {"text": "world"}])
+    assert decode_all([data[:7], data[7:15], data[15:]]) == [{"text": "hello"}, {"text": "world"}]
+
+
+def test_multibyte_character_split_byte_by_byte():
+    objects = [{"text": "月经 période دورة मासिक"}] * 3
+    data = encode(objects)
+    assert decode_all([data[i:i + 1] for i in range(len(data))]) == objects
+
+
+def test_final_line_without_newline_is_flushed():
+    assert decode_all([b'{"a": 1}\n{"b": 2}']) == [{"a": 1}, {"b": 2}]
+
+
+def test_blank_and_malformed_lines_are_skipped():
+    assert decode_all([b'\n{"a": 1}\n{broken\n\n{"b": 2}\n']) == [{"a": 1}, {"b": 2}]
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import random
+
+import httpx
+import pytest
+
+import server
+from server import ChatRequest, Deadlines, Generation, RawEvents, UpstreamError
+
+
+def chunk(content, role=None):
+    delta = {"content": content} if role is None else {"role": role, "content": content}
+    return "data: " + json.dumps({"id": "gen-1", "choices": [{"index": 0, "delta": delta}]}, separators=(",", ":"), ensure_ascii=False) + "\n\n"
+
+
+WORDS = ["Cramps ", "are ", "normal. ", "月经 ", 'say "hi" ', "data: [DONE] ", '"error": none ', "\n"]
+EVENTS = [": OPENROUTER PROCESSING\n\n", chunk("", role="assistant")] + [chunk(w) for w in WORDS] + ["data: [DONE]\n\n"]
+
+
+def upstream(monkeypatch, events, seed=0):
+    body = "".join(events).encode("utf-8")
+    rng = random.Random(seed)
+
+    async def fragments():
+        pos = 0
+        while pos < len(body):
+            size = rng.randint(1, 40)
+            yield body[pos:pos + size]
+            pos += size
+
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=fragments()))
+    monkeypatch.setattr(server, "upstream_clients", {"openrouter": httpx.AsyncClient(transport=transport)})
+
+
+async def collect(tokens):
+    return [item async for item in tokens]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fragmented_events_are_relayed_verbatim_and_counted(monkeypatch, seed):
+    upstream(monkeypatch, EVENTS, seed)
+    stats = {}
+    items = asyncio.run(collect(server.stream_openrouter_passthrough([], stats=stats)))
+    assert all(isinstance(item, RawEvents) for item in items)
+    assert "".join(items) == "".join(EVENTS[:-1])
+    assert sum(item.tokens for item in items) == len(WORDS)
+    assert stats["done"]
+
+
+def test_relayed_text_matches_the_parsing_path(monkeypatch):
+    upstream(monkeypatch, EVENTS)
+    parsed = asyncio.run(collect(server.stream_openrouter_response([])))
+    upstream(monkeypatch, EVENTS)
+    raw = "".join(asyncio.run(collect(server.stream_openrouter_passthrough([]))))
+    deltas = [json.loads(line[6:])["choices"][0]["delta"]["content"] for line in raw.split("\n") if line.startswith("data: ")]
+    assert "".join(deltas) == "".join(parsed) == "".join(WORDS)
+
+
+def test_error_event_raises_after_the_deltas_before_it(monkeypatch):
+    error = 'data: {"id":"gen-1","error":{"code":429,"message":"Rate limited"}}\n\n'
+    upstream(monkeypatch, [chunk("one "), chunk("two "), error, chunk("never ")])
+
+    async def scenario():
+        items = []
+        with pytest.raises(UpstreamError) as raised:
+            async for item in server.stream_openrouter_passthrough([]):
+                items.append(item)
+        return items, raised.value
+
+    items, error = asyncio.run(scenario())
+    assert "".join(items) == chunk("one ") + chunk("two ")
+    assert error.status_code == 502 and "Rate limited" in error.detail
+
+
+def test_truncated_stream_is_not_done(monkeypatch):
+    upstream(monkeypatch, [chunk("one "), chunk("two ")])
+    stats = {}
+    items = asyncio.run(collect(server.stream_openrouter_passthrough([], stats=stats)))
+    assert sum(item.tokens for item in items) == 2 and "done" not in stats
+
+
+def test_sse_frames_send_raw_events_unchanged_and_guard_counts_their_deltas():
+    async def tokens():
+        yield RawEvents(chunk("a") + chunk("b"), 2)
+        yield RawEvents(chunk("c"), 1)
+
+    async def scenario():
+        stream = server.ChatStream("openrouter")
+        frames = await collect(server.sse_frames(stream.guard(tokens())))
+        return frames, stream.tokens_emitted
+
+    frames, emitted = asyncio.run(scenario())
+    assert frames == [chunk("a") + chunk("b"), chunk("c"), "data: [DONE]\n\n"]
+    assert emitted == 3
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    seen = []
+
+    async def start_generation(messages, model_type, params, continuation=None, deadlines=None, user="anonymous"):
+        seen.append(params)
+
+        async def tokens():
+            yield "hi"
+
+        return Generation(tokens(), model_type, "requested", {}, None)
+
+    monkeypatch.setattr(server, "start_generation", start_generation)
+    monkeypatch.setattr(server, "CHAT_SINGLEFLIGHT", False)
+    monkeypatch.setattr(server, "OPENROUTER_PASSTHROUGH", True)
+    return seen
+
+
+def open_chat(body, passthrough=True):
+    request = ChatRequest.model_validate({"messages": [{"role": "user", "content": "hello"}], **body})
+
+    async def scenario():
+        return await server.open_chat(request, "ip:1", Deadlines(), passthrough)
+
+    return asyncio.run(scenario())
+
+
+def test_passthrough_is_used_only_for_openrouter_answers_nobody_needs_the_text_of(opened, monkeypatch):
+    assert open_chat({"model_type": "openrouter"}).passthrough
+    assert not open_chat({"model_type": "openrouter"}, passthrough=False).passthrough
+    assert not open_chat({"model_type": "ollama"}).passthrough
+    # temperature 0 is cacheable, so the server needs the text
+    assert not open_chat({"model_type": "openrouter", "temperature": 0}).passthrough
+    monkeypatch.setattr(server, "OPENROUTER_PASSTHROUGH", False)
+    assert not open_chat({"model_type": "openrouter"}).passthrough
+    assert [p.get("passthrough", False) for p in opened] == [True, False, False, False, False]
+
+
+def upstream_reads(monkeypatch, reads):
+    async def body():
+        for read in reads:
+            yield read.encode("utf-8")
+
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body()))
+    monkeypatch.setattr(server, "upstream_clients", {"openrouter": httpx.AsyncClient(transport=transport)})
+
+
+FINISH = 'data: {"id":"gen-1","choices":[{"index":0,"delta":{},"finish_reason":"stop"}],"usage":{"completion_tokens":2}}\n\n'
+
+
+def test_finish_chunk_in_its_own_read_is_relayed(monkeypatch):
+    upstream_reads(monkeypatch, [chunk("one ") + chunk("two "), FINISH, "data: [DONE]\n\n"])
+    stats = {}
+    items = asyncio.run(collect(server.stream_openrouter_passthrough([], stats=stats)))
+    assert "".join(items) == chunk("one ") + chunk("two ") + FINISH
+    assert sum(item.tokens for item in items) == 2 and stats["done"]
+
+
+def test_rest_of_a_stream_closed_without_done_is_relayed(monkeypatch):
+    upstream_reads(monkeypatch, [chunk("one "), FINISH, 'data: {"id":"gen-1"'])
+    stats = {}
+    items = asyncio.run(collect(server.stream_openrouter_passthrough([], stats=stats)))
+    assert "".join(items) == chunk("one ") + FINISH + 'data: {"id":"gen-1"\n\n'
+    assert "done" not in stats
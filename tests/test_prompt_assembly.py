@@ -0,0 +1,23 @@
+import json
+
+from server import assemble_prompt
+
+
+def test_system_prefix_is_byte_identical_across_turns():
+    first = assemble_prompt([{"role": "user", "content": "hi"}], "hindi")
+    later = assemble_prompt([{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"},
+                             {"role": "user", "content": "more"}], "hindi")
+    assert first[0]["role"] == "system"
+    assert json.dumps(first[:2]) == json.dumps(later[:2])
+
+
+def test_prefix_depends_on_language_and_persona():
+    assert "Hindi" in assemble_prompt([], "hindi")[0]["content"]
+    assert assemble_prompt([], "hindi")[0] != assemble_prompt([], "french")[0]
+    # Unknown values fall back instead of producing a new prefix per typo
+    assert assemble_prompt([], "klingon", "pirate")[0] == assemble_prompt([], None)[0]
+
+
+def test_client_only_fields_are_dropped():
+    prompt = assemble_prompt([{"id": "1", "role": "user", "content": "hi", "timestamp": "2024-01-01"}])
+    assert prompt[1] == {"role": "user", "content": "hi"}
@@ -0,0 +1,67 @@
+import asyncio
+
+import server
+from server import ResponseCache, cache_key, collect_response
+
+
+def test_lru_eviction_by_bytes():
+    cache = ResponseCache(max_bytes=10, ttl=60)
+    cache.put("a", ["aaaa"])
+    cache.put("b", ["bbbb"])
+    assert cache.get("a") == ["aaaa"]
+    cache.put("c", ["cccc"])
+    assert cache.get("b") is None
+    assert cache.get("a") == ["aaaa"] and cache.get("c") == ["cccc"]
+    assert cache.bytes == 8
+
+
+def test_oversized_entry_is_not_stored():
+    cache = ResponseCache(max_bytes=4, ttl=60)
+    cache.put("a", ["too long"])
+    assert cache.get("a") is None and cache.bytes == 0
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(max_bytes=100, ttl=5)
+    cache.put("a", ["x"])
+    now[0] += 4
+    assert cache.get("a") == ["x"]
+    now[0] += 2
+    assert cache.get("a") is None and cache.bytes == 0
+
+
+def test_cache_key_ignores_ui_fields_and_whitespace():
+    a = cache_key([{"role": "user", "content": "hi  there", "id": "1"}], "ollama", "m", 0, 100)
+    b = cache_key([{"role": "user", "content": " hi there ", "timestamp": "t"}], "ollama", "m", 0, 100)
+    assert a == b
+    assert a != cache_key([{"role": "user", "content": "hi there"}], "ollama", "m", 0.7, 100)
+
+
+async def upstream(chunks, stats, done):
+    for chunk in chunks:
+        yield chunk
+    if done:
+        stats["done"] = True
+
+
+def collect(chunks, done):
+    stored = []
+    stats = {}
+
+    async def run():
+        return [c async for c in collect_response(upstream(chunks, stats, done), [stored.append], stats)]
+
+    assert asyncio.run(run()) == chunks
+    return stored
+
+
+def test_only_completed_answers_are_stored():
+    assert collect(["a", "b"], done=True) == [["a", "b"]]
+    assert collect(["a", "b"], done=False) == []
+
+
+def test_empty_answers_are_not_stored():
+    assert collect([], done=True) == []
+    assert collect(["", " "], done=True) == []
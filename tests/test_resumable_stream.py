@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+import server
+from server import ResumableStream
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(server, "resumable_streams", {})
+
+
+def body(events, count=5, delay=0.0):
+    async def frames():
+        try:
+            for i in range(count):
+                if delay:
+                    await asyncio.sleep(delay)
+                yield f"data: {i}\n\n"
+        finally:
+            events.append("body closed")
+
+    return frames()
+
+
+def test_frames_are_numbered_and_a_resume_replays_after_the_last_seen_id():
+    async def scenario():
+        stream = ResumableStream("s", body([]), grace=1)
+        frames, _ = stream.listen()
+        first = [await frames.__anext__() for _ in range(2)]
+        await frames.aclose()
+        resumed, _ = stream.listen(2)
+        return first, [frame async for frame in resumed]
+
+    first, rest = asyncio.run(scenario())
+    assert first == ["id: 1\ndata: 0\n\n", "id: 2\ndata: 1\n\n"]
+    assert rest == ["id: 3\ndata: 2\n\n", "id: 4\ndata: 3\n\n", "id: 5\ndata: 4\n\n"]
+
+
+def test_generation_continues_after_disconnect_and_stops_after_grace():
+    async def scenario():
+        events = []
+        stream = ResumableStream("s", body(events, count=1000, delay=0.005), on_close=lambda: events.append("closed"), grace=0.05)
+        _, leave = stream.listen()
+        await asyncio.sleep(0.02)
+        leave()
+        await asyncio.sleep(0.02)
+        assert not events and stream.last_id > 2
+        await asyncio.sleep(0.1)
+        return events, stream.done
+
+    events, done = asyncio.run(scenario())
+    assert events == ["body closed", "closed"] and done
+
+
+def test_finished_stream_is_kept_for_grace_then_dropped():
+    async def scenario():
+        stream = ResumableStream("s", body([]), grace=0.02)
+        server.resumable_streams["s"] = stream
+        frames, _ = stream.listen()
+        assert len([f async for f in frames]) == 5
+        assert "s" in server.resumable_streams
+        await asyncio.sleep(0.05)
+        return "s" in server.resumable_streams
+
+    assert not asyncio.run(scenario())
+
+
+def test_resume_is_refused_once_events_left_the_ring_buffer():
+    async def scenario():
+        stream = ResumableStream("s", body([], count=10), grace=1, max_events=4)
+        frames, _ = stream.listen()
+        [f async for f in frames]
+        return [stream.can_resume(i) for i in (0, 5, 6, 10, 11)]
+
+    assert asyncio.run(scenario()) == [False, False, True, True, False]
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import server
+from server import BackendBusy, BackendHealth
+
+
+@pytest.fixture(autouse=True)
+def fresh_health(monkeypatch):
+    monkeypatch.setattr(server, "backend_health",
+                        {"ollama": BackendHealth("ollama"), "openrouter": BackendHealth("openrouter")})
+    monkeypatch.setattr(server, "status_probers", {})
+    monkeypatch.setattr(server, "ROUTER_POLICY", "requested")
+    monkeypatch.setattr(server, "ROUTER_FAILOVER", True)
+
+
+def test_requested_backend_comes_first():
+    assert server.route_candidates("openrouter") == [("openrouter", "requested"), ("ollama", "failover:error")]
+
+
+def test_unhealthy_backend_is_moved_behind_healthy_one():
+    for _ in range(10):
+        server.backend_health["ollama"].record_result(ok=False)
+    assert server.route_candidates("ollama") == [("openrouter", "failover:unhealthy"), ("ollama", "failover:error")]
+
+
+def test_unhealthy_backend_is_not_a_failover_target():
+    for _ in range(10):
+        server.backend_health["openrouter"].record_result(ok=False)
+    assert server.route_candidates("ollama") == [("ollama", "requested")]
+
+
+def test_failover_when_first_backend_errors_before_first_token(monkeypatch):
+    async def failing():
+        raise RuntimeError("boom")
+        yield
+
+    async def working():
+        yield "hello"
+
+    def open_backend(backend, messages, params, stats, continuation=None, deadlines=None, user=None):
+        return (failing() if backend == "ollama" else working()), None
+
+    monkeypatch.setattr(server, "open_backend", open_backend)
+
+    async def run():
+        generation = await server.start_generation([], "ollama", {})
+        return generation, [t async for t in generation.tokens]
+
+    generation, tokens = asyncio.run(run())
+    assert generation.backend == "openrouter"
+    assert tokens == ["hello"]
+    assert server.backend_health["ollama"].failures == 1
+
+
+def test_busy_is_reported_when_failover_also_fails(monkeypatch):
+    async def failing():
+        raise RuntimeError("unreachable")
+        yield
+
+    def open_backend(backend, messages, params, stats, continuation=None, deadlines=None, user=None):
+        if backend == "ollama":
+            raise BackendBusy("busy", retry_after=7)
+        return failing(), None
+
+    monkeypatch.setattr(server, "open_backend", open_backend)
+    with pytest.raises(BackendBusy) as excinfo:
+        asyncio.run(server.start_generation([], "ollama", {}))
+    assert excinfo.value.retry_after == 7
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+import server
+from server import SemanticIndex
+
+
+@pytest.fixture(params=["numpy", "pure-python"])
+def backend(request, monkeypatch):
+    if request.param == "pure-python":
+        monkeypatch.setattr(server, "np", None)
+    return request.param
+
+
+def test_search_is_scoped_and_thresholded(tmp_path, backend):
+    index = SemanticIndex(str(tmp_path / "idx"), capacity=4)
+    index.add("en", [1, 0, 0], "english")
+    index.add("hi", [1, 0, 0], "hindi")
+    assert index.search("en", [0.9, 0.1, 0], 0.9) == "english"
+    assert index.search("hi", [0.9, 0.1, 0], 0.9) == "hindi"
+    assert index.search("en", [0.5, 0.5, 0], 0.9) is None
+    assert index.search("ar", [1, 0, 0], 0.9) is None
+    index.close()
+
+
+def test_full_index_overwrites_oldest_slot(tmp_path):
+    index = SemanticIndex(str(tmp_path / "idx"), capacity=2)
+    index.add("en", [1, 0], "a")
+    index.add("en", [0, 1], "b")
+    index.add("en", [1, 0.01], "c")
+    assert index.search("en", [1, 0], 0.9) == "c"
+    assert len(index.slots) == 2
+    index.close()
+
+
+def test_reload_restores_entries(tmp_path):
+    path = str(tmp_path / "idx")
+    index = SemanticIndex(path, capacity=3)
+    for i in range(8):  # wraps around and triggers compaction
+        index.add("en", [1, i, 0], f"answer {i}")
+    index.close()
+
+    reloaded = SemanticIndex(path, capacity=3)
+    assert reloaded.snapshot()["entries"] == 3
+    assert reloaded.search("en", [1, 7, 0], 0.99) == "answer 7"
+    assert reloaded.seq == 8
+    reloaded.close()
+
+
+def test_missing_vector_file_resets_to_empty(tmp_path):
+    path = str(tmp_path / "idx")
+    index = SemanticIndex(path, capacity=3)
+    index.add("en", [1, 0], "a")
+    index.close()
+    os.remove(path + ".vec")
+
+    reloaded = SemanticIndex(path, capacity=3)
+    assert reloaded.snapshot()["entries"] == 0
+    assert os.path.getsize(path + ".jsonl") == 0
+    reloaded.add("en", [1, 0], "b")
+    assert reloaded.search("en", [1, 0], 0.9) == "b"
+    reloaded.close()
+
+
+def test_capacity_change_resets(tmp_path):
+    path = str(tmp_path / "idx")
+    index = SemanticIndex(path, capacity=3)
+    index.add("en", [1, 0], "a")
+    index.close()
+    assert SemanticIndex(path, capacity=5).snapshot()["entries"] == 0
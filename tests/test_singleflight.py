@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from server import Generation, SharedGeneration, Singleflight
+
+
+def upstream(events, gate=None, error=None):
+    async def tokens():
+        try:
+            yield {"queue": {"position": 1}}
+            for i in range(3):
+                if gate is not None:
+                    await gate.wait()
+                yield f"tok{i} "
+            if error is not None:
+                raise error
+        finally:
+            events.append("upstream closed")
+
+    return Generation(tokens(), "ollama", "requested", {}, lambda: events.append("slot released"))
+
+
+async def drain(subscriber):
+    return [item async for item in subscriber]
+
+
+def test_late_joiner_replays_text_and_both_get_the_whole_answer():
+    async def scenario():
+        events = []
+        gate = asyncio.Event()
+        shared = SharedGeneration(upstream(events, gate))
+        first = asyncio.ensure_future(drain(shared.subscribe()[0]))
+        await asyncio.sleep(0.01)
+        late = asyncio.ensure_future(drain(shared.subscribe()[0]))
+        gate.set()
+        return await first, await late, events
+
+    first, late, events = asyncio.run(scenario())
+    assert first == [{"queue": {"position": 1}}, "tok0 ", "tok1 ", "tok2 "]
+    assert late == ["tok0 ", "tok1 ", "tok2 "]
+    assert events == ["upstream closed", "slot released"]
+
+
+def test_one_subscriber_leaving_does_not_stop_the_generation():
+    async def scenario():
+        events = []
+        gate = asyncio.Event()
+        shared = SharedGeneration(upstream(events, gate))
+        (leaving, _), (staying, _) = shared.subscribe(), shared.subscribe()
+        await leaving.__anext__()
+        await leaving.aclose()
+        gate.set()
+        return await drain(staying), events
+
+    items, events = asyncio.run(scenario())
+    assert items[-1] == "tok2 " and events == ["upstream closed", "slot released"]
+
+
+def test_last_subscriber_leaving_stops_upstream_and_closes_the_key():
+    async def scenario():
+        events = []
+        closed = []
+        shared = SharedGeneration(upstream(events, asyncio.Event()), on_closed=lambda: closed.append(True))
+        subscriber, _ = shared.subscribe()
+        await subscriber.__anext__()
+        await subscriber.aclose()
+        await asyncio.sleep(0)
+        return events, closed
+
+    events, closed = asyncio.run(scenario())
+    assert events == ["upstream closed", "slot released"] and closed == [True]
+
+
+def test_response_that_never_started_can_still_leave():
+    async def scenario():
+        events = []
+        shared = SharedGeneration(upstream(events, asyncio.Event()))
+        _, leave = shared.subscribe()
+        leave()
+        leave()
+        await asyncio.sleep(0.01)
+        return events, shared.subscribers
+
+    events, subscribers = asyncio.run(scenario())
+    assert events[-1] == "slot released" and subscribers == 0
+
+
+def test_errors_reach_every_subscriber():
+    async def scenario():
+        shared = SharedGeneration(upstream([], error=RuntimeError("boom")))
+        results = await asyncio.gather(drain(shared.subscribe()[0]), drain(shared.subscribe()[0]), return_exceptions=True)
+        return results
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(scenario()))
+
+
+def test_identical_requests_open_one_generation():
+    async def scenario():
+        group = Singleflight()
+        events = []
+        opened = []
+
+        async def open_generation():
+            opened.append(True)
+            await asyncio.sleep(0.01)
+            return upstream(events)
+
+        (a, a_joined), (b, b_joined) = await asyncio.gather(group.join("k", open_generation), group.join("k", open_generation))
+        assert a is b and (a_joined, b_joined) == (False, True)
+        await drain(a.subscribe()[0])
+        assert not group.inflight
+        c, _ = await group.join("k", open_generation)
+        await drain(c.subscribe()[0])
+        return opened
+
+    assert len(asyncio.run(scenario())) == 2
+
+
+def test_failure_to_open_reaches_all_waiters_and_is_not_remembered():
+    async def scenario():
+        group = Singleflight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("busy")
+
+        results = await asyncio.gather(group.join("k", failing), group.join("k", failing), return_exceptions=True)
+        return results, group.inflight
+
+    results, inflight = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results) and not inflight
+
+
+def test_opening_stops_once_every_waiter_is_cancelled():
+    async def scenario():
+        group = Singleflight()
+        events = []
+
+        async def open_generation():
+            try:
+                await asyncio.sleep(1)
+            finally:
+                events.append("opening stopped")
+            return upstream(events)
+
+        first = asyncio.ensure_future(group.join("k", open_generation))
+        second = asyncio.ensure_future(group.join("k", open_generation))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not events and group.inflight
+        second.cancel()
+        await asyncio.sleep(0.01)
+        return events, group.inflight, group.waiters
+
+    events, inflight, waiters = asyncio.run(scenario())
+    assert events == ["opening stopped"] and not inflight and not waiters
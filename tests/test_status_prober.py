@@ -0,0 +1,52 @@
+import asyncio
+
+from server import StatusProber
+
+
+def test_concurrent_refreshes_share_one_probe():
+    calls = []
+
+    async def probe():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"status": "online", "message": "ok"}
+
+    async def run():
+        prober = StatusProber("test", probe, interval=60)
+        return await asyncio.gather(*(prober.get() for _ in range(10)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(r["status"] == "online" and "age" in r for r in results)
+
+
+def test_fresh_snapshot_is_served_from_cache():
+    calls = []
+
+    async def probe():
+        calls.append(1)
+        return {"status": "online", "message": "ok"}
+
+    async def run():
+        prober = StatusProber("test", probe, interval=60)
+        await prober.get()
+        await prober.get()
+
+    asyncio.run(run())
+    assert len(calls) == 1
+
+
+def test_cancelled_caller_does_not_cancel_shared_probe():
+    async def probe():
+        await asyncio.sleep(0.05)
+        return {"status": "online", "message": "ok"}
+
+    async def run():
+        prober = StatusProber("test", probe, interval=60)
+        first = asyncio.ensure_future(prober.get())
+        second = asyncio.ensure_future(prober.get())
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run())["status"] == "online"
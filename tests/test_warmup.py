@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+from server import WarmupManager, metrics
+
+
+def manager():
+    return WarmupManager(["llama3.2"], "10m", interval=60, active_window=600, cold_load_ms=500)
+
+
+def test_concurrent_warmups_share_one_load():
+    calls = []
+
+    async def load(model):
+        calls.append(model)
+        await asyncio.sleep(0.05)
+        return 1200.0
+
+    async def run():
+        warmup = manager()
+
+        async def fake_load(model):
+            try:
+                return await load(model)
+            finally:
+                del warmup._inflight[model]
+
+        warmup._load = fake_load
+        results = await asyncio.gather(*(warmup.warm("llama3.2") for _ in range(5)))
+        assert not warmup._inflight
+        return results
+
+    assert asyncio.run(run()) == [1200.0] * 5
+    assert calls == ["llama3.2"]
+
+
+def test_ttft_is_split_by_model_load():
+    warmup = manager()
+    cold_before = metrics["ollama_cold_starts"]
+    warmup.record_ttft(4.0, load_ms=3500)
+    warmup.record_ttft(0.2, load_ms=20)
+    warmup.record_ttft(0.3, load_ms=0)
+    snapshot = warmup.snapshot()
+    assert snapshot["ttft_cold"]["count"] == 1 and snapshot["ttft_cold"]["p50"] == 4.0
+    assert snapshot["ttft_warm"]["count"] == 2
+    assert metrics["ollama_cold_starts"] == cold_before + 1
+
+
+def test_keepalive_survives_a_failed_preload():
+    async def run():
+        warmup = WarmupManager(["llama3.2"], "10m", interval=0.04, active_window=600, cold_load_ms=500)
+        attempts = []
+
+        async def load(model):
+            attempts.append(model)
+            try:
+                raise ConnectionError("Ollama is down")
+            finally:
+                del warmup._inflight[model]
+
+        warmup._load = load
+        task = asyncio.ensure_future(warmup.run_forever())
+        await asyncio.sleep(0.02)
+        assert attempts == ["llama3.2"] and warmup.last_request is None
+        # What POST /api/warmup does
+        warmup.last_activity = time.monotonic()
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        task.cancel()
+        return attempts
+
+    assert len(asyncio.run(run())) >= 3